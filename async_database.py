@@ -0,0 +1,157 @@
+"""
+Асинхронный фасад над Database для обработчиков бота
+"""
+
+import asyncio
+import contextvars
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional, Union
+
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+
+class _Job:
+    """Вызов метода Database в рабочем потоке, который можно прервать"""
+
+    def __init__(self, pool, func: Callable, args, kwargs):
+        self.pool = pool
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self._lock = threading.Lock()
+        self._thread_id = None
+
+    def __call__(self):
+        with self._lock:
+            self._thread_id = threading.get_ident()
+        try:
+            return self.func(*self.args, **self.kwargs)
+        finally:
+            with self._lock:
+                self._thread_id = None
+
+    def interrupt(self) -> bool:
+        """Прерывание SQL-запроса, если задача уже выполняется"""
+        with self._lock:
+            if self._thread_id is None:
+                return False
+            return self.pool.interrupt(self._thread_id)
+
+
+def _mirror(name: str):
+    """Создание асинхронной версии метода Database с тем же именем"""
+    async def method(self, *args, **kwargs):
+        return await self.run(getattr(self.sync, name), *args, **kwargs)
+
+    method.__name__ = name
+    method.__qualname__ = f"AsyncDatabase.{name}"
+    method.__doc__ = getattr(Database, name).__doc__
+    return method
+
+
+class AsyncDatabase:
+    """
+    Асинхронная версия Database: те же методы, но в виде корутин.
+    Запросы выполняются в выделенных рабочих потоках на соединениях из пула,
+    поэтому цикл событий бота не блокируется на время обращения к SQLite.
+    Отмена корутины снимает задачу из очереди или прерывает уже идущий запрос.
+    """
+
+    def __init__(self, db: Union[Database, str], workers: int = 2):
+        if isinstance(db, str):
+            db = Database(db, pool_size=workers)
+        self.sync = db
+        self.db_path = db.db_path
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='db-worker')
+
+    async def run(self, func: Callable, *args, **kwargs):
+        """Выполнение произвольной функции в рабочем потоке базы данных"""
+        # Контекст (текущий span трассировки) переходит в рабочий поток
+        context = contextvars.copy_context()
+        job = _Job(self.sync.pool, context.run, (func,) + args, kwargs)
+        future = self._executor.submit(job)
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            # Задача из очереди снимается сама, а уже идущий запрос прерываем
+            if not future.cancelled() and job.interrupt():
+                logger.info(f"Запрос {getattr(func, '__name__', func)} прерван из-за отмены")
+            raise
+
+    async def add_user(self, telegram_id: int, full_name: str, email: str, phone: str, birth_date: str):
+        """Добавление нового пользователя"""
+        # В режиме отложенной записи ждем Future группового коммита, не занимая рабочий поток
+        if self.sync.writer:
+            return await asyncio.wrap_future(
+                self.sync.submit_add_user(telegram_id, full_name, email, phone, birth_date)
+            )
+        return await self.run(self.sync.add_user, telegram_id, full_name, email, phone, birth_date)
+
+    add_users_bulk = _mirror('add_users_bulk')
+    get_user_by_telegram_id = _mirror('get_user_by_telegram_id')
+    update_user = _mirror('update_user')
+    add_event = _mirror('add_event')
+    get_event = _mirror('get_event')
+    set_event_capacity = _mirror('set_event_capacity')
+    get_remaining_seats = _mirror('get_remaining_seats')
+    get_all_events = _mirror('get_all_events')
+    get_events_page = _mirror('get_events_page')
+    get_upcoming_events_page = _mirror('get_upcoming_events_page')
+
+    async def register_user_for_event(self, user_id: int, event_id: int):
+        """Регистрация пользователя на мероприятие"""
+        if self.sync.writer:
+            return await asyncio.wrap_future(self.sync.submit_register_user_for_event(user_id, event_id))
+        return await self.run(self.sync.register_user_for_event, user_id, event_id)
+
+    async def reserve_seat(self, user_id: int, event_id: int):
+        """Запись на мероприятие с учетом числа мест (статус и ID регистрации)"""
+        if self.sync.writer:
+            return await asyncio.wrap_future(self.sync.submit_reserve_seat(user_id, event_id))
+        return await self.run(self.sync.reserve_seat, user_id, event_id)
+
+    cancel_registration = _mirror('cancel_registration')
+    join_waitlist = _mirror('join_waitlist')
+    leave_waitlist = _mirror('leave_waitlist')
+    confirm_waitlist_offer = _mirror('confirm_waitlist_offer')
+    expire_waitlist_offers = _mirror('expire_waitlist_offers')
+    claim_waitlist_offers = _mirror('claim_waitlist_offers')
+    register_users_for_event_bulk = _mirror('register_users_for_event_bulk')
+    get_user_registrations = _mirror('get_user_registrations')
+    get_event_registrations = _mirror('get_event_registrations')
+    get_event_registrations_page = _mirror('get_event_registrations_page')
+    export_event_registrations = _mirror('export_event_registrations')
+    get_registration_stats = _mirror('get_registration_stats')
+    get_event_registration_count = _mirror('get_event_registration_count')
+    rebuild_stats_counters = _mirror('rebuild_stats_counters')
+    get_conversation_states = _mirror('get_conversation_states')
+    count_conversation_states = _mirror('count_conversation_states')
+    get_user_data = _mirror('get_user_data')
+    save_conversation_state = _mirror('save_conversation_state')
+    purge_stale_conversation_state = _mirror('purge_stale_conversation_state')
+    create_broadcast = _mirror('create_broadcast')
+    get_broadcast = _mirror('get_broadcast')
+    get_active_broadcasts = _mirror('get_active_broadcasts')
+    save_broadcast_progress = _mirror('save_broadcast_progress')
+
+    def get_pool_stats(self) -> Dict:
+        """Статистика пула соединений"""
+        return self.sync.get_pool_stats()
+
+    def get_writer_stats(self) -> Optional[Dict]:
+        """Статистика групповых коммитов"""
+        return self.sync.get_writer_stats()
+
+    def get_cache_stats(self) -> Optional[Dict]:
+        """Статистика кэша пользователей"""
+        return self.sync.get_cache_stats()
+
+    def close(self):
+        """Остановка рабочих потоков и закрытие соединений"""
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self.sync.close()
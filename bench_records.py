@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Сравнение расхода памяти и времени чтения строк в словари и в компактные записи
+"""
+
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from records import UserRecord
+
+ROWS = 100_000
+COLUMNS = ['id', 'telegram_id', 'full_name', 'email', 'phone', 'birth_date', 'registration_date']
+QUERY = 'SELECT id, telegram_id, full_name, email, phone, birth_date, registration_date FROM users'
+
+
+def create_database(path: str):
+    """Создание тестовой базы с ROWS пользователями"""
+    conn = sqlite3.connect(path)
+    conn.execute('''
+        CREATE TABLE users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            telegram_id INTEGER UNIQUE NOT NULL,
+            full_name TEXT NOT NULL,
+            email TEXT NOT NULL,
+            phone TEXT NOT NULL,
+            birth_date TEXT NOT NULL,
+            registration_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.executemany(
+        'INSERT INTO users (telegram_id, full_name, email, phone, birth_date) VALUES (?, ?, ?, ?, ?)',
+        ((i, f"Пользователь {i}", f"user{i}@example.com", "+79991234567", "01.01.1990") for i in range(ROWS))
+    )
+    conn.commit()
+    conn.close()
+
+
+def read_dicts(conn):
+    """Прежний способ: словарь на каждую строку"""
+    return [dict(zip(COLUMNS, row)) for row in conn.execute(QUERY).fetchall()]
+
+
+def read_records(conn):
+    """Записи, создаваемые фабрикой строк"""
+    cursor = conn.cursor()
+    cursor.row_factory = UserRecord.row_factory
+    return cursor.execute(QUERY).fetchall()
+
+
+def measure(conn, reader):
+    """Время чтения и пиковый прирост памяти (tracemalloc замедляет код, поэтому отдельно)"""
+    started = time.perf_counter()
+    rows = reader(conn)
+    elapsed = time.perf_counter() - started
+    assert len(rows) == ROWS
+    del rows
+
+    tracemalloc.start()
+    reader(conn)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.db')
+        create_database(path)
+        conn = sqlite3.connect(path)
+
+        # Прогрев кэша страниц SQLite
+        read_dicts(conn)
+
+        results = {}
+        for name, reader in (('dict', read_dicts), ('records', read_records)):
+            timings = [measure(conn, reader) for _ in range(3)]
+            results[name] = min(timings)
+        conn.close()
+
+    print(f"Чтение {ROWS} строк:")
+    for name, (elapsed, peak) in results.items():
+        print(f"  {name:8} время: {elapsed * 1000:8.1f} мс   пик памяти: {peak / 1024 / 1024:7.1f} МБ")
+
+    dict_time, dict_peak = results['dict']
+    record_time, record_peak = results['records']
+    print(f"Экономия: время x{dict_time / record_time:.2f}, память x{dict_peak / record_peak:.2f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -5,12 +5,34 @@
 Telegram-бот для регистрации на мероприятия
 """
 
+# Отсчет времени запуска начинается до импорта остальных модулей
+from startup import STARTUP
+
 import logging
 import asyncio
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ConversationHandler
-from config import TELEGRAM_BOT_TOKEN
+from telegram.ext import (Application, CommandHandler, MessageHandler, CallbackQueryHandler,
+                          filters, ConversationHandler)
+from config import (
+    TELEGRAM_BOT_TOKEN, DB_WORKERS, USER_CACHE_SIZE, USER_CACHE_TTL, EVENT_CACHE_SIZE, EVENT_CACHE_TTL,
+    WAITLIST_HOLD_MINUTES,
+    WRITE_BEHIND, WRITE_BATCH_SIZE, WRITE_MAX_DELAY_MS, UPDATE_CONCURRENCY,
+    PERSISTENCE_INTERVAL, CONVERSATION_MAX_AGE_HOURS,
+    SEND_GLOBAL_RATE, SEND_CHAT_RATE, SEND_MAX_RETRIES,
+    BOT_MODE, WEBHOOK_URL, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH,
+    WEBHOOK_SECRET_TOKEN, WEBHOOK_MAX_BACKLOG, WEBHOOK_CERT, WEBHOOK_KEY,
+    DATABASE_PATH, WORKER_PROCESSES, PID_FILE, READY_FILE, DRAIN_TIMEOUT,
+    METRICS_PORT, METRICS_HOST, TRACE_SAMPLE_RATE, TRACE_FILE, TRACE_BUFFER_SIZE, STARTUP_BUDGET
+)
 from database import Database
-from registration import RegistrationHandler
+from async_database import AsyncDatabase
+from registration import RegistrationHandler, EVENTS_CALLBACK_PATTERN
+from waitlist import WAITLIST_CALLBACK_PATTERN
+from dispatcher import PerUserUpdateProcessor
+from persistence import SQLitePersistence
+from scheduler import SendScheduler
+from handover import InstanceLock, serve_polling, mark_ready, clear_ready
+from metrics import CONVERSATIONS, start_metrics_server
+from tracing import TRACER, TracedRequest, RingBufferExporter, JSONFileExporter
 from constants import NAME, EMAIL, PHONE, BIRTH_DATE, CONFIRM
 
 # Настройка логирования
@@ -19,16 +41,88 @@ logging.basicConfig(
     level=logging.INFO
 )
 logger = logging.getLogger(__name__)
+STARTUP.mark("импорт модулей")
 
-def main():
-    # Инициализация базы данных
-    db = Database("registrations.db")
+def create_database() -> AsyncDatabase:
+    """Подключение к базе данных с настройками из config.py"""
+    return AsyncDatabase(
+        Database(DATABASE_PATH, pool_size=DB_WORKERS,
+                 user_cache_size=USER_CACHE_SIZE, user_cache_ttl=USER_CACHE_TTL,
+                 event_cache_size=EVENT_CACHE_SIZE, event_cache_ttl=EVENT_CACHE_TTL,
+                 waitlist_hold=WAITLIST_HOLD_MINUTES * 60,
+                 write_behind=WRITE_BEHIND, write_batch_size=WRITE_BATCH_SIZE,
+                 write_max_delay=WRITE_MAX_DELAY_MS / 1000),
+        workers=DB_WORKERS
+    )
+
+# Названия шагов регистрации для метрик
+STATE_NAMES = {NAME: 'NAME', EMAIL: 'EMAIL', PHONE: 'PHONE', BIRTH_DATE: 'BIRTH_DATE', CONFIRM: 'CONFIRM'}
+
+def start_metrics(db: AsyncDatabase, port: int = METRICS_PORT):
+    """
+    Запуск HTTP-сервера метрик, если он включен в config.py.
+    Число диалогов по шагам считается по сохраненным состояниям при каждом запросе.
+    """
+    if not port:
+        return None
+    
+    def conversations():
+        counts = db.sync.count_conversation_states('registration')
+        return {(STATE_NAMES.get(state, str(state)),): count for state, count in counts.items()}
     
+    CONVERSATIONS.set_function(conversations)
+    return start_metrics_server(port, METRICS_HOST)
+
+def configure_tracing():
+    """Трассировка обновлений с параметрами из config.py"""
+    exporters = [RingBufferExporter(TRACE_BUFFER_SIZE)]
+    if TRACE_FILE:
+        exporters.append(JSONFileExporter(TRACE_FILE))
+    TRACER.configure(TRACE_SAMPLE_RATE, exporters)
+
+def build_application(db: AsyncDatabase, worker_count: int = 0,
+                      resume_broadcasts: bool = True) -> Application:
+    """
+    Создание приложения со всеми обработчиками.
+    worker_count > 0 - приложение рабочего процесса: обновления приходят от
+    супервизора, а общий лимит отправки делится между worker_count процессами.
+    resume_broadcasts=False - незавершенные рассылки продолжает другой процесс;
+    лист ожидания обрабатывается в каждом процессе.
+    """
     # Создание экземпляра RegistrationHandler
     reg_handler = RegistrationHandler(db)
     
-    # Создание приложения
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+    # Шаги регистрации сохраняются в той же базе и переживают перезапуск
+    persistence = SQLitePersistence(db, update_interval=PERSISTENCE_INTERVAL,
+                                    max_age=CONVERSATION_MAX_AGE_HOURS * 3600)
+    
+    # Исходящие сообщения проходят через планировщик с учетом лимитов Telegram
+    scheduler = SendScheduler(global_rate=SEND_GLOBAL_RATE / max(worker_count, 1),
+                              chat_rate=SEND_CHAT_RATE, max_retries=SEND_MAX_RETRIES)
+    
+    # Создание приложения; обновления разных пользователей обрабатываются параллельно.
+    # Вызовы API (кроме getUpdates) записываются в трассы обновлений
+    configure_tracing()
+    builder = (Application.builder().token(TELEGRAM_BOT_TOKEN)
+               .persistence(persistence).rate_limiter(scheduler)
+               .request(TracedRequest(connection_pool_size=256)))
+    if UPDATE_CONCURRENCY > 1:
+        builder = builder.concurrent_updates(PerUserUpdateProcessor(UPDATE_CONCURRENCY))
+    if worker_count:
+        builder = builder.updater(None)
+    # Незавершенные рассылки продолжаются после запуска, лист ожидания
+    # обрабатывается в фоне; обе задачи останавливаются вместе с ботом
+    async def post_init(app: Application):
+        if resume_broadcasts:
+            await reg_handler.broadcaster.resume(app.bot)
+        reg_handler.waitlist.start(app.bot)
+    
+    async def post_stop(app: Application):
+        await reg_handler.broadcaster.stop()
+        await reg_handler.waitlist.stop()
+    
+    builder = builder.post_init(post_init).post_stop(post_stop)
+    application = builder.build()
     
     # Создание ConversationHandler для регистрации
     conv_handler = ConversationHandler(
@@ -36,27 +130,87 @@ def main():
         states={
             NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, reg_handler.get_name)],
             EMAIL: [MessageHandler(filters.TEXT & ~filters.COMMAND, reg_handler.get_email)],
-            PHONE: [MessageHandler(filters.TEXT & ~filters.COMMAND, reg_handler.get_phone)],
+            PHONE: [MessageHandler(filters.TEXT & ~filters.COMMAND, reg_handler.get_phone),
+                    MessageHandler(filters.CONTACT, reg_handler.get_contact)],
             BIRTH_DATE: [MessageHandler(filters.TEXT & ~filters.COMMAND, reg_handler.get_birth_date)],
             CONFIRM: [MessageHandler(filters.TEXT & ~filters.COMMAND, reg_handler.confirm_registration)]
         },
-        fallbacks=[CommandHandler('cancel', reg_handler.cancel_registration)]
+        fallbacks=[CommandHandler('cancel', reg_handler.cancel_registration)],
+        name='registration',
+        persistent=True
     )
     
     # Добавление обработчиков команд
     application.add_handler(CommandHandler("start", reg_handler.start_command))
     application.add_handler(CommandHandler("help", reg_handler.help_command))
     application.add_handler(CommandHandler("my_info", reg_handler.my_info_command))
+    application.add_handler(CommandHandler("events", reg_handler.events_command))
+    application.add_handler(CallbackQueryHandler(reg_handler.events_callback, pattern=EVENTS_CALLBACK_PATTERN))
+    application.add_handler(CallbackQueryHandler(reg_handler.waitlist_callback, pattern=WAITLIST_CALLBACK_PATTERN))
+    application.add_handler(CommandHandler("unregister", reg_handler.unregister_command))
     application.add_handler(CommandHandler("admin", reg_handler.admin_command))
     application.add_handler(CommandHandler("stats", reg_handler.stats_command))
+    application.add_handler(CommandHandler("rebuild_stats", reg_handler.rebuild_stats_command))
+    application.add_handler(CommandHandler("export", reg_handler.export_command))
+    application.add_handler(CommandHandler("broadcast", reg_handler.broadcast_command))
+    application.add_handler(CommandHandler("profile", reg_handler.profile_command))
+    application.add_handler(CommandHandler("capacity", reg_handler.capacity_command))
     application.add_handler(CommandHandler("new_event", reg_handler.new_event_command))
     
     # Добавление ConversationHandler в приложение
     application.add_handler(conv_handler)
+    return application
+
+def main():
+    # Активный экземпляр держит блокировку PID-файла; новый экземпляр (restart_bot.py)
+    # прогревается, отмечает готовность и ждет, пока старый доработает и выйдет
+    lock = InstanceLock(PID_FILE)
+    
+    # Несколько рабочих процессов: обновления распределяет супервизор
+    if WORKER_PROCESSES > 1:
+        from supervisor import Supervisor
+        mark_ready(READY_FILE)
+        lock.acquire()
+        clear_ready(READY_FILE)
+        logger.info(f"Запуск Telegram-бота: {WORKER_PROCESSES} рабочих процессов, режим {BOT_MODE}...")
+        try:
+            Supervisor(WORKER_PROCESSES).run()
+        finally:
+            lock.release()
+        return
+    
+    # Инициализация базы данных
+    db = create_database()
+    STARTUP.mark("база данных")
+    application = build_application(db)
+    start_metrics(db)
+    STARTUP.mark("создание приложения")
     
     # Запуск бота
-    logger.info("Запуск Telegram-бота...")
-    application.run_polling()
+    logger.info(f"Запуск Telegram-бота в режиме {BOT_MODE}...")
+    try:
+        if BOT_MODE == "webhook":
+            if not WEBHOOK_URL:
+                raise ValueError("Для режима webhook нужно задать WEBHOOK_URL")
+            if not WEBHOOK_SECRET_TOKEN:
+                raise ValueError("Для режима webhook нужно задать WEBHOOK_SECRET_TOKEN")
+            from webhook import run_webhook
+            STARTUP.log(STARTUP_BUDGET)
+            mark_ready(READY_FILE)
+            lock.acquire()
+            clear_ready(READY_FILE)
+            asyncio.run(run_webhook(
+                application, WEBHOOK_URL, listen=WEBHOOK_LISTEN, port=WEBHOOK_PORT,
+                url_path=WEBHOOK_PATH, secret_token=WEBHOOK_SECRET_TOKEN,
+                max_backlog=WEBHOOK_MAX_BACKLOG,
+                cert_file=WEBHOOK_CERT or None, key_file=WEBHOOK_KEY or None
+            ))
+        else:
+            asyncio.run(serve_polling(application, lock, READY_FILE, DRAIN_TIMEOUT,
+                                      startup=STARTUP, startup_budget=STARTUP_BUDGET))
+    finally:
+        db.close()
+        lock.release()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
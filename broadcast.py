@@ -0,0 +1,134 @@
+"""
+Рассылка сообщений участникам мероприятий с продолжением после перезапуска
+"""
+
+import asyncio
+import logging
+from typing import Dict, Optional
+
+from telegram import Bot
+from telegram.error import Forbidden, TelegramError
+
+from async_database import AsyncDatabase
+from records import BroadcastRecord
+from scheduler import BULK
+
+logger = logging.getLogger(__name__)
+
+# Участников на страницу: после каждой страницы прогресс сохраняется в базе
+BROADCAST_PAGE_SIZE = 100
+
+
+class Broadcaster:
+    """
+    Выполняет рассылки из таблицы broadcasts в фоновых задачах.
+    Участники читаются страницами по курсору, сообщения страницы отправляются
+    параллельно - темп задает планировщик отправки (приоритет BULK, ответы
+    пользователям идут раньше). После страницы курсор и счетчики сохраняются,
+    поэтому после сбоя рассылка продолжается со следующей страницы; повторно
+    может быть отправлена только страница, на которой произошел сбой.
+    """
+
+    def __init__(self, db: AsyncDatabase, page_size: int = BROADCAST_PAGE_SIZE):
+        self.db = db
+        self.page_size = page_size
+        self._tasks: Dict[int, asyncio.Task] = {}
+
+    def start(self, bot: Bot, broadcast_id: int) -> asyncio.Task:
+        """Запуск (или продолжение) рассылки в фоне"""
+        task = self._tasks.get(broadcast_id)
+        if task is None or task.done():
+            task = asyncio.create_task(self.run(bot, broadcast_id), name=f"broadcast:{broadcast_id}")
+            self._tasks[broadcast_id] = task
+            task.add_done_callback(lambda done: self._finished(broadcast_id, done))
+        return task
+
+    def _finished(self, broadcast_id: int, task: asyncio.Task):
+        self._tasks.pop(broadcast_id, None)
+        if not task.cancelled() and task.exception():
+            logger.error(f"Рассылка {broadcast_id} прервана с ошибкой, продолжится после перезапуска",
+                         exc_info=task.exception())
+
+    async def resume(self, bot: Bot) -> int:
+        """Продолжение незавершенных рассылок после запуска бота"""
+        broadcasts = await self.db.get_active_broadcasts()
+        for broadcast in broadcasts:
+            logger.info(f"Продолжение рассылки {broadcast.id} (доставлено {broadcast.delivered})")
+            self.start(bot, broadcast.id)
+        return len(broadcasts)
+
+    async def stop(self):
+        """Остановка рассылок; прогресс уже сохранен, при запуске они продолжатся"""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def is_running(self, broadcast_id: int) -> bool:
+        task = self._tasks.get(broadcast_id)
+        return task is not None and not task.done()
+
+    async def run(self, bot: Bot, broadcast_id: int) -> Optional[BroadcastRecord]:
+        """Выполнение рассылки до конца; возвращает итоговую запись"""
+        broadcast = await self.db.get_broadcast(broadcast_id)
+        if broadcast is None or broadcast.status != 'running':
+            return broadcast
+
+        counts = {'delivered': broadcast.delivered, 'failed': broadcast.failed, 'blocked': broadcast.blocked}
+        # rate_limit_args можно передавать, только если у бота есть планировщик отправки
+        rate_limit_args = {'priority': BULK} if getattr(bot, 'rate_limiter', None) else None
+        cursor = broadcast.cursor
+
+        while True:
+            attendees, next_cursor = await self.db.get_event_registrations_page(
+                broadcast.event_id, page_size=self.page_size, cursor=cursor
+            )
+            results = await asyncio.gather(*(
+                self._send(bot, attendee.telegram_id, broadcast.text, rate_limit_args)
+                for attendee in attendees
+            ))
+            for result in results:
+                counts[result] += 1
+
+            cursor = next_cursor
+            status = 'running' if cursor else 'completed'
+            await self.db.save_broadcast_progress(broadcast_id, cursor, status=status, **counts)
+            if not cursor:
+                break
+
+        logger.info(
+            f"Рассылка {broadcast_id} завершена: доставлено {counts['delivered']}, "
+            f"ошибок {counts['failed']}, заблокировали бота {counts['blocked']}"
+        )
+        await self._report(bot, broadcast, counts)
+        return await self.db.get_broadcast(broadcast_id)
+
+    @staticmethod
+    async def _send(bot: Bot, chat_id: int, text: str, rate_limit_args: Optional[Dict]) -> str:
+        """Отправка одного сообщения; возвращает delivered, blocked или failed"""
+        kwargs = {'rate_limit_args': rate_limit_args} if rate_limit_args else {}
+        try:
+            await bot.send_message(chat_id=chat_id, text=text, **kwargs)
+            return 'delivered'
+        except Forbidden:
+            # Пользователь заблокировал бота или удалил аккаунт
+            return 'blocked'
+        except TelegramError as exc:
+            logger.warning(f"Не удалось отправить сообщение пользователю {chat_id}: {exc}")
+            return 'failed'
+
+    @staticmethod
+    async def _report(bot: Bot, broadcast: BroadcastRecord, counts: Dict):
+        """Итоги рассылки администратору, который ее запустил"""
+        try:
+            await bot.send_message(
+                chat_id=broadcast.created_by,
+                text=(
+                    f"Рассылка #{broadcast.id} по мероприятию {broadcast.event_id} завершена.\n\n"
+                    f"Доставлено: {counts['delivered']}\n"
+                    f"Не доставлено: {counts['failed']}\n"
+                    f"Заблокировали бота: {counts['blocked']}"
+                )
+            )
+        except TelegramError as exc:
+            logger.warning(f"Не удалось отправить итоги рассылки {broadcast.id}: {exc}")
@@ -0,0 +1,97 @@
+"""
+Ограниченный кэш в памяти процесса с временем жизни записей и вытеснением LRU
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable
+
+# Признак отсутствия записи в кэше (None - допустимое закэшированное значение)
+MISSING = object()
+
+
+class TTLCache:
+    """
+    Потокобезопасный кэш: не больше maxsize записей, каждая живет ttl секунд.
+    При переполнении вытесняется запись, к которой дольше всего не обращались.
+    Значение None тоже кэшируется, что позволяет хранить отрицательные результаты.
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 60.0,
+                 clock: Callable[[], float] = time.monotonic):
+        if maxsize < 1:
+            raise ValueError("Размер кэша должен быть положительным числом")
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        # Увеличивается при каждой инвалидации (см. snapshot)
+        self._generation = 0
+        # Счетчики для подбора размера кэша
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+
+    def get(self, key: Hashable) -> Any:
+        """Значение из кэша или MISSING, если записи нет или она устарела"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self._misses += 1
+                return MISSING
+            expires_at, value = entry
+            if expires_at <= self._clock():
+                del self._data[key]
+                self._expirations += 1
+                self._misses += 1
+                return MISSING
+            self._data.move_to_end(key)
+            self._hits += 1
+            return value
+
+    def snapshot(self) -> int:
+        """
+        Метка состояния кэша перед чтением из источника данных.
+        Передается в set(), чтобы не записать значение, прочитанное до
+        параллельной инвалидации (иначе устаревшие данные прожили бы весь ttl).
+        """
+        with self._lock:
+            return self._generation
+
+    def set(self, key: Hashable, value: Any, snapshot: int = None):
+        """Запись значения в кэш"""
+        with self._lock:
+            if snapshot is not None and snapshot != self._generation:
+                return
+            self._data[key] = (self._clock() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self._evictions += 1
+
+    def invalidate(self, key: Hashable):
+        """Удаление записи из кэша"""
+        with self._lock:
+            self._data.pop(key, None)
+            self._generation += 1
+
+    def clear(self):
+        """Очистка кэша"""
+        with self._lock:
+            self._data.clear()
+            self._generation += 1
+
+    def stats(self) -> Dict:
+        """Счетчики попаданий, промахов и вытеснений"""
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'expirations': self._expirations,
+            }
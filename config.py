@@ -10,7 +10,89 @@ TELEGRAM_BOT_TOKEN = "8436269209:AAEYFDNXZmM1DZ5PlfL5_nsOYHsQvQv4Qkw"
 # Путь к базе данных
 DATABASE_PATH = os.getenv("DATABASE_PATH", "registrations.db")
 
+# Количество рабочих потоков (и соединений) для запросов к базе данных
+DB_WORKERS = int(os.getenv("DB_WORKERS", "4"))
+
+# Кэш пользователей: максимальное число записей (0 - отключить) и время жизни в секундах
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))
+
+# Кэш страниц списка мероприятий /events: число страниц (0 - отключить) и время жизни в секундах
+EVENT_CACHE_SIZE = int(os.getenv("EVENT_CACHE_SIZE", "256"))
+EVENT_CACHE_TTL = float(os.getenv("EVENT_CACHE_TTL", "300"))
+
+# Лист ожидания: сколько минут место удерживается до подтверждения и как часто
+# (в секундах) проверять истекшие предложения
+WAITLIST_HOLD_MINUTES = float(os.getenv("WAITLIST_HOLD_MINUTES", "30"))
+WAITLIST_SWEEP_SECONDS = float(os.getenv("WAITLIST_SWEEP_SECONDS", "30"))
+
+# Отложенная запись регистраций с групповыми коммитами (1 - включить)
+WRITE_BEHIND = os.getenv("WRITE_BEHIND", "0") == "1"
+# Максимальный размер пачки и время ожидания пачки в миллисекундах
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", "100"))
+WRITE_MAX_DELAY_MS = float(os.getenv("WRITE_MAX_DELAY_MS", "5"))
+
+# Число обновлений, обрабатываемых одновременно (1 - строго последовательно).
+# Обновления одного пользователя всегда обрабатываются по очереди
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "8"))
+
+# Число рабочих процессов (0 или 1 - один процесс). Обновления распределяются
+# между процессами по telegram_id, поэтому диалог пользователя всегда в одном процессе
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", "0"))
+# Через сколько секунд без сигнала о работе процесс считается зависшим и перезапускается
+WORKER_HEALTH_TIMEOUT = float(os.getenv("WORKER_HEALTH_TIMEOUT", "30"))
+
+# Ограничения исходящих сообщений: сообщений в секунду на весь бот и на один чат
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", "30"))
+SEND_CHAT_RATE = float(os.getenv("SEND_CHAT_RATE", "1"))
+# Сколько раз повторять отправку после ответа 429 (Too Many Requests)
+SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", "3"))
+
+# Сохранение шагов регистрации между перезапусками: интервал записи в секундах
+# и время хранения незавершенных диалогов в часах
+PERSISTENCE_INTERVAL = float(os.getenv("PERSISTENCE_INTERVAL", "1"))
+CONVERSATION_MAX_AGE_HOURS = float(os.getenv("CONVERSATION_MAX_AGE_HOURS", "168"))
+
+# Перезапуск без простоя (restart_bot.py): PID-файл активного экземпляра,
+# файл готовности нового экземпляра и сколько секунд старый экземпляр
+# дожидается обработчиков перед выходом
+PID_FILE = os.getenv("PID_FILE", "bot.pid")
+READY_FILE = os.getenv("READY_FILE", "bot.ready")
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", "30"))
+# Сколько секунд restart_bot.py ждет готовности нового экземпляра
+READY_TIMEOUT = float(os.getenv("READY_TIMEOUT", "60"))
+
+# Метрики в формате Prometheus: http://METRICS_HOST:METRICS_PORT/metrics
+# (0 - выключено). Рабочий процесс с номером N отдает метрики на METRICS_PORT + N
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+
+# Трассировка обновлений: доля трассируемых обновлений (0 - выключено, 1 - все),
+# файл для трасс (JSON по строке на трассу) и число последних трасс в памяти
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+TRACE_FILE = os.getenv("TRACE_FILE", "")
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "100"))
+
+# Бюджет времени запуска (секунды): при превышении в журнал пишется предупреждение
+STARTUP_BUDGET = float(os.getenv("STARTUP_BUDGET", "5"))
+
 # ID администраторов (через запятую в .env файле)
 ADMIN_IDS = []
 if os.getenv("ADMIN_IDS"):
-    ADMIN_IDS = [int(id) for id in os.getenv("ADMIN_IDS").split(",")]
\ No newline at end of file
+    ADMIN_IDS = [int(id) for id in os.getenv("ADMIN_IDS").split(",")]
+# Режим получения обновлений: polling (по умолчанию) или webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+# Публичный HTTPS-адрес бота (без пути), по которому Telegram отправляет обновления
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+# Адрес, порт и путь встроенного HTTP-сервера
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+# Секретный токен, который Telegram передает в заголовке каждого запроса;
+# обязателен в режиме webhook (1-256 символов: A-Z, a-z, 0-9, _ и -)
+WEBHOOK_SECRET_TOKEN = os.getenv("WEBHOOK_SECRET_TOKEN", "")
+# Максимум необработанных обновлений в очереди; сверх него сервер отвечает 503
+WEBHOOK_MAX_BACKLOG = int(os.getenv("WEBHOOK_MAX_BACKLOG", "1000"))
+# Сертификат и ключ, если TLS не завершается на обратном прокси
+WEBHOOK_CERT = os.getenv("WEBHOOK_CERT", "")
+WEBHOOK_KEY = os.getenv("WEBHOOK_KEY", "")
@@ -8,6 +8,8 @@ WELCOME_MESSAGE = """
 /start - Начать взаимодействие с ботом
 /register - Зарегистрироваться на мероприятие
 /my_info - Посмотреть информацию о себе
+/events - Ближайшие мероприятия и запись на них
+/unregister <ID> - Отменить запись на мероприятие
 /help - Показать это сообщение
 """
 
@@ -21,6 +23,12 @@ HELP_MESSAGE = """
 - Номер телефона
 - Дату рождения
 
+Все данные можно отправить сразу, одним сообщением:
+/register Иван Петров
+ivan@example.com
++7 999 123-45-67
+01.01.1990
+
 Для связи с администратором используйте команду /admin
 """
 
@@ -32,12 +40,42 @@ BIRTH_DATE_REQUEST = "Введите вашу дату рождения (в фо
 REGISTRATION_SUCCESS = "Вы успешно зарегистрировались на мероприятие! ✅"
 
 # Ошибки ввода
+INVALID_NAME = "Некорректное имя. Пожалуйста, введите ваше полное имя (не длиннее 200 символов):"
 INVALID_EMAIL = "Некорректный email. Пожалуйста, введите корректный email:"
 INVALID_PHONE = "Некорректный номер телефона. Пожалуйста, введите корректный номер:"
 INVALID_DATE = "Некорректная дата рождения. Пожалуйста, введите дату в формате ДД.ММ.ГГГГ:"
+INVALID_DATE_FUTURE = INVALID_DATE + " Дата не может быть в будущем."
+INVALID_CONTACT = "Пожалуйста, отправьте свой контакт или введите номер телефона:"
+# Регистрация одним сообщением: поля, которые не удалось принять
+INVALID_FIELDS = "Не удалось принять: {fields}."
+FIELD_TITLES = {'full_name': "имя", 'email': "email", 'phone': "телефон", 'birth_date': "дата рождения"}
+
+# Список мероприятий /events
+EVENTS_HEADER = "Ближайшие мероприятия. Нажмите на мероприятие, чтобы записаться:"
+EVENTS_EMPTY = "Ближайших мероприятий пока нет."
+EVENTS_NEED_PROFILE = "Сначала зарегистрируйтесь в боте командой /register."
+EVENT_REGISTERED = "Вы записаны на «{title}» ✅"
+EVENT_ALREADY_REGISTERED = "Вы уже записаны на это мероприятие."
+EVENT_NOT_FOUND = "Мероприятие не найдено."
+
+# Лист ожидания
+WAITLIST_JOINED = ("Свободных мест нет. Вы в листе ожидания, позиция: {position}. "
+                   "Когда место освободится, бот пришлет предложение.")
+WAITLIST_OFFER = ("Освободилось место на «{title}»! Оно закреплено за вами до {deadline}. "
+                  "Подтвердите участие, иначе место перейдет следующему в очереди.")
+WAITLIST_CONFIRM_BUTTON = "✅ Иду"
+WAITLIST_DECLINE_BUTTON = "Отказаться"
+WAITLIST_OFFER_EXPIRED = "Время подтверждения истекло, место передано следующему в очереди."
+WAITLIST_DECLINED = "Вы отказались от места и вышли из листа ожидания."
+UNREGISTER_DONE = "Регистрация на «{title}» отменена."
+UNREGISTER_WAITLIST_LEFT = "Вы вышли из листа ожидания «{title}»."
+UNREGISTER_NOT_FOUND = "Вы не записаны на это мероприятие и не стоите в листе ожидания."
+EVENTS_FIRST_PAGE_BUTTON = "⏮ В начало"
+EVENTS_NEXT_PAGE_BUTTON = "Далее ➡️"
 
 # Кнопки
 CANCEL_BUTTON = "❌ Отмена"
+CONTACT_BUTTON = "📱 Отправить контакт"
 CONFIRM_BUTTON = "✅ Подтвердить"
 
 # Состояния для ConversationHandler
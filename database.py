@@ -1,238 +1,1355 @@
 import sqlite3
+import base64
+import io
+import json
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
 from datetime import datetime
-from typing import List, Dict, Optional
+from itertools import islice
+from operator import itemgetter
+from typing import List, Dict, Optional, Iterable, Iterator, NamedTuple, Tuple, Callable, Union, BinaryIO
 import logging
+from migrations import apply_migrations, STATS_COUNTERS_SEED
+from cache import TTLCache, MISSING
+from records import (UserRecord, EventRecord, RegistrationRecord, UserRegistrationRecord, BroadcastRecord,
+                     WaitlistOfferRecord)
+from metrics import instrument
+from validators import validate_users
+from tracing import trace_class
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+
+# Количество строк в одной транзакции при массовой загрузке
+BULK_CHUNK_SIZE = 1000
+
+USER_FIELDS = ('telegram_id', 'full_name', 'email', 'phone', 'birth_date')
+
+# Размер страницы по умолчанию для постраничного чтения
+PAGE_SIZE = 500
+
+# Мероприятий на одной странице списка /events
+EVENTS_PAGE_SIZE = 5
+
+# Списки столбцов в порядке полей записей
+USER_SELECT = 'SELECT id, telegram_id, full_name, email, phone, birth_date, registration_date FROM users'
+EVENT_SELECT = 'SELECT id, title, description, date, location, created_at, capacity, remaining FROM events'
+BROADCAST_SELECT = '''
+    SELECT id, event_id, text, created_by, status, cursor, delivered, failed, blocked,
+           created_at, updated_at
+    FROM broadcasts
+'''
+ATTENDEE_SELECT = '''
+    SELECT er.id, er.user_id, u.telegram_id, u.full_name, u.email, u.phone,
+           u.birth_date, er.registration_date
+    FROM event_registrations er
+    JOIN users u ON u.id = er.user_id
+'''
+
+# Столбцы выгрузки участников и поддерживаемые форматы
+EXPORT_COLUMNS = ('telegram_id', 'full_name', 'email', 'phone', 'birth_date', 'registration_date')
+EXPORT_FORMATS = ('csv', 'ndjson')
+
+# Результаты записи на мероприятие (Database.reserve_seat)
+RESERVATION_REGISTERED = 'registered'
+RESERVATION_DUPLICATE = 'duplicate'
+RESERVATION_FULL = 'full'
+RESERVATION_NOT_FOUND = 'not_found'
+# Предложение места из листа ожидания истекло или его не было
+RESERVATION_EXPIRED = 'expired'
+
+
+class Reservation(NamedTuple):
+    """Результат записи на мероприятие: статус и ID регистрации, если она создана"""
+    status: str
+    registration_id: Optional[int] = None
+
+
+def encode_cursor(sort_value, row_id: int) -> str:
+    """
+    Курсор постраничного чтения: позиция последней выданной строки.
+    Компактная строка, помещается в callback_data кнопки Telegram.
+    """
+    raw = json.dumps([sort_value, row_id], separators=(',', ':'), ensure_ascii=False)
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).rstrip(b'=').decode('ascii')
+
+
+def decode_cursor(token: str) -> Tuple:
+    """Разбор курсора, созданного encode_cursor"""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        sort_value, row_id = json.loads(raw.decode('utf-8'))
+    except (ValueError, TypeError):
+        raise ValueError(f"Некорректный курсор: {token!r}")
+    if not isinstance(row_id, int):
+        raise ValueError(f"Некорректный курсор: {token!r}")
+    return sort_value, row_id
+
+
+def _keyset_condition(sort_column: str, id_column: str, cursor: Optional[str]) -> Tuple[str, tuple]:
+    """Условие WHERE для чтения строк после позиции курсора в порядке (sort_column, id_column)"""
+    if cursor is None:
+        return '', ()
+    sort_value, row_id = decode_cursor(cursor)
+    # NULL сортируется первым: после него идут остальные NULL с большим id и все не-NULL
+    if sort_value is None:
+        return (f'AND (({sort_column} IS NULL AND {id_column} > ?) OR {sort_column} IS NOT NULL)',
+                (row_id,))
+    return f'AND ({sort_column}, {id_column}) > (?, ?)', (sort_value, row_id)
+
+
+def _chunks(items: Iterable, size: int) -> Iterator[List]:
+    """Разбиение итерируемого объекта (в том числе генератора) на списки по size элементов"""
+    iterator = iter(items)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class PoolTimeoutError(sqlite3.OperationalError):
+    """Не удалось получить соединение из пула за отведенное время"""
+
+
+class ConnectionPool:
+    """
+    Ограниченный пул долгоживущих соединений SQLite.
+    Соединения создаются по требованию (не больше size штук), выдаются
+    через acquire()/release() и могут использоваться из любого потока,
+    но только одним потоком одновременно.
+    """
+
+    def __init__(self, db_path: str, size: int = 5, timeout: float = 30.0):
+        if size < 1:
+            raise ValueError("Размер пула должен быть положительным числом")
+        # Каждое соединение с ':memory:' - отдельная база, поэтому держим одно
+        if db_path == ':memory:':
+            size = 1
+        self.db_path = db_path
+        self.size = size
+        self.timeout = timeout
+        # LIFO: чаще используем "горячие" соединения с прогретым кэшем страниц
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._in_use = 0
+        self._closed = False
+        # Какое соединение занято каким потоком (для interrupt())
+        self._owners = {}
+        # Счетчики для мониторинга
+        self._checkouts = 0
+        self._waits = 0
+        self._timeouts = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+
+    def _connect(self) -> sqlite3.Connection:
+        """Открытие нового соединения"""
+        conn = sqlite3.connect(self.db_path, timeout=self.timeout, check_same_thread=False)
+        # В режиме WAL NORMAL не теряет целостность, но избавляет от fsync на каждый commit
+        conn.execute('PRAGMA synchronous = NORMAL')
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        """Получение соединения из пула (ожидает, если все соединения заняты)"""
+        if self._closed:
+            raise sqlite3.ProgrammingError("Пул соединений закрыт")
+        
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = None
+        
+        if conn is None:
+            with self._lock:
+                can_create = self._created < self.size
+                if can_create:
+                    self._created += 1
+            
+            if can_create:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                started = time.perf_counter()
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    with self._lock:
+                        self._timeouts += 1
+                    raise PoolTimeoutError(
+                        f"Нет свободных соединений с {self.db_path} в течение {self.timeout} с"
+                    )
+                waited = time.perf_counter() - started
+                with self._lock:
+                    self._waits += 1
+                    self._wait_time_total += waited
+                    self._wait_time_max = max(self._wait_time_max, waited)
+        
+        with self._lock:
+            self._checkouts += 1
+            self._in_use += 1
+            self._owners[threading.get_ident()] = conn
+        return conn
+
+    def release(self, conn: sqlite3.Connection):
+        """Возврат соединения в пул"""
+        # Незавершенная транзакция не должна достаться следующему владельцу
+        if conn.in_transaction:
+            conn.rollback()
+        
+        with self._lock:
+            self._in_use -= 1
+            if self._owners.get(threading.get_ident()) is conn:
+                del self._owners[threading.get_ident()]
+            closed = self._closed
+            if closed:
+                self._created -= 1
+        
+        if closed:
+            conn.close()
+        else:
+            self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        """Контекстный менеджер: соединение возвращается в пул при выходе"""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def interrupt(self, thread_id: int) -> bool:
+        """Прерывание запроса, выполняемого потоком thread_id на соединении из пула"""
+        with self._lock:
+            conn = self._owners.get(thread_id)
+            if conn is None:
+                return False
+            conn.interrupt()
+            return True
+
+    def stats(self) -> Dict:
+        """Счетчики пула: размер, занятость и время ожидания"""
+        with self._lock:
+            return {
+                'size': self.size,
+                'created': self._created,
+                'in_use': self._in_use,
+                'idle': self._created - self._in_use,
+                'checkouts': self._checkouts,
+                'waits': self._waits,
+                'timeouts': self._timeouts,
+                'wait_time_total': self._wait_time_total,
+                'wait_time_max': self._wait_time_max,
+            }
+
+    def close(self):
+        """Закрытие всех свободных соединений; занятые закроются при возврате"""
+        with self._lock:
+            self._closed = True
+        
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+
+def _insert_user(conn: sqlite3.Connection, telegram_id: int, full_name: str, email: str,
+                 phone: str, birth_date: str) -> Optional[int]:
+    """Вставка пользователя; возвращает ID или None, если telegram_id уже занят"""
+    try:
+        return conn.execute('''
+            INSERT INTO users (telegram_id, full_name, email, phone, birth_date)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (telegram_id, full_name, email, phone, birth_date)).lastrowid
+    except sqlite3.IntegrityError:
+        return None
+
+
+# Вставка регистрации, только если на мероприятии есть свободные места
+# (remaining IS NULL - без ограничения). Место занимает триггер
+# trg_event_registrations_insert_seats в том же операторе, поэтому проверка
+# и уменьшение остатка атомарны и параллельные регистрации не превышают лимит
+INSERT_REGISTRATION = '''
+    INSERT INTO event_registrations (user_id, event_id)
+    SELECT ?, id FROM events WHERE id = ? AND (remaining IS NULL OR remaining > 0)
+    ON CONFLICT(user_id, event_id) DO NOTHING
+'''
+
+
+def _insert_registration(conn: sqlite3.Connection, user_id: int, event_id: int) -> Optional[int]:
+    """
+    Вставка регистрации; возвращает ID или None, если пользователь уже
+    зарегистрирован, мест нет или мероприятия не существует
+    """
+    cursor = conn.execute(INSERT_REGISTRATION, (user_id, event_id))
+    return cursor.lastrowid if cursor.rowcount else None
+
+
+def _reserve_seat(conn: sqlite3.Connection, user_id: int, event_id: int) -> Reservation:
+    """
+    Запись на мероприятие с причиной отказа. Вызывается внутри транзакции
+    с блокировкой записи, поэтому причина согласована с результатом вставки.
+    """
+    registration_id = _insert_registration(conn, user_id, event_id)
+    if registration_id:
+        return Reservation(RESERVATION_REGISTERED, registration_id)
+    if conn.execute('SELECT 1 FROM events WHERE id = ?', (event_id,)).fetchone() is None:
+        return Reservation(RESERVATION_NOT_FOUND)
+    if conn.execute('SELECT 1 FROM event_registrations WHERE user_id = ? AND event_id = ?',
+                    (user_id, event_id)).fetchone():
+        return Reservation(RESERVATION_DUPLICATE)
+    return Reservation(RESERVATION_FULL)
+
+
+def _promote_waitlist(conn: sqlite3.Connection, event_id: int, hold_until: float) -> int:
+    """
+    Предложение свободных мест следующим в листе ожидания. Место удерживается
+    (вычитается из remaining) до hold_until, чтобы его не занял кто-то вне
+    очереди. Следующие пользователи читаются из индекса idx_waitlist_queue:
+    O(log n) на поиск начала очереди плюс число предложенных мест.
+    Вызывается в транзакции, которая освободила место, поэтому свободное
+    место при непустой очереди не бывает видно остальным.
+    """
+    row = conn.execute('SELECT remaining FROM events WHERE id = ?', (event_id,)).fetchone()
+    if row is None or row[0] == 0:
+        return 0
+    # Без ограничения мест (NULL) предложение получают все ожидающие
+    limit = -1 if row[0] is None else row[0]
+    waitlist_ids = [waitlist_id for waitlist_id, in conn.execute('''
+        SELECT id FROM waitlist
+        WHERE event_id = ? AND status = 'waiting'
+        ORDER BY id
+        LIMIT ?
+    ''', (event_id, limit))]
+    if not waitlist_ids:
+        return 0
+    conn.executemany(
+        "UPDATE waitlist SET status = 'offered', offered_until = ?, notified = 0 WHERE id = ?",
+        [(hold_until, waitlist_id) for waitlist_id in waitlist_ids]
+    )
+    conn.execute('UPDATE events SET remaining = remaining - ? WHERE id = ? AND remaining IS NOT NULL',
+                 (len(waitlist_ids), event_id))
+    return len(waitlist_ids)
+
+
+class WriteBehindQueue:
+    """
+    Очередь отложенной записи с групповыми коммитами.
+    Операции записи ставятся в очередь, единственный поток-писатель собирает
+    их в пачки (до batch_size операций или max_delay секунд ожидания) и
+    фиксирует каждую пачку одним commit, то есть одним fsync.
+    Каждая операция выполняется в своей точке сохранения: ошибка одной
+    операции не отменяет остальные. Результат операции передается через
+    Future только после успешного commit.
+    """
+
+    _STOP = object()
+
+    def __init__(self, connect: Callable[[], sqlite3.Connection],
+                 batch_size: int = 100, max_delay: float = 0.005):
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self._queue = queue.Queue()
+        self._conn = connect()
+        self._lock = threading.Lock()
+        self._closed = False
+        # Счетчики для мониторинга
+        self._batches = 0
+        self._operations = 0
+        self._max_batch = 0
+        self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, operation: Callable[[sqlite3.Connection], object],
+               after_commit: Optional[Callable[[object], None]] = None) -> Future:
+        """
+        Постановка операции в очередь. operation(conn) выполняется в потоке-писателе,
+        after_commit(результат) - после фиксации пачки, до передачи результата в Future.
+        """
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise sqlite3.ProgrammingError("Очередь записи закрыта")
+            self._queue.put((operation, after_commit, future))
+        return future
+
+    def _run(self):
+        """Цикл потока-писателя"""
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is self._STOP:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is self._STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._commit_batch(batch)
+        self._conn.close()
+
+    def _commit_batch(self, batch: List):
+        """Выполнение пачки операций в одной транзакции"""
+        results = []
+        try:
+            self._conn.execute('BEGIN IMMEDIATE')
+            for operation, after_commit, future in batch:
+                # Отмененные до начала выполнения операции пропускаются
+                if not future.set_running_or_notify_cancel():
+                    continue
+                self._conn.execute('SAVEPOINT write_behind_op')
+                try:
+                    result = operation(self._conn)
+                except Exception as exc:
+                    self._conn.execute('ROLLBACK TO write_behind_op')
+                    results.append((after_commit, future, None, exc))
+                else:
+                    results.append((after_commit, future, result, None))
+                self._conn.execute('RELEASE write_behind_op')
+            self._conn.commit()
+        except Exception as exc:
+            if self._conn.in_transaction:
+                self._conn.rollback()
+            logger.error(f"Ошибка группового коммита ({len(batch)} операций): {exc}")
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        
+        with self._lock:
+            self._batches += 1
+            self._operations += len(results)
+            self._max_batch = max(self._max_batch, len(results))
+        
+        for after_commit, future, result, error in results:
+            if error is None and after_commit:
+                try:
+                    after_commit(result)
+                except Exception as exc:
+                    logger.error(f"Ошибка обработчика после коммита: {exc}")
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+    def stats(self) -> Dict:
+        """Счетчики групповых коммитов"""
+        with self._lock:
+            return {
+                'queued': self._queue.qsize(),
+                'batches': self._batches,
+                'operations': self._operations,
+                'max_batch': self._max_batch,
+            }
+
+    def close(self):
+        """Запись всех операций из очереди и остановка потока-писателя"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(self._STOP)
+        self._thread.join()
+
+
+@trace_class('db')
+@instrument('database')
 class Database:
-    def __init__(self, db_path: str):
+    def __init__(self, db_path: str, pool_size: int = 5, pool_timeout: float = 30.0,
+                 user_cache_size: int = 10000, user_cache_ttl: float = 60.0,
+                 event_cache_size: int = 256, event_cache_ttl: float = 300.0,
+                 waitlist_hold: float = 1800.0,
+                 write_behind: bool = False, write_batch_size: int = 100,
+                 write_max_delay: float = 0.005):
         self.db_path = db_path
+        self.pool = ConnectionPool(db_path, size=pool_size, timeout=pool_timeout)
+        # Кэш пользователей по telegram_id (user_cache_size=0 отключает кэш)
+        self.user_cache = TTLCache(user_cache_size, user_cache_ttl) if user_cache_size else None
+        # Кэш страниц списка ближайших мероприятий (event_cache_size=0 отключает кэш)
+        self.event_cache = TTLCache(event_cache_size, event_cache_ttl) if event_cache_size else None
+        # Сколько секунд место из листа ожидания удерживается до подтверждения
+        self.waitlist_hold = waitlist_hold
         self.init_db()
+        # В режиме отложенной записи регистрации фиксируются групповыми коммитами
+        self.writer = None
+        if write_behind:
+            self.writer = WriteBehindQueue(self.pool._connect, write_batch_size, write_max_delay)
+    
+    def close(self):
+        """Закрытие соединений с базой данных"""
+        if self.writer:
+            self.writer.close()
+        self.pool.close()
+    
+    def get_pool_stats(self) -> Dict:
+        """Статистика пула соединений"""
+        return self.pool.stats()
+    
+    def get_cache_stats(self) -> Optional[Dict]:
+        """Статистика кэша пользователей (None, если кэш отключен)"""
+        return self.user_cache.stats() if self.user_cache else None
+    
+    def get_event_cache_stats(self) -> Optional[Dict]:
+        """Статистика кэша страниц мероприятий (None, если кэш отключен)"""
+        return self.event_cache.stats() if self.event_cache else None
+    
+    def get_writer_stats(self) -> Optional[Dict]:
+        """Статистика групповых коммитов (None, если отложенная запись выключена)"""
+        return self.writer.stats() if self.writer else None
+    
+    def _invalidate_users(self, telegram_ids: Iterable[int]):
+        """Сброс закэшированных записей пользователей после изменения"""
+        if self.user_cache:
+            for telegram_id in telegram_ids:
+                self.user_cache.invalidate(telegram_id)
     
     def init_db(self):
-        """Инициализация базы данных и создание таблиц"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Создание таблицы пользователей
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                telegram_id INTEGER UNIQUE NOT NULL,
-                full_name TEXT NOT NULL,
-                email TEXT NOT NULL,
-                phone TEXT NOT NULL,
-                birth_date TEXT NOT NULL,
-                registration_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Создание таблицы мероприятий
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS events (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                title TEXT NOT NULL,
-                description TEXT,
-                date TIMESTAMP,
-                location TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Создание таблицы регистрации на мероприятия
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS event_registrations (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                event_id INTEGER NOT NULL,
-                registration_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (id),
-                FOREIGN KEY (event_id) REFERENCES events (id),
-                UNIQUE(user_id, event_id)
-            )
-        ''')
-        
-        conn.commit()
-        conn.close()
+        """Инициализация базы данных и применение миграций схемы"""
+        with self.pool.connection() as conn:
+            # WAL позволяет читателям работать параллельно с записью;
+            # режим сохраняется в файле базы, поэтому меняем его только один раз
+            journal_mode = conn.execute('PRAGMA journal_mode').fetchone()[0]
+            if journal_mode.lower() != 'wal' and self.db_path != ':memory:':
+                conn.execute('PRAGMA journal_mode = WAL')
+            apply_migrations(conn)
         logger.info("База данных инициализирована")
     
     def add_user(self, telegram_id: int, full_name: str, email: str, phone: str, birth_date: str):
         """Добавление нового пользователя"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        if self.writer:
+            return self.submit_add_user(telegram_id, full_name, email, phone, birth_date).result()
         
-        try:
-            cursor.execute('''
-                INSERT INTO users (telegram_id, full_name, email, phone, birth_date)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (telegram_id, full_name, email, phone, birth_date))
+        with self.pool.connection() as conn:
+            user_id = _insert_user(conn, telegram_id, full_name, email, phone, birth_date)
             conn.commit()
-            user_id = cursor.lastrowid
+        self._user_added(telegram_id, full_name, user_id)
+        return user_id
+    
+    def submit_add_user(self, telegram_id: int, full_name: str, email: str, phone: str,
+                        birth_date: str) -> Future:
+        """
+        Добавление пользователя через очередь отложенной записи.
+        Future получает ID пользователя или None, если он уже существует.
+        """
+        return self.writer.submit(
+            lambda conn: _insert_user(conn, telegram_id, full_name, email, phone, birth_date),
+            lambda user_id: self._user_added(telegram_id, full_name, user_id)
+        )
+    
+    def _user_added(self, telegram_id: int, full_name: str, user_id: Optional[int]):
+        """Журналирование и сброс кэша после попытки добавления пользователя"""
+        if user_id:
             logger.info(f"Пользователь {full_name} добавлен с ID {user_id}")
-            return user_id
-        except sqlite3.IntegrityError:
+        else:
             # Пользователь с таким telegram_id уже существует
             logger.warning(f"Пользователь с telegram_id {telegram_id} уже существует")
-            return None
-        finally:
-            conn.close()
+        # В кэше мог остаться отрицательный результат
+        self._invalidate_users((telegram_id,))
     
-    def get_user_by_telegram_id(self, telegram_id: int) -> Optional[Dict]:
-        """Получение информации о пользователе по telegram_id"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    def add_users_bulk(self, users: Iterable, chunk_size: int = BULK_CHUNK_SIZE,
+                       update_existing: bool = False, validate: bool = False) -> Dict:
+        """
+        Массовое добавление пользователей.
+        users - словари с полями USER_FIELDS или кортежи в том же порядке.
+        Существующие telegram_id пропускаются (или обновляются при update_existing).
+        Каждые chunk_size строк записываются одной транзакцией.
+        При validate=True записи проверяются и нормализуются теми же правилами,
+        что и в диалоге регистрации (validators.validate_users); некорректные
+        записи пропускаются и считаются в invalid.
+        """
+        if update_existing:
+            conflict = '''DO UPDATE SET full_name = excluded.full_name, email = excluded.email,
+                          phone = excluded.phone, birth_date = excluded.birth_date'''
+        else:
+            conflict = 'DO NOTHING'
+        query = f'''
+            INSERT INTO users (telegram_id, full_name, email, phone, birth_date)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(telegram_id) {conflict}
+        '''
         
-        cursor.execute('SELECT * FROM users WHERE telegram_id = ?', (telegram_id,))
-        row = cursor.fetchone()
+        inserted = duplicates = invalid = 0
+        with self.pool.connection() as conn:
+            for number, chunk in enumerate(_chunks(users, chunk_size)):
+                if validate:
+                    chunk, errors = validate_users([
+                        user if isinstance(user, dict) else dict(zip(USER_FIELDS, user)) for user in chunk
+                    ])
+                    for index, field, error in errors:
+                        logger.warning(f"Массовая загрузка: запись {number * chunk_size + index} "
+                                       f"отклонена, поле {field}: {error}")
+                    invalid += len({index for index, _, _ in errors})
+                    if not chunk:
+                        continue
+                rows = [
+                    tuple(user[field] for field in USER_FIELDS) if isinstance(user, dict) else tuple(user)
+                    for user in chunk
+                ]
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    # AUTOINCREMENT гарантирует, что новые строки получат id больше текущего максимума
+                    max_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM users').fetchone()[0]
+                    conn.executemany(query, rows)
+                    added = conn.execute('SELECT COUNT(*) FROM users WHERE id > ?', (max_id,)).fetchone()[0]
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+                self._invalidate_users(row[0] for row in rows)
+                inserted += added
+                duplicates += len(rows) - added
         
-        if row:
-            columns = ['id', 'telegram_id', 'full_name', 'email', 'phone', 'birth_date', 'registration_date']
-            user = dict(zip(columns, row))
-            conn.close()
-            return user
-        else:
-            conn.close()
-            return None
+        logger.info(f"Массовая загрузка пользователей: добавлено {inserted}, дубликатов {duplicates}, "
+                    f"некорректных {invalid}")
+        return {'inserted': inserted, 'duplicates': duplicates, 'invalid': invalid}
     
-    def update_user(self, telegram_id: int, full_name: str, email: str, phone: str, birth_date: str):
-        """Обновление информации о пользователе"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    def get_user_by_telegram_id(self, telegram_id: int) -> Optional[UserRecord]:
+        """Получение информации о пользователе по telegram_id (через кэш)"""
+        snapshot = None
+        if self.user_cache:
+            user = self.user_cache.get(telegram_id)
+            if user is not MISSING:
+                # Записи неизменяемы, поэтому их можно отдавать из кэша без копирования
+                return user
+            snapshot = self.user_cache.snapshot()
         
-        cursor.execute('''
-            UPDATE users 
-            SET full_name = ?, email = ?, phone = ?, birth_date = ?
-            WHERE telegram_id = ?
-        ''', (full_name, email, phone, birth_date, telegram_id))
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = UserRecord.row_factory
+            cursor.execute(USER_SELECT + ' WHERE telegram_id = ?', (telegram_id,))
+            user = cursor.fetchone()
         
-        conn.commit()
-        conn.close()
+        # Отсутствие пользователя тоже кэшируется
+        if self.user_cache:
+            self.user_cache.set(telegram_id, user, snapshot)
+        return user
+    
+    def update_user(self, telegram_id: int, full_name: str, email: str, phone: str, birth_date: str):
+        """Обновление информации о пользователе"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE users 
+                SET full_name = ?, email = ?, phone = ?, birth_date = ?
+                WHERE telegram_id = ?
+            ''', (full_name, email, phone, birth_date, telegram_id))
+            conn.commit()
+        self._invalidate_users((telegram_id,))
         logger.info(f"Информация о пользователе {telegram_id} обновлена")
     
-    def add_event(self, title: str, description: str, date: str, location: str) -> int:
-        """Добавление нового мероприятия"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO events (title, description, date, location)
-            VALUES (?, ?, ?, ?)
-        ''', (title, description, date, location))
-        
-        event_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+    def add_event(self, title: str, description: str, date: str, location: str,
+                  capacity: Optional[int] = None) -> int:
+        """Добавление нового мероприятия (capacity - число мест, None - без ограничения)"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO events (title, description, date, location, capacity, remaining)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (title, description, date, location, capacity, capacity))
+            event_id = cursor.lastrowid
+            conn.commit()
+        # Новое мероприятие может попасть на любую страницу списка
+        if self.event_cache:
+            self.event_cache.clear()
         
         logger.info(f"Мероприятие '{title}' добавлено с ID {event_id}")
         return event_id
     
-    def get_all_events(self) -> List[Dict]:
+    def get_all_events(self) -> List[EventRecord]:
         """Получение всех мероприятий"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = EventRecord.row_factory
+            cursor.execute(EVENT_SELECT + ' ORDER BY date')
+            return cursor.fetchall()
+    
+    def get_events_page(self, page_size: int = PAGE_SIZE,
+                        cursor: Optional[str] = None) -> Tuple[List[EventRecord], Optional[str]]:
+        """
+        Страница мероприятий в порядке (date, id), начиная после cursor.
+        Возвращает мероприятия и курсор следующей страницы (None, если страница последняя).
+        """
+        condition, params = _keyset_condition('date', 'id', cursor)
+        with self.pool.connection() as conn:
+            db_cursor = conn.cursor()
+            db_cursor.row_factory = EventRecord.row_factory
+            events = db_cursor.execute(f'''
+                {EVENT_SELECT}
+                WHERE 1 {condition}
+                ORDER BY date, id
+                LIMIT ?
+            ''', params + (page_size + 1,)).fetchall()
         
-        cursor.execute('SELECT * FROM events ORDER BY date')
-        rows = cursor.fetchall()
+        next_cursor = None
+        if len(events) > page_size:
+            del events[page_size:]
+            next_cursor = encode_cursor(events[-1].date, events[-1].id)
+        return events, next_cursor
+    
+    def get_upcoming_events_page(self, page_size: int = EVENTS_PAGE_SIZE, cursor: Optional[str] = None,
+                                 ) -> Tuple[List[EventRecord], Optional[str]]:
+        """
+        Страница мероприятий, которые еще не прошли (начиная с сегодняшних),
+        в порядке (date, id). Страницы кэшируются: список листают все
+        пользователи бота, а меняется он только при добавлении мероприятий.
+        """
+        today = datetime.now().strftime('%Y-%m-%d')
+        key = (today, page_size, cursor)
+        snapshot = None
+        if self.event_cache:
+            page = self.event_cache.get(key)
+            if page is not MISSING:
+                events, next_cursor = page
+                return list(events), next_cursor
+            snapshot = self.event_cache.snapshot()
         
-        events = []
-        if rows:
-            columns = ['id', 'title', 'description', 'date', 'location', 'created_at']
-            for row in rows:
-                events.append(dict(zip(columns, row)))
+        condition, params = _keyset_condition('date', 'id', cursor)
+        with self.pool.connection() as conn:
+            db_cursor = conn.cursor()
+            db_cursor.row_factory = EventRecord.row_factory
+            events = db_cursor.execute(f'''
+                {EVENT_SELECT}
+                WHERE date >= ? {condition}
+                ORDER BY date, id
+                LIMIT ?
+            ''', (today,) + params + (page_size + 1,)).fetchall()
         
-        conn.close()
-        return events
+        next_cursor = None
+        if len(events) > page_size:
+            del events[page_size:]
+            next_cursor = encode_cursor(events[-1].date, events[-1].id)
+        # В кэше страница хранится кортежем, вызывающий код получает свою копию списка
+        if self.event_cache:
+            self.event_cache.set(key, (tuple(events), next_cursor), snapshot)
+        return events, next_cursor
+    
+    def set_event_capacity(self, event_id: int, capacity: Optional[int]) -> bool:
+        """
+        Изменение числа мест (None - без ограничения). Остаток пересчитывается
+        по фактическим регистрациям; если их уже больше, новых мест нет, а
+        уже записанные участники остаются. False, если мероприятие не найдено.
+        """
+        with self.pool.connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                # Удерживаемые для листа ожидания места тоже заняты
+                cursor = conn.execute('''
+                    UPDATE events
+                    SET capacity = ?1,
+                        remaining = CASE WHEN ?1 IS NULL THEN NULL ELSE MAX(?1 - (
+                            SELECT COUNT(*) FROM event_registrations WHERE event_id = events.id
+                        ) - (
+                            SELECT COUNT(*) FROM waitlist WHERE event_id = events.id AND status = 'offered'
+                        ), 0) END
+                    WHERE id = ?2
+                ''', (capacity, event_id))
+                # Новые места сразу предлагаются листу ожидания
+                if cursor.rowcount:
+                    _promote_waitlist(conn, event_id, time.time() + self.waitlist_hold)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        if self.event_cache:
+            self.event_cache.clear()
+        return cursor.rowcount > 0
+    
+    def get_remaining_seats(self, event_ids: Iterable[int]) -> Dict[int, Optional[int]]:
+        """
+        Свободные места мероприятий (None - без ограничения). Читается из базы
+        в обход кэша страниц: остаток меняется при каждой регистрации.
+        """
+        event_ids = list(event_ids)
+        if not event_ids:
+            return {}
+        placeholders = ','.join('?' * len(event_ids))
+        with self.pool.connection() as conn:
+            rows = conn.execute(f'SELECT id, remaining FROM events WHERE id IN ({placeholders})',
+                                event_ids).fetchall()
+        return dict(rows)
+    
+    def get_event(self, event_id: int) -> Optional[EventRecord]:
+        """Получение мероприятия по ID"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = EventRecord.row_factory
+            return cursor.execute(EVENT_SELECT + ' WHERE id = ?', (event_id,)).fetchone()
+    
+    def iter_events(self, page_size: int = PAGE_SIZE, cursor: Optional[str] = None) -> Iterator[EventRecord]:
+        """Потоковое чтение мероприятий постранично (соединение не удерживается между страницами)"""
+        while True:
+            events, cursor = self.get_events_page(page_size, cursor)
+            yield from events
+            if cursor is None:
+                return
     
     def register_user_for_event(self, user_id: int, event_id: int):
-        """Регистрация пользователя на мероприятие"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        """
+        Регистрация пользователя на мероприятие. Возвращает ID регистрации или
+        None (уже зарегистрирован или мест нет); причину отказа дает reserve_seat.
+        """
+        if self.writer:
+            return self.submit_register_user_for_event(user_id, event_id).result()
         
-        try:
-            cursor.execute('''
-                INSERT INTO event_registrations (user_id, event_id)
-                VALUES (?, ?)
-            ''', (user_id, event_id))
+        with self.pool.connection() as conn:
+            registration_id = _insert_registration(conn, user_id, event_id)
             conn.commit()
+        self._registration_added(user_id, event_id, registration_id)
+        return registration_id
+    
+    def submit_register_user_for_event(self, user_id: int, event_id: int) -> Future:
+        """
+        Регистрация на мероприятие через очередь отложенной записи.
+        Future получает ID регистрации или None, если пользователь уже зарегистрирован.
+        """
+        return self.writer.submit(
+            lambda conn: _insert_registration(conn, user_id, event_id),
+            lambda registration_id: self._registration_added(user_id, event_id, registration_id)
+        )
+    
+    def _registration_added(self, user_id: int, event_id: int, registration_id: Optional[int]):
+        """Журналирование попытки регистрации на мероприятие"""
+        if registration_id:
             logger.info(f"Пользователь {user_id} зарегистрирован на мероприятие {event_id}")
-        except sqlite3.IntegrityError:
-            # Пользователь уже зарегистрирован на это мероприятие
-            logger.warning(f"Пользователь {user_id} уже зарегистрирован на мероприятие {event_id}")
-        finally:
-            conn.close()
+        else:
+            # Пользователь уже зарегистрирован на это мероприятие или мест нет
+            logger.warning(f"Пользователь {user_id} не зарегистрирован на мероприятие {event_id}")
     
-    def get_user_registrations(self, user_id: int) -> List[Dict]:
-        """Получение всех регистраций пользователя"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT e.id, e.title, e.description, e.date, e.location, er.registration_date
-            FROM events e
-            JOIN event_registrations er ON e.id = er.event_id
-            WHERE er.user_id = ?
-            ORDER BY e.date
-        ''', (user_id,))
-        
-        rows = cursor.fetchall()
-        registrations = []
+    def reserve_seat(self, user_id: int, event_id: int) -> Reservation:
+        """
+        Запись на мероприятие с учетом числа мест. Вставка регистрации, занятие
+        места и определение причины отказа выполняются в одной транзакции
+        BEGIN IMMEDIATE, поэтому при параллельных вызовах мест не продается
+        больше, чем есть. Статус: registered, duplicate, full или not_found.
+        """
+        if self.writer:
+            return self.submit_reserve_seat(user_id, event_id).result()
         
-        if rows:
-            columns = ['event_id', 'title', 'description', 'date', 'location', 'registration_date']
-            for row in rows:
-                registrations.append(dict(zip(columns, row)))
+        with self.pool.connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                reservation = _reserve_seat(conn, user_id, event_id)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        self._reservation_done(user_id, event_id, reservation)
+        return reservation
+    
+    def submit_reserve_seat(self, user_id: int, event_id: int) -> Future:
+        """Запись на мероприятие через очередь отложенной записи (Future получает Reservation)"""
+        return self.writer.submit(
+            lambda conn: _reserve_seat(conn, user_id, event_id),
+            lambda reservation: self._reservation_done(user_id, event_id, reservation)
+        )
+    
+    def _reservation_done(self, user_id: int, event_id: int, reservation: Reservation):
+        """Журналирование записи на мероприятие"""
+        if reservation.status == RESERVATION_REGISTERED:
+            logger.info(f"Пользователь {user_id} зарегистрирован на мероприятие {event_id}")
+        else:
+            logger.info(f"Пользователь {user_id} не зарегистрирован на мероприятие {event_id}: {reservation.status}")
+    
+    def cancel_registration(self, user_id: int, event_id: int) -> bool:
+        """
+        Отмена регистрации. Освободившееся место в той же транзакции
+        предлагается следующему в листе ожидания. False, если регистрации не было.
+        """
+        with self.pool.connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                cursor = conn.execute('DELETE FROM event_registrations WHERE user_id = ? AND event_id = ?',
+                                      (user_id, event_id))
+                if cursor.rowcount:
+                    _promote_waitlist(conn, event_id, time.time() + self.waitlist_hold)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        if cursor.rowcount:
+            logger.info(f"Пользователь {user_id} отменил регистрацию на мероприятие {event_id}")
+        return cursor.rowcount > 0
+    
+    def join_waitlist(self, user_id: int, event_id: int) -> Optional[int]:
+        """
+        Постановка в лист ожидания (повторная постановка сохраняет место в очереди).
+        Возвращает позицию в очереди, 0 - если место уже удерживается для
+        пользователя (его можно сразу подтвердить), None - если пользователь
+        уже зарегистрирован или мероприятия нет.
+        """
+        with self.pool.connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                registered = conn.execute('SELECT 1 FROM event_registrations WHERE user_id = ? AND event_id = ?',
+                                          (user_id, event_id)).fetchone()
+                exists = conn.execute('SELECT 1 FROM events WHERE id = ?', (event_id,)).fetchone()
+                if registered or not exists:
+                    conn.rollback()
+                    return None
+                conn.execute('''
+                    INSERT INTO waitlist (event_id, user_id) VALUES (?, ?)
+                    ON CONFLICT(event_id, user_id) DO NOTHING
+                ''', (event_id, user_id))
+                # Место могло освободиться после отказа в записи
+                _promote_waitlist(conn, event_id, time.time() + self.waitlist_hold)
+                waitlist_id, status = conn.execute(
+                    'SELECT id, status FROM waitlist WHERE event_id = ? AND user_id = ?', (event_id, user_id)
+                ).fetchone()
+                position = 0
+                if status == 'waiting':
+                    position = conn.execute('''
+                        SELECT COUNT(*) FROM waitlist WHERE event_id = ? AND status = 'waiting' AND id <= ?
+                    ''', (event_id, waitlist_id)).fetchone()[0]
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        logger.info(f"Пользователь {user_id} в листе ожидания мероприятия {event_id}, позиция {position}")
+        return position
+    
+    def leave_waitlist(self, user_id: int, event_id: int) -> bool:
+        """
+        Выход из листа ожидания или отказ от предложенного места; удерживаемое
+        место передается следующему. False, если пользователя в очереди нет.
+        """
+        with self.pool.connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = conn.execute('SELECT id, status FROM waitlist WHERE event_id = ? AND user_id = ?',
+                                   (event_id, user_id)).fetchone()
+                if row:
+                    conn.execute('DELETE FROM waitlist WHERE id = ?', (row[0],))
+                    if row[1] == 'offered':
+                        self._release_held_seats(conn, event_id, 1)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        return row is not None
+    
+    def confirm_waitlist_offer(self, user_id: int, event_id: int, now: Optional[float] = None) -> Reservation:
+        """
+        Подтверждение предложенного места. Удерживаемое место превращается в
+        регистрацию; если предложение истекло или его не было - статус expired.
+        """
+        now = time.time() if now is None else now
+        with self.pool.connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = conn.execute('''
+                    SELECT id, offered_until FROM waitlist
+                    WHERE event_id = ? AND user_id = ? AND status = 'offered'
+                ''', (event_id, user_id)).fetchone()
+                if row is None or row[1] <= now:
+                    # Истекшее предложение освободит очередная проверка expire_waitlist_offers
+                    conn.rollback()
+                    return Reservation(RESERVATION_EXPIRED)
+                conn.execute('DELETE FROM waitlist WHERE id = ?', (row[0],))
+                # Удерживаемое место возвращается и сразу занимается регистрацией
+                conn.execute('UPDATE events SET remaining = remaining + 1 WHERE id = ? AND remaining IS NOT NULL',
+                             (event_id,))
+                reservation = _reserve_seat(conn, user_id, event_id)
+                if reservation.status != RESERVATION_REGISTERED:
+                    _promote_waitlist(conn, event_id, now + self.waitlist_hold)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        self._reservation_done(user_id, event_id, reservation)
+        return reservation
+    
+    def expire_waitlist_offers(self, now: Optional[float] = None) -> int:
+        """
+        Снятие неподтвержденных вовремя предложений: пользователь выходит из
+        очереди, место предлагается следующему. Возвращает число снятых предложений.
+        """
+        now = time.time() if now is None else now
+        with self.pool.connection() as conn:
+            # Обычно истекших предложений нет: проверка без блокировки записи
+            if conn.execute("SELECT 1 FROM waitlist WHERE status = 'offered' AND offered_until <= ? LIMIT 1",
+                            (now,)).fetchone() is None:
+                return 0
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                expired = conn.execute('''
+                    SELECT id, event_id FROM waitlist WHERE status = 'offered' AND offered_until <= ?
+                ''', (now,)).fetchall()
+                conn.executemany('DELETE FROM waitlist WHERE id = ?', [(waitlist_id,) for waitlist_id, _ in expired])
+                per_event: Dict[int, int] = {}
+                for _, event_id in expired:
+                    per_event[event_id] = per_event.get(event_id, 0) + 1
+                for event_id, seats in per_event.items():
+                    self._release_held_seats(conn, event_id, seats, now)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        logger.info(f"Лист ожидания: истекло предложений {len(expired)}")
+        return len(expired)
+    
+    def _release_held_seats(self, conn: sqlite3.Connection, event_id: int, seats: int,
+                            now: Optional[float] = None):
+        """Возврат удерживаемых мест и предложение их следующим в очереди"""
+        conn.execute('UPDATE events SET remaining = remaining + ? WHERE id = ? AND remaining IS NOT NULL',
+                     (seats, event_id))
+        _promote_waitlist(conn, event_id, (time.time() if now is None else now) + self.waitlist_hold)
+    
+    def claim_waitlist_offers(self, limit: int) -> List[WaitlistOfferRecord]:
+        """
+        Пачка еще не отправленных предложений мест. Предложения сразу отмечаются
+        отправленными, поэтому несколько процессов не отправят одно и то же дважды.
+        """
+        with self.pool.connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                cursor = conn.cursor()
+                cursor.row_factory = WaitlistOfferRecord.row_factory
+                offers = cursor.execute('''
+                    SELECT w.id, w.event_id, u.telegram_id, e.title, w.offered_until
+                    FROM waitlist w
+                    JOIN users u ON u.id = w.user_id
+                    JOIN events e ON e.id = w.event_id
+                    WHERE w.status = 'offered' AND w.notified = 0
+                    ORDER BY w.offered_until
+                    LIMIT ?
+                ''', (limit,)).fetchall()
+                conn.executemany('UPDATE waitlist SET notified = 1 WHERE id = ?',
+                                 [(offer.waitlist_id,) for offer in offers])
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        return offers
+    
+    def register_users_for_event_bulk(self, event_id: int, user_ids: Iterable[int],
+                                      chunk_size: int = BULK_CHUNK_SIZE) -> Dict:
+        """
+        Массовая регистрация пользователей на мероприятие.
+        Уже зарегистрированные пользователи пропускаются без исключений,
+        после заполнения всех мест остальные не регистрируются (full).
+        Если мероприятия нет, никто не регистрируется и все записи
+        считаются в not_found.
+        """
+        inserted = duplicates = full = 0
+        with self.pool.connection() as conn:
+            if conn.execute('SELECT 1 FROM events WHERE id = ?', (event_id,)).fetchone() is None:
+                missing = sum(1 for _ in user_ids)
+                logger.warning(f"Массовая регистрация: мероприятие {event_id} не найдено")
+                return {'inserted': 0, 'duplicates': 0, 'full': 0, 'not_found': missing}
+            for chunk in _chunks(user_ids, chunk_size):
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    cursor = conn.executemany(INSERT_REGISTRATION, [(user_id, event_id) for user_id in chunk])
+                    added = cursor.rowcount
+                    skipped_full = 0
+                    limited = conn.execute('SELECT remaining IS NOT NULL FROM events WHERE id = ?',
+                                           (event_id,)).fetchone()
+                    if limited and limited[0] and added < len(chunk):
+                        # Строки пачки, чей пользователь так и не зарегистрирован, не получили места
+                        registered = conn.execute('''
+                            SELECT COUNT(*) FROM json_each(?) AS chunk
+                            JOIN event_registrations er ON er.user_id = chunk.value AND er.event_id = ?
+                        ''', (json.dumps(chunk), event_id)).fetchone()[0]
+                        skipped_full = len(chunk) - registered
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+                inserted += added
+                full += skipped_full
+                duplicates += len(chunk) - added - skipped_full
         
-        conn.close()
-        return registrations
+        logger.info(f"Массовая регистрация на мероприятие {event_id}: добавлено {inserted}, "
+                    f"дубликатов {duplicates}, без мест {full}")
+        return {'inserted': inserted, 'duplicates': duplicates, 'full': full, 'not_found': 0}
+    
+    def get_user_registrations(self, user_id: int) -> List[UserRegistrationRecord]:
+        """Получение всех регистраций пользователя"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = UserRegistrationRecord.row_factory
+            cursor.execute('''
+                SELECT e.id, e.title, e.description, e.date, e.location, er.registration_date
+                FROM events e
+                JOIN event_registrations er ON e.id = er.event_id
+                WHERE er.user_id = ?
+                ORDER BY e.date
+            ''', (user_id,))
+            return cursor.fetchall()
     
-    def get_event_registrations(self, event_id: int) -> List[Dict]:
+    def get_event_registrations(self, event_id: int) -> List[RegistrationRecord]:
         """Получение всех регистраций на мероприятие"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT u.full_name, u.email, u.phone, u.birth_date, er.registration_date
-            FROM users u
-            JOIN event_registrations er ON u.id = er.user_id
-            WHERE er.event_id = ?
-            ORDER BY er.registration_date
-        ''', (event_id,))
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = RegistrationRecord.row_factory
+            cursor.execute(ATTENDEE_SELECT + '''
+                WHERE er.event_id = ?
+                ORDER BY er.registration_date
+            ''', (event_id,))
+            return cursor.fetchall()
+    
+    def get_event_registrations_page(self, event_id: int, page_size: int = PAGE_SIZE,
+                                     cursor: Optional[str] = None) -> Tuple[List[RegistrationRecord], Optional[str]]:
+        """
+        Страница участников мероприятия в порядке (registration_date, user_id).
+        Пара уникальна внутри мероприятия и целиком читается из индекса
+        idx_event_registrations_event, поэтому сортировка не нужна.
+        """
+        condition, params = _keyset_condition('er.registration_date', 'er.user_id', cursor)
+        with self.pool.connection() as conn:
+            db_cursor = conn.cursor()
+            db_cursor.row_factory = RegistrationRecord.row_factory
+            attendees = db_cursor.execute(f'''
+                {ATTENDEE_SELECT}
+                WHERE er.event_id = ? {condition}
+                ORDER BY er.registration_date, er.user_id
+                LIMIT ?
+            ''', (event_id,) + params + (page_size + 1,)).fetchall()
         
-        rows = cursor.fetchall()
-        registrations = []
+        next_cursor = None
+        if len(attendees) > page_size:
+            del attendees[page_size:]
+            next_cursor = encode_cursor(attendees[-1].registration_date, attendees[-1].user_id)
+        return attendees, next_cursor
+    
+    def iter_event_registrations(self, event_id: int, page_size: int = PAGE_SIZE,
+                                 cursor: Optional[str] = None) -> Iterator[RegistrationRecord]:
+        """Потоковое чтение участников мероприятия постранично"""
+        while True:
+            attendees, cursor = self.get_event_registrations_page(event_id, page_size, cursor)
+            yield from attendees
+            if cursor is None:
+                return
+    
+    def export_event_registrations(self, event_id: int, output: Union[str, BinaryIO], fmt: str = 'csv',
+                                   chunk_size: int = PAGE_SIZE,
+                                   progress: Optional[Callable[[int], None]] = None) -> int:
+        """
+        Потоковая выгрузка участников мероприятия в сжатый gzip файл CSV или NDJSON.
+        output - путь к файлу или бинарный файловый объект. Строки читаются и
+        записываются страницами по chunk_size, поэтому расход памяти не зависит
+        от размера мероприятия. После каждой страницы вызывается progress(строк_записано).
+        Возвращает количество выгруженных строк.
+        """
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Неподдерживаемый формат выгрузки: {fmt}")
+        # Выгрузку запускают только администраторы - не тратим время запуска бота
+        import csv
+        import gzip
         
-        if rows:
-            columns = ['full_name', 'email', 'phone', 'birth_date', 'registration_date']
-            for row in rows:
-                registrations.append(dict(zip(columns, row)))
+        export_row = itemgetter(*(RegistrationRecord._index[column] for column in EXPORT_COLUMNS))
+        rows_written = 0
+        with gzip.open(output, 'wb') as compressed:
+            with io.TextIOWrapper(compressed, encoding='utf-8', newline='') as text:
+                if fmt == 'csv':
+                    writer = csv.writer(text)
+                    writer.writerow(EXPORT_COLUMNS)
+                
+                cursor = None
+                while True:
+                    attendees, cursor = self.get_event_registrations_page(event_id, chunk_size, cursor)
+                    if fmt == 'csv':
+                        writer.writerows(export_row(attendee) for attendee in attendees)
+                    else:
+                        text.writelines(
+                            json.dumps(dict(zip(EXPORT_COLUMNS, export_row(attendee))),
+                                       ensure_ascii=False) + '\n'
+                            for attendee in attendees
+                        )
+                    rows_written += len(attendees)
+                    if progress:
+                        progress(rows_written)
+                    if cursor is None:
+                        break
         
-        conn.close()
-        return registrations
+        logger.info(f"Выгружено {rows_written} участников мероприятия {event_id} в формате {fmt}")
+        return rows_written
     
     def get_registration_stats(self) -> Dict:
-        """Получение статистики регистрации"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Общее количество пользователей
-        cursor.execute('SELECT COUNT(*) FROM users')
-        total_users = cursor.fetchone()[0]
-        
-        # Общее количество мероприятий
-        cursor.execute('SELECT COUNT(*) FROM events')
-        total_events = cursor.fetchone()[0]
+        """Получение статистики регистрации (из счетчиков, без подсчета строк)"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT name, value FROM stats_counters
+                WHERE name IN ('users', 'events', 'registrations')
+            ''')
+            counters = dict(cursor.fetchall())
         
-        # Общее количество регистраций
-        cursor.execute('SELECT COUNT(*) FROM event_registrations')
-        total_registrations = cursor.fetchone()[0]
+        return {
+            'total_users': counters.get('users', 0),
+            'total_events': counters.get('events', 0),
+            'total_registrations': counters.get('registrations', 0)
+        }
+    
+    def get_event_registration_count(self, event_id: int) -> int:
+        """Количество регистраций на мероприятие (из счетчиков)"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT value FROM stats_counters WHERE name = ?', (f'event:{event_id}',))
+            row = cursor.fetchone()
+        return row[0] if row else 0
+    
+    def rebuild_stats_counters(self) -> Dict:
+        """Пересчет счетчиков статистики по фактическим данным таблиц"""
+        with self.pool.connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute('DELETE FROM stats_counters')
+                for statement in STATS_COUNTERS_SEED:
+                    conn.execute(statement)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
         
-        conn.close()
+        logger.info("Счетчики статистики пересчитаны")
+        return self.get_registration_stats()
+    
+    def get_conversation_states(self, name: str) -> Dict[Tuple, object]:
+        """Сохраненные состояния диалогов ConversationHandler с именем name"""
+        with self.pool.connection() as conn:
+            rows = conn.execute(
+                'SELECT conversation_key, state FROM conversation_states WHERE name = ?', (name,)
+            ).fetchall()
+        return {tuple(json.loads(key)): json.loads(state) for key, state in rows}
+    
+    def count_conversation_states(self, name: str) -> Dict[object, int]:
+        """Число сохраненных диалогов ConversationHandler с именем name по состояниям"""
+        with self.pool.connection() as conn:
+            rows = conn.execute(
+                'SELECT state, COUNT(*) FROM conversation_states WHERE name = ? GROUP BY state', (name,)
+            ).fetchall()
+        return {json.loads(state): count for state, count in rows}
+    
+    def get_user_data(self, user_id: int) -> Optional[Dict]:
+        """Сохраненные данные context.user_data пользователя (None, если их нет)"""
+        with self.pool.connection() as conn:
+            row = conn.execute('SELECT data FROM user_data WHERE user_id = ?', (user_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+    
+    def save_conversation_state(self, user_data: Dict[int, Optional[Dict]],
+                                conversations: Dict[Tuple[str, Tuple], object]):
+        """
+        Сохранение накопленных изменений состояния бота одной транзакцией.
+        user_data: {user_id: данные или None для удаления},
+        conversations: {(имя обработчика, ключ диалога): состояние или None для удаления}
+        """
+        with self.pool.connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.executemany(
+                    '''
+                    INSERT INTO user_data (user_id, data, updated_at) VALUES (?, ?, CURRENT_TIMESTAMP)
+                    ON CONFLICT(user_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at
+                    ''',
+                    [(user_id, json.dumps(data, ensure_ascii=False))
+                     for user_id, data in user_data.items() if data]
+                )
+                # Пустые данные не храним
+                conn.executemany(
+                    'DELETE FROM user_data WHERE user_id = ?',
+                    [(user_id,) for user_id, data in user_data.items() if not data]
+                )
+                conn.executemany(
+                    '''
+                    INSERT INTO conversation_states (name, conversation_key, state, updated_at)
+                    VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+                    ON CONFLICT(name, conversation_key)
+                    DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at
+                    ''',
+                    [(name, json.dumps(list(key)), json.dumps(state))
+                     for (name, key), state in conversations.items() if state is not None]
+                )
+                conn.executemany(
+                    'DELETE FROM conversation_states WHERE name = ? AND conversation_key = ?',
+                    [(name, json.dumps(list(key)))
+                     for (name, key), state in conversations.items() if state is None]
+                )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+    
+    def purge_stale_conversation_state(self, max_age: float) -> Dict:
+        """Удаление диалогов и черновиков, не менявшихся дольше max_age секунд"""
+        modifier = f'-{int(max_age)} seconds'
+        with self.pool.connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conversations = conn.execute(
+                    "DELETE FROM conversation_states WHERE updated_at < datetime('now', ?)", (modifier,)
+                ).rowcount
+                users = conn.execute(
+                    "DELETE FROM user_data WHERE updated_at < datetime('now', ?)", (modifier,)
+                ).rowcount
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
         
-        return {
-            'total_users': total_users,
-            'total_events': total_events,
-            'total_registrations': total_registrations
-        }
\ No newline at end of file
+        if conversations or users:
+            logger.info(f"Удалены устаревшие диалоги: {conversations}, черновики: {users}")
+        return {'conversations': conversations, 'user_data': users}
+    
+    def create_broadcast(self, event_id: int, text: str, created_by: int) -> int:
+        """Создание рассылки участникам мероприятия"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                'INSERT INTO broadcasts (event_id, text, created_by) VALUES (?, ?, ?)',
+                (event_id, text, created_by)
+            )
+            conn.commit()
+            broadcast_id = cursor.lastrowid
+        logger.info(f"Создана рассылка {broadcast_id} для мероприятия {event_id}")
+        return broadcast_id
+    
+    def get_broadcast(self, broadcast_id: int) -> Optional[BroadcastRecord]:
+        """Получение рассылки по ID"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = BroadcastRecord.row_factory
+            return cursor.execute(BROADCAST_SELECT + ' WHERE id = ?', (broadcast_id,)).fetchone()
+    
+    def get_active_broadcasts(self) -> List[BroadcastRecord]:
+        """Незавершенные рассылки (для продолжения после перезапуска)"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = BroadcastRecord.row_factory
+            return cursor.execute(BROADCAST_SELECT + " WHERE status = 'running' ORDER BY id").fetchall()
+    
+    def save_broadcast_progress(self, broadcast_id: int, cursor: Optional[str], delivered: int,
+                                failed: int, blocked: int, status: str = 'running'):
+        """Сохранение контрольной точки рассылки после отправки страницы"""
+        with self.pool.connection() as conn:
+            conn.execute('''
+                UPDATE broadcasts
+                SET cursor = ?, delivered = ?, failed = ?, blocked = ?, status = ?,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', (cursor, delivered, failed, blocked, status, broadcast_id))
+            conn.commit()
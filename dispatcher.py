@@ -0,0 +1,144 @@
+"""
+Параллельная обработка обновлений с сохранением порядка для каждого пользователя
+"""
+
+import asyncio
+import logging
+import sys
+import time
+from typing import Any, Awaitable, Dict, Hashable, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+
+class _UserSlot:
+    """Очередь обновлений одного пользователя: FIFO-блокировка и число ожидающих"""
+
+    __slots__ = ('lock', 'pending')
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.pending = 0
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Обработчик обновлений для Application.builder().concurrent_updates(...).
+    Обновления разных пользователей обрабатываются параллельно (не больше
+    max_concurrent одновременно), обновления одного пользователя - строго
+    по очереди, поэтому состояния ConversationHandler не перемешиваются.
+
+    Обновление сначала дожидается своей очереди у пользователя и только потом
+    занимает слот обработки: пользователь с медленным обработчиком не держит
+    слоты, нужные другим.
+
+    Application не ждет обработчик: каждое обновление из update_queue сразу
+    становится отдельной задачей, и update_queue остается пустой. Поэтому
+    ограничить число принятых обновлений здесь нельзя - pending показывает,
+    сколько их держит обработчик, и WebhookServer учитывает это число в max_backlog.
+    """
+
+    def __init__(self, max_concurrent: int = 8):
+        if max_concurrent < 1:
+            raise ValueError("Число параллельных обработчиков должно быть положительным")
+        # Семафор базового класса не ограничивает прием: ожидающие на нем задачи
+        # не были бы видны в pending. Число выполняемых обработчиков ограничивает
+        # собственный семафор
+        super().__init__(sys.maxsize)
+        self.max_concurrent = max_concurrent
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self._users: Dict[Hashable, _UserSlot] = {}
+        # Счетчики для мониторинга
+        self._pending = 0
+        self._in_flight = 0
+        self._processed = 0
+        self._serialized = 0
+        self._user_waits = 0
+        self._user_wait_total = 0.0
+        self._user_wait_max = 0.0
+        self._slot_wait_total = 0.0
+        self._slot_wait_max = 0.0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        self._users.clear()
+
+    @property
+    def pending(self) -> int:
+        """Принятые обработчиком, но еще не обработанные обновления"""
+        return self._pending
+
+    @staticmethod
+    def user_key(update: Any) -> Optional[Hashable]:
+        """Ключ сериализации: telegram_id пользователя, иначе id чата"""
+        if isinstance(update, Update):
+            if update.effective_user:
+                return update.effective_user.id
+            if update.effective_chat:
+                return ('chat', update.effective_chat.id)
+        return None
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]):
+        key = self.user_key(update)
+        self._pending += 1
+        try:
+            if key is None:
+                await self._run(coroutine, time.perf_counter())
+                return
+
+            slot = self._users.get(key)
+            if slot is None:
+                slot = self._users[key] = _UserSlot()
+            slot.pending += 1
+            queued_at = time.perf_counter()
+            try:
+                if slot.lock.locked():
+                    self._serialized += 1
+                # asyncio.Lock будит ожидающих в порядке очереди
+                async with slot.lock:
+                    waited = time.perf_counter() - queued_at
+                    self._user_waits += 1
+                    self._user_wait_total += waited
+                    self._user_wait_max = max(self._user_wait_max, waited)
+                    await self._run(coroutine, time.perf_counter())
+            finally:
+                slot.pending -= 1
+                if not slot.pending:
+                    del self._users[key]
+        finally:
+            self._pending -= 1
+
+    async def _run(self, coroutine: Awaitable[Any], queued_at: float):
+        """Выполнение обработчика в одном из max_concurrent слотов"""
+        async with self._slots:
+            waited = time.perf_counter() - queued_at
+            self._slot_wait_total += waited
+            self._slot_wait_max = max(self._slot_wait_max, waited)
+            self._in_flight += 1
+            try:
+                await coroutine
+            finally:
+                self._in_flight -= 1
+                self._processed += 1
+
+    def stats(self) -> Dict:
+        """Глубина очереди, число выполняемых обработчиков и время ожидания"""
+        processed = self._processed
+        return {
+            'max_concurrent': self.max_concurrent,
+            'pending': self._pending,
+            'in_flight': self._in_flight,
+            'waiting': self._pending - self._in_flight,
+            'active_users': len(self._users),
+            'processed': processed,
+            'serialized': self._serialized,
+            'user_wait_avg': self._user_wait_total / self._user_waits if self._user_waits else 0.0,
+            'user_wait_max': self._user_wait_max,
+            'slot_wait_avg': self._slot_wait_total / processed if processed else 0.0,
+            'slot_wait_max': self._slot_wait_max,
+        }
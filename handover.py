@@ -0,0 +1,185 @@
+"""
+Перезапуск бота без простоя: PID/lock-файл активного экземпляра, отметка
+готовности нового экземпляра и плавная остановка с дожиданием обработчиков
+"""
+
+import asyncio
+import logging
+import os
+import signal
+from typing import Optional
+
+from telegram.ext import Application
+
+from startup import StartupReport
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировки нет, перезапуск по-старому
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Как часто ожидающий экземпляр проверяет, освободилась ли блокировка (секунды)
+LOCK_POLL_INTERVAL = 0.2
+
+
+class InstanceLock:
+    """
+    Блокировка активного экземпляра бота (flock на PID-файле).
+    Файл содержит PID экземпляра, который получает обновления. Блокировку
+    освобождает ядро при завершении процесса, поэтому после падения
+    устаревший PID не мешает запуску.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+
+    @property
+    def supported(self) -> bool:
+        return fcntl is not None
+
+    def acquire(self, blocking: bool = True) -> bool:
+        """Захват блокировки и запись своего PID; False, если занята"""
+        if not self.supported:
+            return True
+        if self._file is None:
+            self._file = open(self.path, 'a+')
+        flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+        try:
+            fcntl.flock(self._file.fileno(), flags)
+        except BlockingIOError:
+            return False
+        self._file.seek(0)
+        self._file.truncate()
+        self._file.write(str(os.getpid()))
+        self._file.flush()
+        return True
+
+    async def wait(self, stop: Optional[asyncio.Event] = None) -> bool:
+        """
+        Ожидание блокировки без занятия потока; False, если раньше пришел
+        сигнал остановки
+        """
+        while not self.acquire(blocking=False):
+            if stop is not None and stop.is_set():
+                return False
+            await asyncio.sleep(LOCK_POLL_INTERVAL)
+        return True
+
+    def release(self):
+        if self._file is not None:
+            if self.supported:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+
+def read_pid(path: str) -> Optional[int]:
+    """PID из PID-файла или файла готовности, если процесс жив"""
+    try:
+        with open(path) as pid_file:
+            pid = int(pid_file.read().strip() or 0)
+    except (OSError, ValueError):
+        return None
+    if pid <= 0:
+        return None
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return None
+    except PermissionError:
+        pass
+    return pid
+
+
+def mark_ready(path: str):
+    """Отметка готовности: экземпляр прогрет и ждет своей очереди"""
+    temp_path = f"{path}.{os.getpid()}"
+    with open(temp_path, 'w') as ready_file:
+        ready_file.write(str(os.getpid()))
+    # Атомарная замена: скрипт перезапуска не прочитает половину файла
+    os.replace(temp_path, path)
+
+
+def clear_ready(path: str):
+    """Удаление отметки готовности, если она наша"""
+    try:
+        with open(path) as ready_file:
+            if ready_file.read().strip() != str(os.getpid()):
+                return
+        os.remove(path)
+    except OSError:
+        pass
+
+
+async def serve_polling(application: Application, lock: InstanceLock, ready_path: str,
+                        drain_timeout: float, startup: Optional[StartupReport] = None,
+                        startup_budget: Optional[float] = None) -> bool:
+    """
+    Запуск приложения в режиме long polling с передачей работы между экземплярами.
+
+    1. Прогрев: база уже открыта, здесь проверяется токен и соединение (get_me),
+       после чего пишется отметка готовности и отчет о времени запуска.
+    2. Ожидание блокировки: Telegram отдает обновления только одному getUpdates,
+       поэтому новый экземпляр начинает их получать после выхода старого.
+       Неподтвержденные старым экземпляром обновления достанутся новому.
+    3. По SIGTERM/SIGINT экземпляр перестает получать обновления и ждет
+       обработчиков не дольше drain_timeout секунд.
+
+    Возвращает False, если обработчики не успели завершиться (их задачи будут
+    отменены при закрытии цикла событий). post_stop и shutdown выполняются в
+    обоих случаях: фоновые задачи сохраняют прогресс, состояние диалогов
+    записывается в базу.
+    """
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+
+    await application.bot.initialize()
+    mark_ready(ready_path)
+    if startup is not None:
+        startup.mark("проверка токена")
+        startup.log(startup_budget)
+    logger.info("Экземпляр готов, ожидание остановки предыдущего экземпляра...")
+    if not await lock.wait(stop):
+        clear_ready(ready_path)
+        await application.bot.shutdown()
+        return True
+    clear_ready(ready_path)
+
+    # Состояния диалогов загружаются только теперь, когда предыдущий экземпляр
+    # уже сохранил свои
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.updater.start_polling()
+    await application.start()
+    logger.info("Экземпляр принял работу и получает обновления")
+
+    await stop.wait()
+    logger.info("Остановка: прием обновлений прекращен, ожидание обработчиков...")
+    # Updater подтверждает Telegram уже полученные обновления, остальные
+    # получит следующий экземпляр
+    await application.updater.stop()
+    drain = asyncio.ensure_future(application.stop())
+    drained = True
+    try:
+        done, _ = await asyncio.wait({drain}, timeout=drain_timeout)
+        if not done:
+            drained = False
+            logger.warning(f"Обработчики не завершились за {drain_timeout:.0f} с, принудительная остановка")
+            drain.cancel()
+            await asyncio.gather(drain, return_exceptions=True)
+    finally:
+        # Application.stop() уже снял признак работы, поэтому shutdown() возможен
+        # и после отмены; он же сохраняет состояние диалогов
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+    return drained
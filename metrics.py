@@ -0,0 +1,296 @@
+"""
+Метрики бота (счетчики, гистограммы задержек, датчики) в текстовом формате
+Prometheus и небольшой HTTP-сервер для их отдачи
+"""
+
+import functools
+import inspect
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм задержек (секунды): от запросов к SQLite до ответов API
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Metric:
+    """Общая часть метрик: имя, описание, метки и потокобезопасное хранилище"""
+
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 registry: Optional['Registry'] = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # Методы Database вызываются из рабочих потоков, поэтому нужна блокировка
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], object] = {}
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"Метрика {self.name} ожидает метки {self.labelnames}, получены {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}'] + self._samples()
+
+
+class Counter(_Metric):
+    """Монотонно растущий счетчик"""
+
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}' for key, value in items]
+
+
+class Gauge(_Metric):
+    """
+    Текущее значение. Значения можно задавать через set() или функцией,
+    которая вызывается при каждом запросе метрик и возвращает словарь
+    {кортеж значений меток: значение}
+    """
+
+    kind = 'gauge'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._function: Optional[Callable[[], Dict[Tuple[str, ...], float]]] = None
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_function(self, function: Optional[Callable[[], Dict[Tuple[str, ...], float]]]):
+        self._function = function
+
+    def value(self, **labels) -> float:
+        return self._collect().get(self._key(labels), 0)
+
+    def _collect(self) -> Dict[Tuple[str, ...], float]:
+        if self._function is None:
+            with self._lock:
+                return dict(self._values)
+        try:
+            return {tuple(str(part) for part in key): value for key, value in self._function().items()}
+        except Exception:
+            logger.exception(f"Ошибка при вычислении метрики {self.name}")
+            return {}
+
+    def _samples(self) -> List[str]:
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+                for key, value in sorted(self._collect().items())]
+
+
+class _HistogramValue:
+    __slots__ = ('buckets', 'count', 'total')
+
+    def __init__(self, size: int):
+        self.buckets = [0] * size
+        self.count = 0
+        self.total = 0.0
+
+
+class Histogram(_Metric):
+    """Гистограмма с фиксированными границами корзин (накопительные счетчики при выводе)"""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 registry: Optional['Registry'] = None, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        # Номер первой корзины, в которую попадает значение (остальные - при выводе)
+        index = len(self.buckets)
+        for position, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = position
+                break
+        with self._lock:
+            stored = self._values.get(key)
+            if stored is None:
+                stored = self._values[key] = _HistogramValue(len(self.buckets) + 1)
+            stored.buckets[index] += 1
+            stored.count += 1
+            stored.total += value
+
+    def count(self, **labels) -> int:
+        stored = self._values.get(self._key(labels))
+        return stored.count if stored else 0
+
+    def _samples(self) -> List[str]:
+        lines = []
+        with self._lock:
+            items = sorted((key, list(value.buckets), value.count, value.total)
+                           for key, value in self._values.items())
+        for key, buckets, count, total in items:
+            cumulative = 0
+            for bound, hits in zip(self.buckets + (float('inf'),), buckets):
+                cumulative += hits
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}')
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+class Registry:
+    """Набор метрик, отдаваемых одним запросом"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+            self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        """Все метрики в текстовом формате Prometheus"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+CALLS = Counter('bot_calls_total', 'Вызовы обработчиков и методов базы данных',
+                ('component', 'method'))
+ERRORS = Counter('bot_call_errors_total', 'Вызовы, завершившиеся исключением',
+                 ('component', 'method'))
+LATENCY = Histogram('bot_call_duration_seconds', 'Время выполнения обработчиков и методов базы данных',
+                    ('component', 'method'))
+CONVERSATIONS = Gauge('bot_conversations_active', 'Незавершенные диалоги регистрации по шагам',
+                      ('state',))
+
+
+def _record(component: str, method: str, started: float, failed: bool):
+    elapsed = time.perf_counter() - started
+    CALLS.inc(component=component, method=method)
+    LATENCY.observe(elapsed, component=component, method=method)
+    if failed:
+        ERRORS.inc(component=component, method=method)
+
+
+def timed(component: str, method: str) -> Callable:
+    """Декоратор функции или корутины: число вызовов, ошибки и время выполнения"""
+    def decorator(func: Callable) -> Callable:
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                failed = True
+                try:
+                    result = await func(*args, **kwargs)
+                    failed = False
+                    return result
+                finally:
+                    _record(component, method, started, failed)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            failed = True
+            try:
+                result = func(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                _record(component, method, started, failed)
+        return wrapper
+    return decorator
+
+
+def instrument(component: str) -> Callable[[type], type]:
+    """
+    Декоратор класса: оборачивает все публичные методы и корутины в timed().
+    Генераторы (iter_*) не оборачиваются - их страницы читаются измеряемыми методами.
+    """
+    def decorator(cls: type) -> type:
+        for name, attribute in list(vars(cls).items()):
+            if (name.startswith('_') or not inspect.isfunction(attribute)
+                    or inspect.isgeneratorfunction(attribute)):
+                continue
+            setattr(cls, name, timed(component, name)(attribute))
+        return cls
+    return decorator
+
+
+def start_metrics_server(port: int, host: str = '127.0.0.1', registry: Registry = REGISTRY):
+    """
+    Запуск HTTP-сервера с метриками по адресу http://host:port/metrics в фоновом
+    потоке (не зависит от цикла событий бота). port=0 - свободный порт.
+    """
+    # http.server загружается, только если метрики включены
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsRequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # Запросы сборщика метрик не засоряют журнал бота
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True)
+    thread.start()
+    logger.info(f"Метрики доступны по адресу http://{host}:{server.server_address[1]}/metrics")
+    return server
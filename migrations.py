@@ -0,0 +1,275 @@
+"""
+Версионированные миграции схемы базы данных.
+Текущая версия схемы хранится в PRAGMA user_version, каждая миграция
+применяется в отдельной транзакции вместе с обновлением версии.
+"""
+
+import sqlite3
+import logging
+from typing import List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Заполнение счетчиков статистики по фактическим данным
+# (используется миграцией и Database.rebuild_stats_counters)
+STATS_COUNTERS_SEED = [
+    '''
+    INSERT INTO stats_counters (name, value)
+    SELECT 'users', COUNT(*) FROM users
+    UNION ALL SELECT 'events', COUNT(*) FROM events
+    UNION ALL SELECT 'registrations', COUNT(*) FROM event_registrations
+    ''',
+    '''
+    INSERT INTO stats_counters (name, value)
+    SELECT 'event:' || event_id, COUNT(*) FROM event_registrations GROUP BY event_id
+    ''',
+]
+
+# Список миграций: (версия, описание, SQL-инструкции). Только добавлять в конец!
+MIGRATIONS: List[Tuple[int, str, List[str]]] = [
+    (1, "Базовые таблицы", [
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            telegram_id INTEGER UNIQUE NOT NULL,
+            full_name TEXT NOT NULL,
+            email TEXT NOT NULL,
+            phone TEXT NOT NULL,
+            birth_date TEXT NOT NULL,
+            registration_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            description TEXT,
+            date TIMESTAMP,
+            location TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS event_registrations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            event_id INTEGER NOT NULL,
+            registration_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            FOREIGN KEY (event_id) REFERENCES events (id),
+            UNIQUE(user_id, event_id)
+        )
+        ''',
+    ]),
+    (2, "Индексы для выборок по мероприятиям и регистрациям", [
+        # get_all_events: ORDER BY date без сортировки во временном B-дереве
+        'CREATE INDEX IF NOT EXISTS idx_events_date ON events (date)',
+        # get_event_registrations: поиск по event_id, порядок по registration_date,
+        # user_id для соединения с users - все из индекса
+        '''
+        CREATE INDEX IF NOT EXISTS idx_event_registrations_event
+        ON event_registrations (event_id, registration_date, user_id)
+        ''',
+        # get_user_registrations: поиск по user_id, все нужные столбцы в индексе
+        '''
+        CREATE INDEX IF NOT EXISTS idx_event_registrations_user
+        ON event_registrations (user_id, event_id, registration_date)
+        ''',
+    ]),
+    (3, "Счетчики статистики, поддерживаемые триггерами", [
+        # Глобальные счетчики: users, events, registrations;
+        # счетчики регистраций по мероприятиям: event:<id мероприятия>
+        '''
+        CREATE TABLE IF NOT EXISTS stats_counters (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_users_insert_stats AFTER INSERT ON users
+        BEGIN
+            UPDATE stats_counters SET value = value + 1 WHERE name = 'users';
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_users_delete_stats AFTER DELETE ON users
+        BEGIN
+            UPDATE stats_counters SET value = value - 1 WHERE name = 'users';
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_events_insert_stats AFTER INSERT ON events
+        BEGIN
+            UPDATE stats_counters SET value = value + 1 WHERE name = 'events';
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_events_delete_stats AFTER DELETE ON events
+        BEGIN
+            UPDATE stats_counters SET value = value - 1 WHERE name = 'events';
+            DELETE FROM stats_counters WHERE name = 'event:' || OLD.id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_event_registrations_insert_stats AFTER INSERT ON event_registrations
+        BEGIN
+            UPDATE stats_counters SET value = value + 1 WHERE name = 'registrations';
+            INSERT INTO stats_counters (name, value) VALUES ('event:' || NEW.event_id, 1)
+            ON CONFLICT(name) DO UPDATE SET value = value + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_event_registrations_delete_stats AFTER DELETE ON event_registrations
+        BEGIN
+            UPDATE stats_counters SET value = value - 1 WHERE name = 'registrations';
+            UPDATE stats_counters SET value = value - 1 WHERE name = 'event:' || OLD.event_id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_event_registrations_move_stats
+        AFTER UPDATE OF event_id ON event_registrations
+        WHEN NEW.event_id != OLD.event_id
+        BEGIN
+            UPDATE stats_counters SET value = value - 1 WHERE name = 'event:' || OLD.event_id;
+            INSERT INTO stats_counters (name, value) VALUES ('event:' || NEW.event_id, 1)
+            ON CONFLICT(name) DO UPDATE SET value = value + 1;
+        END
+        ''',
+    ] + STATS_COUNTERS_SEED),
+    (4, "Сохранение состояния диалогов и черновиков регистрации", [
+        # Состояния ConversationHandler: имя обработчика, ключ диалога и состояние (JSON)
+        '''
+        CREATE TABLE IF NOT EXISTS conversation_states (
+            name TEXT NOT NULL,
+            conversation_key TEXT NOT NULL,
+            state TEXT NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (name, conversation_key)
+        ) WITHOUT ROWID
+        ''',
+        # context.user_data по telegram_id пользователя (JSON)
+        '''
+        CREATE TABLE IF NOT EXISTS user_data (
+            user_id INTEGER PRIMARY KEY,
+            data TEXT NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        # Для удаления устаревших записей без полного просмотра таблиц
+        'CREATE INDEX IF NOT EXISTS idx_conversation_states_updated ON conversation_states (updated_at)',
+        'CREATE INDEX IF NOT EXISTS idx_user_data_updated ON user_data (updated_at)',
+    ]),
+    (5, "Рассылки участникам мероприятий с сохранением прогресса", [
+        # cursor - курсор страницы участников, после которой продолжается рассылка
+        '''
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            event_id INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            created_by INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'running',
+            cursor TEXT,
+            delivered INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            blocked INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (event_id) REFERENCES events (id)
+        )
+        ''',
+        # Поиск незавершенных рассылок при запуске бота
+        'CREATE INDEX IF NOT EXISTS idx_broadcasts_status ON broadcasts (status)',
+    ]),
+    (6, "Число мест на мероприятиях", [
+        # capacity - всего мест, remaining - свободные (NULL - без ограничения)
+        'ALTER TABLE events ADD COLUMN capacity INTEGER',
+        'ALTER TABLE events ADD COLUMN remaining INTEGER',
+        # Остаток меняется вместе с регистрациями при любом способе записи
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_event_registrations_insert_seats AFTER INSERT ON event_registrations
+        BEGIN
+            UPDATE events SET remaining = remaining - 1 WHERE id = NEW.event_id AND remaining IS NOT NULL;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_event_registrations_delete_seats AFTER DELETE ON event_registrations
+        BEGIN
+            UPDATE events SET remaining = remaining + 1 WHERE id = OLD.event_id AND remaining IS NOT NULL;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_event_registrations_move_seats
+        AFTER UPDATE OF event_id ON event_registrations
+        WHEN NEW.event_id != OLD.event_id
+        BEGIN
+            UPDATE events SET remaining = remaining + 1 WHERE id = OLD.event_id AND remaining IS NOT NULL;
+            UPDATE events SET remaining = remaining - 1 WHERE id = NEW.event_id AND remaining IS NOT NULL;
+        END
+        ''',
+    ]),
+    (7, "Лист ожидания мероприятий", [
+        # id задает порядок очереди (порядок постановки); status: waiting - ждет,
+        # offered - место удерживается до offered_until (время Unix);
+        # notified - предложение уже отправлено пользователю
+        '''
+        CREATE TABLE IF NOT EXISTS waitlist (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            event_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'waiting',
+            offered_until REAL,
+            notified INTEGER NOT NULL DEFAULT 0,
+            joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (event_id, user_id),
+            FOREIGN KEY (event_id) REFERENCES events (id),
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+        ''',
+        # Следующие в очереди мероприятия: поиск по индексу без сортировки
+        'CREATE INDEX IF NOT EXISTS idx_waitlist_queue ON waitlist (event_id, status, id)',
+        # Истекшие и еще не отправленные предложения
+        'CREATE INDEX IF NOT EXISTS idx_waitlist_offers ON waitlist (status, offered_until)',
+    ]),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    """Текущая версия схемы базы данных"""
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def apply_migrations(conn: sqlite3.Connection) -> int:
+    """
+    Применение всех еще не примененных миграций по порядку.
+    Возвращает количество примененных миграций.
+    """
+    # Обычный запуск: схема уже актуальна, одна проверка версии без DDL
+    if get_schema_version(conn) >= MIGRATIONS[-1][0]:
+        return 0
+    
+    applied = 0
+    for version, description, statements in MIGRATIONS:
+        if get_schema_version(conn) >= version:
+            continue
+
+        # BEGIN IMMEDIATE сразу берет блокировку записи, поэтому параллельно
+        # стартующий процесс дождется нас и увидит уже обновленную версию
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if get_schema_version(conn) >= version:
+                conn.rollback()
+                continue
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(f'PRAGMA user_version = {int(version)}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            logger.error(f"Ошибка при применении миграции {version} ({description})")
+            raise
+
+        applied += 1
+        logger.info(f"Применена миграция {version}: {description}")
+    return applied
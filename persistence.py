@@ -0,0 +1,181 @@
+"""
+Сохранение состояния диалогов и черновиков регистрации в базе SQLite бота
+"""
+
+import asyncio
+import json
+import logging
+import time
+from typing import Dict, Optional, Set, Tuple
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from async_database import AsyncDatabase
+
+logger = logging.getLogger(__name__)
+
+
+class SQLitePersistence(BasePersistence):
+    """
+    Хранилище для Application.builder().persistence(...) в том же файле SQLite,
+    что и Database. Сохраняются состояния ConversationHandler и context.user_data,
+    поэтому после перезапуска пользователь продолжает регистрацию с того же шага.
+
+    - context.user_data загружается лениво: при первом обновлении от пользователя,
+      а не целиком при запуске;
+    - изменения, которые Application передает раз в update_interval секунд,
+      накапливаются и записываются одной транзакцией; неизменившиеся данные
+      пользователя повторно не пишутся;
+    - диалоги и черновики, не менявшиеся дольше max_age секунд, удаляются при
+      запуске и затем не чаще раза в gc_interval секунд.
+    """
+
+    def __init__(self, db: AsyncDatabase, update_interval: float = 1.0,
+                 max_age: float = 7 * 24 * 3600, gc_interval: float = 3600.0):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.db = db
+        self.max_age = max_age
+        self.gc_interval = gc_interval
+        self._loaded_users: Set[int] = set()
+        # Последние записанные данные пользователей (JSON) - чтобы не писать то же самое
+        self._saved_user_data: Dict[int, str] = {}
+        self._pending_users: Dict[int, Optional[Dict]] = {}
+        self._pending_conversations: Dict[Tuple[str, Tuple], object] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._last_gc: Optional[float] = None
+        # Счетчики для мониторинга
+        self._flushes = 0
+        self._rows_written = 0
+        self._unchanged = 0
+
+    async def get_conversations(self, name: str) -> Dict:
+        # Вызывается при запуске, поэтому сначала удаляем устаревшие диалоги
+        if self._last_gc is None:
+            await self._collect_garbage()
+        return await self.db.get_conversation_states(name)
+
+    async def update_conversation(self, name: str, key: Tuple, new_state: Optional[object]):
+        self._pending_conversations[(name, tuple(key))] = new_state
+        self._schedule_flush()
+
+    async def get_user_data(self) -> Dict:
+        # Данные пользователей подгружаются по одному в refresh_user_data
+        return {}
+
+    async def refresh_user_data(self, user_id: int, user_data: Dict):
+        if user_id in self._loaded_users:
+            return
+        self._loaded_users.add(user_id)
+        data = await self.db.get_user_data(user_id)
+        if data:
+            for key, value in data.items():
+                user_data.setdefault(key, value)
+            self._saved_user_data[user_id] = self._dump(data)
+
+    async def update_user_data(self, user_id: int, data: Dict):
+        if (user_id not in self._pending_users
+                and self._dump(data) == self._saved_user_data.get(user_id, self._dump({}))):
+            self._unchanged += 1
+            return
+        self._pending_users[user_id] = data
+        self._schedule_flush()
+
+    async def drop_user_data(self, user_id: int):
+        self._pending_users[user_id] = None
+        self._schedule_flush()
+
+    async def get_chat_data(self) -> Dict:
+        return {}
+
+    async def update_chat_data(self, chat_id: int, data: Dict):
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Dict):
+        pass
+
+    async def drop_chat_data(self, chat_id: int):
+        pass
+
+    async def get_bot_data(self) -> Dict:
+        return {}
+
+    async def update_bot_data(self, data: Dict):
+        pass
+
+    async def refresh_bot_data(self, bot_data: Dict):
+        pass
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def flush(self):
+        """Запись всех накопленных изменений (вызывается при остановке бота)"""
+        if self._flush_task:
+            await self._flush_task
+        await self._write_pending()
+
+    def stats(self) -> Dict:
+        """Счетчики записей и загруженных пользователей"""
+        return {
+            'loaded_users': len(self._loaded_users),
+            'pending': len(self._pending_users) + len(self._pending_conversations),
+            'flushes': self._flushes,
+            'rows_written': self._rows_written,
+            'unchanged': self._unchanged,
+        }
+
+    @staticmethod
+    def _dump(data: Optional[Dict]) -> str:
+        return json.dumps(data or {}, ensure_ascii=False, sort_keys=True)
+
+    def _schedule_flush(self):
+        """Одна задача записи на все изменения, переданные за текущий проход"""
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_soon())
+
+    async def _flush_soon(self):
+        # Application вызывает update_* для всех измененных ключей через gather;
+        # уступаем цикл событий, чтобы все они попали в одну транзакцию
+        await asyncio.sleep(0)
+        await self._write_pending()
+        if self._last_gc is not None and time.monotonic() - self._last_gc >= self.gc_interval:
+            await self._collect_garbage()
+
+    async def _write_pending(self):
+        if not self._pending_users and not self._pending_conversations:
+            return
+        users, self._pending_users = self._pending_users, {}
+        conversations, self._pending_conversations = self._pending_conversations, {}
+        try:
+            await self.db.save_conversation_state(users, conversations)
+        except Exception:
+            # Вернем изменения в очередь (кроме перезаписанных за это время) до следующей записи
+            logger.exception("Ошибка при сохранении состояния диалогов")
+            self._pending_users = {**users, **self._pending_users}
+            self._pending_conversations = {**conversations, **self._pending_conversations}
+            return
+
+        for user_id, data in users.items():
+            if data:
+                self._saved_user_data[user_id] = self._dump(data)
+            else:
+                self._saved_user_data.pop(user_id, None)
+        self._flushes += 1
+        self._rows_written += len(users) + len(conversations)
+
+    async def _collect_garbage(self):
+        self._last_gc = time.monotonic()
+        try:
+            purged = await self.db.purge_stale_conversation_state(self.max_age)
+        except Exception:
+            logger.exception("Ошибка при удалении устаревших диалогов")
+            return
+        if purged['user_data']:
+            # Удаленные черновики еще активных пользователей будут записаны заново
+            self._saved_user_data.clear()
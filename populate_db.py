@@ -40,19 +40,11 @@ def main():
     # Генерация случайных данных
     users = generate_random_data()
     
-    # Добавление пользователей в базу данных
-    for user in users:
-        user_id = db.add_user(
-            telegram_id=user['telegram_id'],
-            full_name=user['full_name'],
-            email=user['email'],
-            phone=user['phone'],
-            birth_date=user['birth_date']
-        )
-        if user_id:
-            print(f"Добавлен пользователь: {user['full_name']}, ID: {user_id}")
-        else:
-            print(f"Ошибка при добавлении пользователя: {user['full_name']}")
+    # Добавление пользователей в базу данных одной пачкой, с проверкой теми же
+    # правилами, что и в диалоге регистрации
+    result = db.add_users_bulk(users, validate=True)
+    print(f"Добавлено пользователей: {result['inserted']}, уже существовали: {result['duplicates']}, "
+          f"некорректных: {result['invalid']}")
     
     # Создание нескольких тестовых мероприятий
     events = [
@@ -90,6 +82,7 @@ def main():
     
     # Случайным образом регистрируем пользователей на мероприятия
     all_events = db.get_all_events()
+    attendees = {event['id']: [] for event in all_events}
     for user in users:
         user_db = db.get_user_by_telegram_id(user['telegram_id'])
         if user_db:
@@ -98,8 +91,12 @@ def main():
             selected_events = random.sample(all_events, min(num_events, len(all_events)))
             
             for event in selected_events:
-                db.register_user_for_event(user_db['id'], event['id'])
-                print(f"Пользователь {user_db['full_name']} зарегистрирован на мероприятие '{event['title']}'")
+                attendees[event['id']].append(user_db['id'])
+    
+    for event in all_events:
+        result = db.register_users_for_event_bulk(event['id'], attendees[event['id']])
+        print(f"На мероприятие '{event['title']}' зарегистрировано: {result['inserted']}, "
+              f"уже были зарегистрированы: {result['duplicates']}")
     
     print("\nБаза данных успешно заполнена случайными данными!")
     
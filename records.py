@@ -0,0 +1,105 @@
+"""
+Компактные неизменяемые записи для строк из базы данных
+"""
+
+from operator import itemgetter
+from typing import Any, Dict, Iterator, Tuple
+
+
+class Record(tuple):
+    """
+    Неизменяемая запись на основе кортежа (без __dict__ у экземпляров).
+    Поддерживает доступ как у словаря (record['full_name'], get, keys, items,
+    dict(record)), по индексу и как к атрибуту (record.full_name). Поля задаются
+    в _fields подкласса; row_factory создает записи прямо из курсора SQLite.
+
+    Остальное - как у кортежа: in, итерация, len() и json.dumps работают со
+    значениями, а не с именами полей. Где нужен настоящий словарь (проверка
+    'email' in ..., сериализация в JSON), используйте _asdict().
+    """
+
+    __slots__ = ()
+    _fields: Tuple[str, ...] = ()
+    _index: Dict[str, int] = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._index = {name: i for i, name in enumerate(cls._fields)}
+        for i, name in enumerate(cls._fields):
+            setattr(cls, name, property(itemgetter(i), doc=f"Поле {name}"))
+
+    @classmethod
+    def row_factory(cls, cursor, row: tuple) -> 'Record':
+        """Фабрика строк для sqlite3.Cursor.row_factory"""
+        return tuple.__new__(cls, row)
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            try:
+                key = self._index[key]
+            except KeyError:
+                raise KeyError(key) from None
+        return tuple.__getitem__(self, key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """Значение поля или default, если такого поля нет"""
+        index = self._index.get(key)
+        return default if index is None else tuple.__getitem__(self, index)
+
+    def keys(self) -> Tuple[str, ...]:
+        """Имена полей"""
+        return self._fields
+
+    def values(self) -> Tuple:
+        """Значения полей"""
+        return tuple(self)
+
+    def items(self) -> Iterator[Tuple[str, Any]]:
+        """Пары (поле, значение)"""
+        return zip(self._fields, self)
+
+    def _asdict(self) -> Dict[str, Any]:
+        """Обычный словарь с полями записи"""
+        return dict(zip(self._fields, self))
+
+    def __repr__(self) -> str:
+        fields = ', '.join(f"{name}={value!r}" for name, value in zip(self._fields, self))
+        return f"{type(self).__name__}({fields})"
+
+
+class UserRecord(Record):
+    """Пользователь"""
+    __slots__ = ()
+    _fields = ('id', 'telegram_id', 'full_name', 'email', 'phone', 'birth_date', 'registration_date')
+
+
+class EventRecord(Record):
+    """Мероприятие (capacity и remaining - число мест и свободные места, None - без ограничения)"""
+    __slots__ = ()
+    _fields = ('id', 'title', 'description', 'date', 'location', 'created_at', 'capacity', 'remaining')
+
+
+class RegistrationRecord(Record):
+    """Участник мероприятия (регистрация вместе с данными пользователя)"""
+    __slots__ = ()
+    _fields = ('registration_id', 'user_id', 'telegram_id', 'full_name', 'email',
+               'phone', 'birth_date', 'registration_date')
+
+
+class UserRegistrationRecord(Record):
+    """Мероприятие, на которое зарегистрирован пользователь"""
+    __slots__ = ()
+    _fields = ('event_id', 'title', 'description', 'date', 'location', 'registration_date')
+
+
+class BroadcastRecord(Record):
+    """Рассылка участникам мероприятия и ее прогресс"""
+    __slots__ = ()
+    _fields = ('id', 'event_id', 'text', 'created_by', 'status', 'cursor',
+               'delivered', 'failed', 'blocked', 'created_at', 'updated_at')
+
+
+class WaitlistOfferRecord(Record):
+    """Предложение места из листа ожидания для отправки пользователю"""
+    __slots__ = ()
+    _fields = ('waitlist_id', 'event_id', 'telegram_id', 'title', 'offered_until')
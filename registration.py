@@ -1,13 +1,62 @@
-from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove
+from telegram import (Update, KeyboardButton, ReplyKeyboardMarkup, ReplyKeyboardRemove,
+                      InlineKeyboardButton, InlineKeyboardMarkup)
+from telegram.error import BadRequest
 from telegram.ext import ContextTypes, ConversationHandler
-import re
-from database import Database
+import os
+import asyncio
+import tempfile
+from typing import Optional, Tuple, Union
+from database import (Database, EXPORT_FORMATS, EVENTS_PAGE_SIZE, RESERVATION_REGISTERED,
+                      RESERVATION_DUPLICATE, RESERVATION_FULL, RESERVATION_EXPIRED)
+from async_database import AsyncDatabase
+from dispatcher import PerUserUpdateProcessor
+from scheduler import SendScheduler
+from broadcast import Broadcaster
+from waitlist import WaitlistPromoter
+from metrics import instrument
+from tracing import trace_class, PROFILER
+from validators import (validate_name, validate_email, validate_phone, validate_birth_date,
+                        parse_registration, ERROR_FUTURE)
 from constants import *
-from config import ADMIN_IDS
+from config import ADMIN_IDS, WAITLIST_SWEEP_SECONDS
 
+# Как часто обновлять сообщение о ходе выгрузки (секунды)
+EXPORT_PROGRESS_INTERVAL = 2.0
+# Длительность профилирования по /profile: по умолчанию и максимум (секунды)
+PROFILE_DEFAULT_SECONDS = 10
+PROFILE_MAX_SECONDS = 120
+
+# Шаги регистрации: состояние диалога, поле context.user_data и вопрос
+REGISTRATION_STEPS = (
+    (NAME, 'full_name', NAME_REQUEST),
+    (EMAIL, 'email', EMAIL_REQUEST),
+    (PHONE, 'phone', PHONE_REQUEST),
+    (BIRTH_DATE, 'birth_date', BIRTH_DATE_REQUEST),
+)
+REGISTRATION_FIELDS = tuple(field for _, field, _ in REGISTRATION_STEPS)
+
+# Кнопки списка /events: ev:p:<курсор> - страница, ev:r:<ID>:<курсор> - запись
+# на мероприятие со страницы <курсор> (пустой курсор - первая страница).
+# Курсор страницы занимает до ~40 байт, в лимит callback_data (64 байта) помещается
+EVENTS_CALLBACK_PATTERN = r'^ev:'
+
+@trace_class('handler', root=True)
+@instrument('handler')
 class RegistrationHandler:
-    def __init__(self, db: Database):
+    def __init__(self, db: Union[Database, AsyncDatabase]):
+        # Обращения к SQLite выполняются вне цикла событий
+        if not isinstance(db, AsyncDatabase):
+            db = AsyncDatabase(db)
         self.db = db
+        # Фоновые рассылки участникам мероприятий
+        self.broadcaster = Broadcaster(db)
+        # Предложения мест из листа ожидания
+        self.waitlist = WaitlistPromoter(db, sweep_interval=WAITLIST_SWEEP_SECONDS)
+    
+    def is_admin(self, update: Update) -> bool:
+        """Проверка, является ли пользователь администратором"""
+        # ADMIN_IDS содержит числа, поэтому сравниваем числовой ID
+        return update.effective_user.id in ADMIN_IDS
     
     def format_birth_date_display(self, birth_date_str):
         """
@@ -33,7 +82,7 @@ class RegistrationHandler:
         """Обработка команды /start"""
         keyboard = [
             ['/register', '/my_info'],
-            ['/help']
+            ['/events', '/help']
         ]
         reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
         
@@ -47,21 +96,70 @@ class RegistrationHandler:
         await update.message.reply_text(HELP_MESSAGE)
     
     async def register_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Начало процесса регистрации"""
-        user = self.db.get_user_by_telegram_id(update.effective_user.id)
+        """
+        Начало процесса регистрации. Данные можно передать сразу:
+        /register <имя, email, телефон, дата рождения> - тогда бот спрашивает
+        только недостающие или некорректные поля
+        """
+        user = await self.db.get_user_by_telegram_id(update.effective_user.id)
         if user:
             await update.message.reply_text(
                 "Вы уже зарегистрированы. Если хотите обновить информацию, напишите об этом администратору."
             )
             return ConversationHandler.END
         
+        # Черновик прошлой незавершенной регистрации не используем
+        for field in REGISTRATION_FIELDS:
+            context.user_data.pop(field, None)
+        
+        errors = {}
+        parts = (update.message.text or '').split(maxsplit=1)
+        if len(parts) > 1:
+            values, errors = parse_registration(parts[1])
+            context.user_data.update(values)
+        return await self._next_step(update, context, errors)
+    
+    async def _next_step(self, update: Update, context: ContextTypes.DEFAULT_TYPE,
+                         errors=None, current: int = -1):
+        """
+        Вопрос о следующем незаполненном поле (после шага current, затем
+        пропущенные раньше) или, если заполнены все, подтверждение данных.
+        Одно исходящее сообщение на шаг.
+        """
+        prefix = ""
+        if errors:
+            fields = ", ".join(FIELD_TITLES[field] for field in REGISTRATION_FIELDS if field in errors)
+            prefix = INVALID_FIELDS.format(fields=fields) + "\n\n"
+        
+        steps = REGISTRATION_STEPS[current + 1:] + REGISTRATION_STEPS[:current + 1]
+        for state, field, request in steps:
+            if field in context.user_data:
+                continue
+            keyboard = [[CANCEL_BUTTON]]
+            if state == PHONE:
+                keyboard = [[KeyboardButton(CONTACT_BUTTON, request_contact=True)], [CANCEL_BUTTON]]
+            await update.message.reply_text(
+                prefix + request,
+                reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+            )
+            return state
+        
+        # Показываем пользователю его данные для подтверждения
+        # Форматируем дату рождения для отображения
+        birth_date_display = self.format_birth_date_display(context.user_data['birth_date'])
+        
         await update.message.reply_text(
-            NAME_REQUEST,
+            f"{prefix}Пожалуйста, подтвердите ваши данные:\n\n"
+            f"Имя: {context.user_data['full_name']}\n"
+            f"Email: {context.user_data['email']}\n"
+            f"Телефон: {context.user_data['phone']}\n"
+            f"Дата рождения: {birth_date_display}\n\n"
+            f"Нажмите '{CONFIRM_BUTTON}' для подтверждения или '{CANCEL_BUTTON}' для отмены.",
             reply_markup=ReplyKeyboardMarkup(
-                [[CANCEL_BUTTON]], resize_keyboard=True
+                [[CONFIRM_BUTTON, CANCEL_BUTTON]], resize_keyboard=True
             )
         )
-        return NAME
+        return CONFIRM
     
     async def get_name(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Получение имени пользователя"""
@@ -72,14 +170,13 @@ class RegistrationHandler:
             )
             return ConversationHandler.END
         
-        context.user_data['full_name'] = update.message.text
-        await update.message.reply_text(
-            EMAIL_REQUEST,
-            reply_markup=ReplyKeyboardMarkup(
-                [[CANCEL_BUTTON]], resize_keyboard=True
-            )
-        )
-        return EMAIL
+        name = validate_name(update.message.text)
+        if not name.ok:
+            await update.message.reply_text(INVALID_NAME)
+            return NAME
+        
+        context.user_data['full_name'] = name.value
+        return await self._next_step(update, context, current=NAME)
     
     async def get_email(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Получение email пользователя"""
@@ -90,20 +187,13 @@ class RegistrationHandler:
             )
             return ConversationHandler.END
         
-        email = update.message.text
-        # Проверка формата email
-        if not re.match(r"[^@]+@[^@]+\.[^@]+", email):
+        email = validate_email(update.message.text)
+        if not email.ok:
             await update.message.reply_text(INVALID_EMAIL)
             return EMAIL
         
-        context.user_data['email'] = email
-        await update.message.reply_text(
-            PHONE_REQUEST,
-            reply_markup=ReplyKeyboardMarkup(
-                [[CANCEL_BUTTON]], resize_keyboard=True
-            )
-        )
-        return PHONE
+        context.user_data['email'] = email.value
+        return await self._next_step(update, context, current=EMAIL)
     
     async def get_phone(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Получение номера телефона пользователя"""
@@ -114,20 +204,31 @@ class RegistrationHandler:
             )
             return ConversationHandler.END
         
-        phone = update.message.text
-        # Проверка формата номера телефона (упрощенная)
-        if not re.match(r'^[\+]?[1-9][\d]{3,14}$', phone.replace(' ', '').replace('-', '').replace('(', '').replace(')', '')):
+        phone = validate_phone(update.message.text)
+        if not phone.ok:
             await update.message.reply_text(INVALID_PHONE)
             return PHONE
         
-        context.user_data['phone'] = phone
-        await update.message.reply_text(
-            BIRTH_DATE_REQUEST,
-            reply_markup=ReplyKeyboardMarkup(
-                [[CANCEL_BUTTON]], resize_keyboard=True
-            )
-        )
-        return BIRTH_DATE
+        context.user_data['phone'] = phone.value
+        return await self._next_step(update, context, current=PHONE)
+    
+    async def get_contact(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Номер телефона из отправленного контакта (кнопка на шаге телефона)"""
+        contact = update.message.contact
+        # Принимаем только собственный контакт пользователя
+        if contact.user_id != update.effective_user.id:
+            await update.message.reply_text(INVALID_CONTACT)
+            return PHONE
+        
+        # Telegram присылает номер без "+"
+        number = contact.phone_number
+        phone = validate_phone(number if number.startswith('+') else f"+{number}")
+        if not phone.ok:
+            await update.message.reply_text(INVALID_PHONE)
+            return PHONE
+        
+        context.user_data['phone'] = phone.value
+        return await self._next_step(update, context, current=PHONE)
     
     async def get_birth_date(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Получение даты рождения пользователя"""
@@ -138,42 +239,14 @@ class RegistrationHandler:
             )
             return ConversationHandler.END
         
-        birth_date = update.message.text
-        # Проверка формата даты рождения (ДД.ММ.ГГГГ)
-        if not re.match(r'^\d{2}\.\d{2}\.\d{4}$', birth_date):
-            await update.message.reply_text(INVALID_DATE)
+        # Формат ДД.ММ.ГГГГ, существующая дата, не в будущем
+        birth_date = validate_birth_date(update.message.text)
+        if not birth_date.ok:
+            await update.message.reply_text(INVALID_DATE_FUTURE if birth_date.error == ERROR_FUTURE else INVALID_DATE)
             return BIRTH_DATE
         
-        # Проверка корректности даты
-        try:
-            day, month, year = map(int, birth_date.split('.'))
-            from datetime import datetime
-            birth_date_obj = datetime(year, month, day)
-            if birth_date_obj > datetime.now():
-                await update.message.reply_text(INVALID_DATE + " Дата не может быть в будущем.")
-                return BIRTH_DATE
-        except ValueError:
-            await update.message.reply_text(INVALID_DATE)
-            return BIRTH_DATE
-        
-        context.user_data['birth_date'] = birth_date
-        
-        # Показываем пользователю его данные для подтверждения
-        # Форматируем дату рождения для отображения
-        birth_date_display = self.format_birth_date_display(context.user_data['birth_date'])
-        
-        await update.message.reply_text(
-            f"Пожалуйста, подтвердите ваши данные:\n\n"
-            f"Имя: {context.user_data['full_name']}\n"
-            f"Email: {context.user_data['email']}\n"
-            f"Телефон: {context.user_data['phone']}\n"
-            f"Дата рождения: {birth_date_display}\n\n"
-            f"Нажмите '{CONFIRM_BUTTON}' для подтверждения или '{CANCEL_BUTTON}' для отмены.",
-            reply_markup=ReplyKeyboardMarkup(
-                [[CONFIRM_BUTTON, CANCEL_BUTTON]], resize_keyboard=True
-            )
-        )
-        return CONFIRM
+        context.user_data['birth_date'] = birth_date.value
+        return await self._next_step(update, context, current=BIRTH_DATE)
     
     async def confirm_registration(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Подтверждение регистрации"""
@@ -182,7 +255,7 @@ class RegistrationHandler:
         
         if CONFIRM_BUTTON in user_text or 'Подтвердить' in user_text or 'подтвердить' in user_text:
             # Сохраняем пользователя в базу данных
-            user_id = self.db.add_user(
+            user_id = await self.db.add_user(
                 telegram_id=update.effective_user.id,
                 full_name=context.user_data['full_name'],
                 email=context.user_data['email'],
@@ -230,7 +303,7 @@ class RegistrationHandler:
     
     async def my_info_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Показать информацию о пользователе"""
-        user = self.db.get_user_by_telegram_id(update.effective_user.id)
+        user = await self.db.get_user_by_telegram_id(update.effective_user.id)
         if user:
             # Форматируем дату рождения для отображения
             birth_date_display = self.format_birth_date_display(user['birth_date'])
@@ -248,17 +321,181 @@ class RegistrationHandler:
                 "Вы не зарегистрированы. Используйте команду /register для регистрации."
             )
     
+    async def events_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Список ближайших мероприятий с записью в одно нажатие"""
+        text, reply_markup = await self._events_page(update.effective_user.id, None)
+        await update.message.reply_text(text, reply_markup=reply_markup)
+    
+    async def events_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """
+        Нажатие кнопки списка мероприятий: листание или запись. Сообщение со
+        списком редактируется на месте, новые сообщения не отправляются.
+        """
+        query = update.callback_query
+        parts = query.data.split(':', 3)
+        if len(parts) == 3 and parts[1] == 'p':
+            cursor = parts[2] or None
+            # Ответ на нажатие убирает индикатор загрузки на кнопке
+            await query.answer()
+        elif len(parts) == 4 and parts[1] == 'r' and parts[2].isdigit():
+            cursor = parts[3] or None
+            await self._register_for_event(query, update.effective_user.id, int(parts[2]))
+        else:
+            await query.answer()
+            return
+        
+        text, reply_markup = await self._events_page(update.effective_user.id, cursor)
+        try:
+            await query.edit_message_text(text, reply_markup=reply_markup)
+        except BadRequest as exc:
+            # Повторное нажатие: Telegram не принимает редактирование без изменений
+            if 'not modified' not in str(exc).lower():
+                raise
+    
+    async def _register_for_event(self, query, telegram_id: int, event_id: int):
+        """Запись на мероприятие по кнопке; результат - во всплывающем уведомлении"""
+        user = await self.db.get_user_by_telegram_id(telegram_id)
+        if not user:
+            await query.answer(EVENTS_NEED_PROFILE, show_alert=True)
+            return
+        event = await self.db.get_event(event_id)
+        if not event:
+            await query.answer(EVENT_NOT_FOUND)
+            return
+        
+        # Место занимается атомарно: при одновременных нажатиях лимит не превышается
+        reservation = await self.db.reserve_seat(user['id'], event_id)
+        if reservation.status == RESERVATION_FULL:
+            # Мест нет - в лист ожидания. Если место уже удерживается для
+            # пользователя (позиция 0), нажатие на мероприятие его подтверждает
+            position = await self.db.join_waitlist(user['id'], event_id)
+            if position:
+                await query.answer(WAITLIST_JOINED.format(position=position), show_alert=True)
+                return
+            if position == 0:
+                reservation = await self.db.confirm_waitlist_offer(user['id'], event_id)
+            else:
+                reservation = reservation._replace(status=RESERVATION_DUPLICATE)
+        
+        if reservation.status == RESERVATION_REGISTERED:
+            await query.answer(EVENT_REGISTERED.format(title=event['title']))
+        elif reservation.status == RESERVATION_DUPLICATE:
+            await query.answer(EVENT_ALREADY_REGISTERED)
+        elif reservation.status == RESERVATION_EXPIRED:
+            await query.answer(WAITLIST_OFFER_EXPIRED, show_alert=True)
+        else:
+            await query.answer(EVENT_NOT_FOUND)
+    
+    async def _events_page(self, telegram_id: int,
+                           cursor: Optional[str]) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+        """Текст и клавиатура страницы списка мероприятий"""
+        try:
+            events, next_cursor = await self.db.get_upcoming_events_page(EVENTS_PAGE_SIZE, cursor)
+        except ValueError:
+            # Кнопка из старого сообщения с непонятным курсором - показываем начало списка
+            cursor = None
+            events, next_cursor = await self.db.get_upcoming_events_page(EVENTS_PAGE_SIZE)
+        if not events:
+            return EVENTS_EMPTY, None
+        
+        # Страницы берутся из кэша, а свободные места - всегда из базы
+        seats = await self.db.get_remaining_seats(event.id for event in events)
+        # Мероприятия, на которые пользователь уже записан, отмечаются галочкой
+        registered = set()
+        user = await self.db.get_user_by_telegram_id(telegram_id)
+        if user:
+            registered = {registration.event_id for registration in await self.db.get_user_registrations(user['id'])}
+        
+        lines = [EVENTS_HEADER]
+        keyboard = []
+        page = cursor or ''
+        for event in events:
+            mark = '✅ ' if event.id in registered else ''
+            line = f"\n{mark}{event.title} (ID {event.id})\n📅 {event.date}  📍 {event.location}"
+            remaining = seats.get(event.id)
+            if remaining is not None:
+                line += f"  🎟 свободных мест: {remaining}" if remaining else "  🎟 мест нет"
+            lines.append(line)
+            keyboard.append([InlineKeyboardButton(f"{mark}{event.title}",
+                                                  callback_data=f"ev:r:{event.id}:{page}")])
+        
+        navigation = []
+        if cursor:
+            navigation.append(InlineKeyboardButton(EVENTS_FIRST_PAGE_BUTTON, callback_data='ev:p:'))
+        if next_cursor:
+            navigation.append(InlineKeyboardButton(EVENTS_NEXT_PAGE_BUTTON, callback_data=f"ev:p:{next_cursor}"))
+        if navigation:
+            keyboard.append(navigation)
+        return "\n".join(lines), InlineKeyboardMarkup(keyboard)
+    
+    async def waitlist_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Подтверждение или отказ от места, предложенного из листа ожидания"""
+        query = update.callback_query
+        parts = query.data.split(':')
+        if len(parts) != 3 or parts[1] not in ('y', 'n') or not parts[2].isdigit():
+            await query.answer()
+            return
+        event_id = int(parts[2])
+        user = await self.db.get_user_by_telegram_id(update.effective_user.id)
+        event = await self.db.get_event(event_id)
+        if not user or not event:
+            await query.answer(EVENT_NOT_FOUND)
+            return
+        
+        if parts[1] == 'y':
+            reservation = await self.db.confirm_waitlist_offer(user['id'], event_id)
+            if reservation.status == RESERVATION_REGISTERED:
+                text = EVENT_REGISTERED.format(title=event['title'])
+            elif reservation.status == RESERVATION_DUPLICATE:
+                text = EVENT_ALREADY_REGISTERED
+            else:
+                text = WAITLIST_OFFER_EXPIRED
+        else:
+            await self.db.leave_waitlist(user['id'], event_id)
+            text = WAITLIST_DECLINED
+        # Место могло перейти следующему в очереди - отправляем ему предложение сразу
+        self.waitlist.wake()
+        await query.answer()
+        # Кнопки убираются, чтобы предложение нельзя было использовать повторно
+        await query.edit_message_text(text)
+    
+    async def unregister_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Отмена записи на мероприятие или выход из листа ожидания: /unregister <event_id>"""
+        args = context.args or []
+        if len(args) != 1 or not args[0].isdigit():
+            await update.message.reply_text("Использование: /unregister <ID мероприятия>")
+            return
+        
+        event_id = int(args[0])
+        user = await self.db.get_user_by_telegram_id(update.effective_user.id)
+        event = await self.db.get_event(event_id)
+        if not user or not event:
+            await update.message.reply_text(UNREGISTER_NOT_FOUND)
+            return
+        
+        if await self.db.cancel_registration(user['id'], event_id):
+            # Освободившееся место уже предложено следующему, осталось отправить сообщение
+            self.waitlist.wake()
+            await update.message.reply_text(UNREGISTER_DONE.format(title=event['title']))
+        elif await self.db.leave_waitlist(user['id'], event_id):
+            self.waitlist.wake()
+            await update.message.reply_text(UNREGISTER_WAITLIST_LEFT.format(title=event['title']))
+        else:
+            await update.message.reply_text(UNREGISTER_NOT_FOUND)
+    
     # Функции для админ-панели
     async def admin_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Команда для администратора"""
         # Проверяем, является ли пользователь администратором
-        if str(update.effective_user.id) not in ADMIN_IDS:
+        if not self.is_admin(update):
             await update.message.reply_text("У вас нет прав администратора.")
             return
         
         keyboard = [
             ['/stats', '/new_event'],
-            ['/events_list']
+            ['/events_list', '/export'],
+            ['/broadcast', '/rebuild_stats'],
+            ['/capacity', '/profile']
         ]
         reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
         
@@ -270,23 +507,211 @@ class RegistrationHandler:
     async def stats_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Показать статистику регистрации"""
         # Проверяем, является ли пользователь администратором
-        if str(update.effective_user.id) not in ADMIN_IDS:
+        if not self.is_admin(update):
             await update.message.reply_text("У вас нет прав администратора.")
             return
         
-        stats = self.db.get_registration_stats()
+        stats = await self.db.get_registration_stats()
+        text = (
+            f"{ADMIN_STATS_MESSAGE}\n\n"
+            f"Всего пользователей: {stats['total_users']}\n"
+            f"Всего мероприятий: {stats['total_events']}\n"
+            f"Всего регистраций: {stats['total_registrations']}"
+        )
+        
+        # Загрузка обработчика обновлений, если включена параллельная обработка
+        processor = context.application.update_processor
+        if isinstance(processor, PerUserUpdateProcessor):
+            load = processor.stats()
+            text += (
+                f"\n\nОчередь обновлений: {context.application.update_queue.qsize() + load['pending']}\n"
+                f"Обрабатывается: {load['in_flight']} из {load['max_concurrent']}, "
+                f"ожидает: {load['waiting']}\n"
+                f"Ожидание своей очереди: в среднем {load['user_wait_avg'] * 1000:.0f} мс, "
+                f"максимум {load['user_wait_max'] * 1000:.0f} мс"
+            )
+        
+        # Задержка исходящих сообщений в очереди планировщика
+        scheduler = getattr(context.bot, 'rate_limiter', None)
+        if isinstance(scheduler, SendScheduler):
+            sending = scheduler.stats()
+            for name, lane in sending['lanes'].items():
+                text += (
+                    f"\nОтправка ({name}): {lane['sent']}, в очереди {lane['queued']}, "
+                    f"задержка в среднем {lane['latency_avg'] * 1000:.0f} мс"
+                )
+        
+        await update.message.reply_text(text)
+    
+    async def rebuild_stats_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Пересчет счетчиков статистики по фактическим данным"""
+        # Проверяем, является ли пользователь администратором
+        if not self.is_admin(update):
+            await update.message.reply_text("У вас нет прав администратора.")
+            return
+        
+        stats = await self.db.rebuild_stats_counters()
         
         await update.message.reply_text(
-            f"{ADMIN_STATS_MESSAGE}\n\n"
+            f"Счетчики статистики пересчитаны.\n\n"
             f"Всего пользователей: {stats['total_users']}\n"
             f"Всего мероприятий: {stats['total_events']}\n"
             f"Всего регистраций: {stats['total_registrations']}"
         )
     
+    async def export_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Выгрузка участников мероприятия: /export <event_id> [csv|ndjson]"""
+        # Проверяем, является ли пользователь администратором
+        if not self.is_admin(update):
+            await update.message.reply_text("У вас нет прав администратора.")
+            return
+        
+        args = context.args or []
+        fmt = args[1].lower() if len(args) > 1 else 'csv'
+        if not args or not args[0].isdigit() or fmt not in EXPORT_FORMATS:
+            await update.message.reply_text("Использование: /export <ID мероприятия> [csv|ndjson]")
+            return
+        
+        event_id = int(args[0])
+        event = await self.db.get_event(event_id)
+        if not event:
+            await update.message.reply_text(f"Мероприятие с ID {event_id} не найдено.")
+            return
+        
+        total = await self.db.get_event_registration_count(event_id)
+        status = await update.message.reply_text(
+            f"Выгрузка участников мероприятия '{event['title']}' ({total})..."
+        )
+        
+        # Счетчик обновляется из рабочего потока базы данных после каждой страницы
+        progress = {'rows': 0}
+        fd, path = tempfile.mkstemp(suffix=f'.{fmt}.gz')
+        os.close(fd)
+        try:
+            export = asyncio.ensure_future(self.db.export_event_registrations(
+                event_id, path, fmt, progress=lambda rows: progress.__setitem__('rows', rows)
+            ))
+            reported = 0
+            while True:
+                done, _ = await asyncio.wait({export}, timeout=EXPORT_PROGRESS_INTERVAL)
+                if done:
+                    break
+                # Telegram отклоняет редактирование без изменений текста
+                if progress['rows'] != reported:
+                    reported = progress['rows']
+                    await status.edit_text(f"Выгрузка участников: {reported} из {total}...")
+            rows = export.result()
+            
+            with open(path, 'rb') as document:
+                await update.message.reply_document(
+                    document=document,
+                    filename=f"event_{event_id}_attendees.{fmt}.gz",
+                    caption=f"Участники мероприятия '{event['title']}': {rows}"
+                )
+        finally:
+            os.remove(path)
+    
+    async def broadcast_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Рассылка участникам мероприятия: /broadcast <event_id> <текст>"""
+        # Проверяем, является ли пользователь администратором
+        if not self.is_admin(update):
+            await update.message.reply_text("У вас нет прав администратора.")
+            return
+        
+        # Текст берем из сообщения целиком, чтобы сохранить переносы строк
+        parts = update.message.text.split(maxsplit=2)
+        if len(parts) < 3 or not parts[1].isdigit():
+            active = await self.db.get_active_broadcasts()
+            lines = ["Использование: /broadcast <ID мероприятия> <текст сообщения>"]
+            for broadcast in active:
+                lines.append(
+                    f"Рассылка #{broadcast.id} (мероприятие {broadcast.event_id}): "
+                    f"доставлено {broadcast.delivered}, ошибок {broadcast.failed}, "
+                    f"заблокировали {broadcast.blocked}"
+                )
+            await update.message.reply_text("\n".join(lines))
+            return
+        
+        event_id, text = int(parts[1]), parts[2]
+        event = await self.db.get_event(event_id)
+        if not event:
+            await update.message.reply_text(f"Мероприятие с ID {event_id} не найдено.")
+            return
+        
+        total = await self.db.get_event_registration_count(event_id)
+        broadcast_id = await self.db.create_broadcast(event_id, text, update.effective_user.id)
+        self.broadcaster.start(context.bot, broadcast_id)
+        await update.message.reply_text(
+            f"Рассылка #{broadcast_id} участникам мероприятия '{event['title']}' ({total}) запущена. "
+            f"Итоги придут отдельным сообщением."
+        )
+    
+    async def profile_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Профилирование бота: /profile [секунд]; отчет cProfile приходит файлом"""
+        # Проверяем, является ли пользователь администратором
+        if not self.is_admin(update):
+            await update.message.reply_text("У вас нет прав администратора.")
+            return
+        
+        args = context.args or []
+        if args and (not args[0].isdigit() or not 0 < int(args[0]) <= PROFILE_MAX_SECONDS):
+            await update.message.reply_text(f"Использование: /profile [секунд, от 1 до {PROFILE_MAX_SECONDS}]")
+            return
+        if PROFILER.running:
+            await update.message.reply_text("Профилирование уже выполняется.")
+            return
+        
+        seconds = int(args[0]) if args else PROFILE_DEFAULT_SECONDS
+        await update.message.reply_text(f"Профилирование {seconds} с, отчет придет отдельным сообщением.")
+        # Снимаем профиль в фоне: обработка обновлений (в том числе этого
+        # администратора) во время замера не должна ждать
+        context.application.create_task(self._send_profile(update, seconds))
+    
+    async def _send_profile(self, update: Update, seconds: int):
+        """Снятие профиля и отправка отчета администратору файлом"""
+        try:
+            report = await PROFILER.capture(seconds)
+        except RuntimeError as exc:
+            await update.message.reply_text(str(exc))
+            return
+        await update.message.reply_document(
+            document=report.encode('utf-8'),
+            filename=f"profile_{seconds}s.txt",
+            caption=f"Профиль за {seconds} с (по суммарному времени)"
+        )
+    
+    async def capacity_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Число мест на мероприятии: /capacity <event_id> <мест|off>"""
+        # Проверяем, является ли пользователь администратором
+        if not self.is_admin(update):
+            await update.message.reply_text("У вас нет прав администратора.")
+            return
+        
+        args = context.args or []
+        if len(args) != 2 or not args[0].isdigit() or not (args[1].isdigit() or args[1].lower() == 'off'):
+            await update.message.reply_text("Использование: /capacity <ID мероприятия> <число мест|off>")
+            return
+        
+        event_id = int(args[0])
+        capacity = None if args[1].lower() == 'off' else int(args[1])
+        if not await self.db.set_event_capacity(event_id, capacity):
+            await update.message.reply_text(f"Мероприятие с ID {event_id} не найдено.")
+            return
+        # Новые места могли достаться листу ожидания
+        self.waitlist.wake()
+        
+        event = await self.db.get_event(event_id)
+        if capacity is None:
+            await update.message.reply_text(f"Ограничение мест на '{event['title']}' снято.")
+        else:
+            await update.message.reply_text(
+                f"Мест на '{event['title']}': {capacity}, свободно: {event['remaining']}."
+            )
+    
     async def new_event_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Начать создание нового мероприятия (заглушка)"""
         # Проверяем, является ли пользователь администратором
-        if str(update.effective_user.id) not in ADMIN_IDS:
+        if not self.is_admin(update):
             await update.message.reply_text("У вас нет прав администратора.")
             return
         
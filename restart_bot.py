@@ -2,7 +2,13 @@
 # -*- coding: utf-8 -*-
 
 """
-Скрипт для перезапуска бота с новыми настройками администратора
+Скрипт для перезапуска бота с новыми настройками администратора.
+
+В Linux перезапуск идет без простоя: новый экземпляр запускается рядом со
+старым, прогревается и пишет файл готовности; только после этого старый
+экземпляр получает SIGTERM, перестает принимать обновления, дожидается
+обработчиков и выходит, а новый занимает PID-файл и продолжает работу.
+Если новый экземпляр не стал готов, старый продолжает работать.
 """
 
 import subprocess
@@ -11,6 +17,12 @@ import os
 import signal
 import time
 
+from config import PID_FILE, READY_FILE, DRAIN_TIMEOUT, READY_TIMEOUT
+from handover import read_pid
+
+# Запас времени сверх DRAIN_TIMEOUT на сохранение состояния и выход (секунды)
+EXIT_GRACE = 10
+
 def stop_running_bots():
     """Останавливает все запущенные экземпляры бота"""
     print("Остановка запущенных экземпляров бота...")
@@ -49,18 +61,80 @@ def start_bot():
         print(f"Ошибка при запуске бота: {e}")
         return None
 
+def wait_until_ready(process, timeout=READY_TIMEOUT):
+    """Ожидание файла готовности с PID нового экземпляра"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            print(f"Новый экземпляр завершился с кодом {process.returncode}")
+            return False
+        if read_pid(READY_FILE) == process.pid:
+            return True
+        time.sleep(0.2)
+    print(f"Новый экземпляр не стал готов за {timeout:.0f} с")
+    return False
+
+def wait_for_exit(pid, timeout):
+    """Ожидание завершения процесса; False, если он еще жив"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return True
+        time.sleep(0.2)
+    return False
+
+def handover():
+    """
+    Перезапуск без простоя (Linux); возвращает новый процесс или None.
+    Старый экземпляр завершается только после готовности нового.
+    """
+    old_pid = read_pid(PID_FILE)
+    bot_process = start_bot()
+    if bot_process is None:
+        return None
+    
+    print("Ожидание готовности нового экземпляра...")
+    if not wait_until_ready(bot_process):
+        if bot_process.poll() is None:
+            bot_process.terminate()
+            bot_process.wait()
+        print("Перезапуск отменен, работает прежний экземпляр.")
+        return None
+    
+    if old_pid and old_pid != bot_process.pid:
+        print(f"Остановка прежнего экземпляра (PID {old_pid}) с дожиданием обработчиков...")
+        os.kill(old_pid, signal.SIGTERM)
+        if not wait_for_exit(old_pid, DRAIN_TIMEOUT + EXIT_GRACE):
+            print("Прежний экземпляр не завершился вовремя, принудительная остановка")
+            os.kill(old_pid, signal.SIGKILL)
+            wait_for_exit(old_pid, EXIT_GRACE)
+    
+    # Новый экземпляр занимает PID-файл сразу после выхода старого
+    deadline = time.monotonic() + EXIT_GRACE
+    while read_pid(PID_FILE) != bot_process.pid and time.monotonic() < deadline:
+        if bot_process.poll() is not None:
+            print(f"Новый экземпляр завершился с кодом {bot_process.returncode}")
+            return None
+        time.sleep(0.2)
+    return bot_process
+
 def main():
     print("Перезапуск Telegram-бота...")
     print("Текущий каталог:", os.getcwd())
     
-    # Останавливаем запущенные экземпляры
-    stop_running_bots()
-    
-    # Ждем немного перед перезапуском
-    time.sleep(3)
-    
-    # Запускаем бота с новыми настройками
-    bot_process = start_bot()
+    if os.name == 'posix':
+        bot_process = handover()
+    else:
+        # Без сигналов и flock: останавливаем запущенные экземпляры и запускаем новый
+        stop_running_bots()
+        
+        # Ждем немного перед перезапуском
+        time.sleep(3)
+        
+        # Запускаем бота с новыми настройками
+        bot_process = start_bot()
     
     if bot_process:
         print("Бот успешно перезапущен с новыми настройками администратора.")
@@ -0,0 +1,234 @@
+"""
+Планировщик исходящих сообщений с учетом ограничений Telegram на частоту отправки
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from typing import Any, Callable, Coroutine, Dict, Optional
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+logger = logging.getLogger(__name__)
+
+# Очереди приоритетов: ответы пользователям идут раньше массовых рассылок.
+# Массовые отправки помечаются так: bot.send_message(..., rate_limit_args={'priority': BULK})
+INTERACTIVE = 0
+BULK = 1
+PRIORITY_NAMES = {INTERACTIVE: 'interactive', BULK: 'bulk'}
+
+# Методы API, на которые распространяются ограничения частоты отправки сообщений
+LIMITED_PREFIXES = ('send', 'forward', 'copy', 'edit')
+
+
+class TokenBucket:
+    """Корзина токенов: rate токенов в секунду, не больше capacity"""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated', '_clock')
+
+    def __init__(self, rate: float, capacity: float, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self._clock = clock
+        self.updated = clock()
+
+    def delay(self) -> float:
+        """Через сколько секунд будет доступен токен (0 - уже доступен)"""
+        now = self._clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def is_full(self) -> bool:
+        self.delay()
+        return self.tokens >= self.capacity
+
+
+class _ChatLane:
+    """Ограничение отправки в один чат: корзина и очередь отправителей по порядку"""
+
+    __slots__ = ('bucket', 'lock')
+
+    def __init__(self, bucket: TokenBucket):
+        self.bucket = bucket
+        self.lock = asyncio.Lock()
+
+
+class SendScheduler(BaseRateLimiter):
+    """
+    Ограничитель запросов для Application.builder().rate_limiter(...).
+    Обработчики ничего не меняют: все вызовы send_*/edit_* бота проходят через
+    планировщик. Отправка ждет токен корзины своего чата (по умолчанию 1 сообщение
+    в секунду, в группах 20 в минуту), затем токен общей корзины бота (30 в секунду).
+    Общие токены выдаются по приоритету: INTERACTIVE раньше BULK.
+    При ответе 429 вся отправка приостанавливается на retry_after секунд,
+    после чего запрос повторяется (не больше max_retries раз).
+    """
+
+    def __init__(self, global_rate: float = 30.0, chat_rate: float = 1.0, chat_burst: float = 3.0,
+                 group_rate: float = 20 / 60, group_burst: float = 3.0, max_retries: int = 3,
+                 max_chats: int = 10000):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.max_retries = max_retries
+        self.max_chats = max_chats
+        self._global: Optional[TokenBucket] = None
+        self._chats: Dict[Any, _ChatLane] = {}
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._paused_until = 0.0
+        # Счетчики для мониторинга по очередям приоритетов
+        # sent - успешные отправки; задержка считается по каждому получению
+        # токена (acquired), включая повторы после RetryAfter и ошибки отправки
+        self._sent = {priority: 0 for priority in PRIORITY_NAMES}
+        self._acquired = {priority: 0 for priority in PRIORITY_NAMES}
+        self._queued = {priority: 0 for priority in PRIORITY_NAMES}
+        self._latency_total = {priority: 0.0 for priority in PRIORITY_NAMES}
+        self._latency_max = {priority: 0.0 for priority in PRIORITY_NAMES}
+        self._retries = 0
+
+    async def initialize(self):
+        self._global = TokenBucket(self.global_rate, self.global_rate)
+        self._wakeup = asyncio.Event()
+        self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def shutdown(self):
+        if self._dispatcher:
+            self._dispatcher.cancel()
+            try:
+                await self._dispatcher
+            except asyncio.CancelledError:
+                pass
+            self._dispatcher = None
+        for _, _, future in self._waiters:
+            future.cancel()
+        self._waiters.clear()
+
+    async def process_request(self, callback: Callable[..., Coroutine], args: Any, kwargs: Dict[str, Any],
+                              endpoint: str, data: Dict[str, Any], rate_limit_args: Optional[Dict]):
+        if not endpoint.startswith(LIMITED_PREFIXES):
+            return await callback(*args, **kwargs)
+
+        priority = (rate_limit_args or {}).get('priority', INTERACTIVE)
+        if priority not in PRIORITY_NAMES:
+            priority = BULK
+        chat_id = (data or {}).get('chat_id')
+
+        for attempt in range(self.max_retries + 1):
+            queued_at = time.monotonic()
+            await self._acquire(priority, chat_id)
+            self._record_latency(priority, time.monotonic() - queued_at)
+            try:
+                result = await callback(*args, **kwargs)
+            except RetryAfter as exc:
+                if attempt >= self.max_retries:
+                    raise
+                self._retries += 1
+                self._pause(exc.retry_after)
+                logger.warning(f"Telegram ограничил отправку ({endpoint}), пауза {exc.retry_after} с")
+            else:
+                self._sent[priority] += 1
+                return result
+
+    def stats(self) -> Dict:
+        """Число отправок, очереди и задержка в очереди по приоритетам"""
+        lanes = {}
+        for priority, name in PRIORITY_NAMES.items():
+            acquired = self._acquired[priority]
+            lanes[name] = {
+                'sent': self._sent[priority],
+                'queued': self._queued[priority],
+                'latency_avg': self._latency_total[priority] / acquired if acquired else 0.0,
+                'latency_max': self._latency_max[priority],
+            }
+        return {
+            'lanes': lanes,
+            'retries': self._retries,
+            'paused_for': max(0.0, self._paused_until - time.monotonic()),
+            'chats': len(self._chats),
+        }
+
+    def _pause(self, retry_after: float):
+        self._paused_until = max(self._paused_until, time.monotonic() + float(retry_after))
+        if self._wakeup:
+            self._wakeup.set()
+
+    def _record_latency(self, priority: int, latency: float):
+        self._acquired[priority] += 1
+        self._latency_total[priority] += latency
+        self._latency_max[priority] = max(self._latency_max[priority], latency)
+
+    def _chat_lane(self, chat_id) -> _ChatLane:
+        lane = self._chats.get(chat_id)
+        if lane is None:
+            if len(self._chats) >= self.max_chats:
+                # Забываем чаты, в которые давно ничего не отправляли
+                for key in [key for key, old in self._chats.items()
+                            if not old.lock.locked() and old.bucket.is_full()]:
+                    del self._chats[key]
+            is_group = isinstance(chat_id, str) or chat_id < 0
+            bucket = (TokenBucket(self.group_rate, self.group_burst) if is_group
+                      else TokenBucket(self.chat_rate, self.chat_burst))
+            lane = self._chats[chat_id] = _ChatLane(bucket)
+        return lane
+
+    async def _acquire(self, priority: int, chat_id):
+        """Ожидание токена чата, затем токена общей корзины в порядке приоритета"""
+        self._queued[priority] += 1
+        try:
+            if chat_id is None:
+                await self._acquire_global(priority)
+                return
+            lane = self._chat_lane(chat_id)
+            async with lane.lock:
+                delay = lane.bucket.delay()
+                while delay:
+                    await asyncio.sleep(delay)
+                    delay = lane.bucket.delay()
+                lane.bucket.take()
+                await self._acquire_global(priority)
+        finally:
+            self._queued[priority] -= 1
+
+    async def _acquire_global(self, priority: int):
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), future))
+        self._wakeup.set()
+        await future
+
+    async def _dispatch(self):
+        """Выдача токенов общей корзины ожидающим отправкам по приоритету"""
+        while True:
+            while not self._waiters:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+
+            pause = self._paused_until - time.monotonic()
+            delay = pause if pause > 0 else self._global.delay()
+            if delay:
+                self._wakeup.clear()
+                try:
+                    # Новая пауза от RetryAfter будит раньше срока
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                # Отправитель отменил ожидание
+                continue
+            self._global.take()
+            future.set_result(None)
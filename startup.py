@@ -0,0 +1,55 @@
+"""
+Замер времени запуска бота по этапам (импорт, база данных, приложение, инициализация)
+"""
+
+import logging
+import time
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Бюджет импорта модулей самого бота сверх telegram.ext (секунды);
+# соблюдение проверяет test_cold_start_within_budget
+IMPORT_BUDGET = 0.25
+# Модули, которые нужны только администраторам или отдельным режимам работы
+# и не должны загружаться при обычном запуске
+LAZY_MODULES = ('supervisor', 'multiprocessing', 'webhook', 'cProfile', 'pstats', 'http.server', 'gzip', 'csv')
+
+
+class StartupReport:
+    """Длительность этапов запуска: каждый mark() закрывает этап, начатый предыдущим"""
+
+    def __init__(self, started: Optional[float] = None):
+        self.started = started if started is not None else time.perf_counter()
+        self.phases: List[Tuple[str, float]] = []
+        self._last = self.started
+        self.reported = False
+
+    def mark(self, phase: str) -> float:
+        """Завершение этапа phase; возвращает его длительность"""
+        now = time.perf_counter()
+        duration = now - self._last
+        self.phases.append((phase, duration))
+        self._last = now
+        return duration
+
+    @property
+    def total(self) -> float:
+        return self._last - self.started
+
+    def summary(self) -> str:
+        phases = ", ".join(f"{phase} {duration:.2f} с" for phase, duration in self.phases)
+        return f"{phases}; всего {self.total:.2f} с"
+
+    def log(self, budget: Optional[float] = None):
+        """Отчет о запуске в журнал (один раз); предупреждение, если превышен бюджет"""
+        if self.reported:
+            return
+        self.reported = True
+        logger.info(f"Время запуска: {self.summary()}")
+        if budget and self.total > budget:
+            logger.warning(f"Запуск занял {self.total:.2f} с, больше бюджета {budget:.2f} с")
+
+
+# Отсчет от импорта этого модуля: bot.py импортирует его первым
+STARTUP = StartupReport()
@@ -0,0 +1,327 @@
+"""
+Многопроцессный режим: супервизор получает обновления и распределяет их
+по рабочим процессам по telegram_id пользователя
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import queue
+import signal
+import time
+from typing import Callable, List, Optional
+
+from telegram import Bot, Update
+from telegram.error import TelegramError
+
+from config import (
+    TELEGRAM_BOT_TOKEN, BOT_MODE, WEBHOOK_URL, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH,
+    WEBHOOK_SECRET_TOKEN, WEBHOOK_MAX_BACKLOG, WORKER_HEALTH_TIMEOUT
+)
+from webhook import WebhookServer
+
+logger = logging.getLogger(__name__)
+
+# Сигнал рабочему процессу завершиться после обработки очереди
+STOP = None
+# Как часто рабочий процесс сообщает, что жив (секунды)
+HEARTBEAT_INTERVAL = 1.0
+# Таймаут long polling при получении обновлений (секунды)
+POLL_TIMEOUT = 10
+# Сколько ждать завершения рабочих процессов при остановке (секунды)
+SHUTDOWN_TIMEOUT = 30.0
+# Пауза перед повторным перезапуском часто падающего процесса (секунды, максимум)
+MAX_RESTART_DELAY = 30.0
+
+
+def shard_for(update: Update, shards: int) -> int:
+    """
+    Номер рабочего процесса для обновления. Все обновления одного пользователя
+    попадают в один процесс, поэтому его диалог и черновик остаются локальными.
+    """
+    if update.effective_user:
+        key = update.effective_user.id
+    elif update.effective_chat:
+        key = update.effective_chat.id
+    else:
+        key = update.update_id
+    return key % shards
+
+
+class ShardedQueue:
+    """
+    Очередь обновлений, раскладывающая их по очередям рабочих процессов.
+    Повторяет нужную WebhookServer часть интерфейса asyncio.Queue.
+    """
+
+    def __init__(self, queues: List):
+        self.queues = queues
+
+    def qsize(self) -> int:
+        return sum(shard.qsize() for shard in self.queues)
+
+    def put_nowait(self, update: Update):
+        """Постановка в очередь; queue.Full, если очередь процесса заполнена"""
+        self.queues[shard_for(update, len(self.queues))].put_nowait(update.to_dict())
+
+    async def put(self, update: Update):
+        """Постановка в очередь с ожиданием места (обратное давление на получение)"""
+        while True:
+            try:
+                self.put_nowait(update)
+                return
+            except queue.Full:
+                await asyncio.sleep(0.05)
+
+
+class _Worker:
+    """Рабочий процесс и сведения о его состоянии"""
+
+    def __init__(self, index: int, updates):
+        self.index = index
+        self.updates = updates
+        self.process: Optional[multiprocessing.Process] = None
+        self.heartbeat = None
+        self.restarts = 0
+        self.started_at = 0.0
+        self.next_start_at = 0.0
+
+
+class Supervisor:
+    """
+    Запускает workers рабочих процессов с приложением бота и раздает им обновления.
+    Процессы работают с общей базой SQLite (WAL, блокировки записи - на стороне SQLite).
+    Упавший процесс или процесс, не подававший сигнал дольше health_timeout секунд,
+    перезапускается; его очередь обновлений сохраняется в супервизоре. Потеряться
+    может только обновление, которое было в обработке, и обновление, пришедшее в
+    очередь в течение HEARTBEAT_INTERVAL после гибели процесса (его забирает
+    незавершенный запрос чтения погибшего процесса).
+    """
+
+    def __init__(self, workers: int, health_timeout: float = WORKER_HEALTH_TIMEOUT,
+                 queue_size: int = WEBHOOK_MAX_BACKLOG, worker_target: Optional[Callable] = None,
+                 bot: Optional[Bot] = None):
+        if workers < 1:
+            raise ValueError("Число рабочих процессов должно быть положительным")
+        # spawn: дочерние процессы не наследуют потоки и соединения SQLite родителя
+        self._context = multiprocessing.get_context('spawn')
+        self.health_timeout = health_timeout
+        self.worker_target = worker_target or worker_main
+        self.bot = bot
+        # Очереди живут в процессе-менеджере: в отличие от multiprocessing.Queue,
+        # убитый во время чтения процесс не оставляет очередь заблокированной,
+        # и перезапущенный процесс продолжает получать свои обновления
+        self._manager = self._context.Manager()
+        self._workers = [_Worker(index, self._manager.Queue(maxsize=queue_size)) for index in range(workers)]
+        self.update_queue = ShardedQueue([worker.updates for worker in self._workers])
+        self._stop_event: Optional[asyncio.Event] = None
+
+    def run(self):
+        """Запуск до получения SIGINT/SIGTERM"""
+        asyncio.run(self._main())
+
+    def start_workers(self):
+        for worker in self._workers:
+            self._start(worker)
+
+    def check_workers(self) -> int:
+        """Проверка процессов и перезапуск упавших и зависших; возвращает число перезапусков"""
+        restarted = 0
+        now = time.time()
+        for worker in self._workers:
+            if worker.process.is_alive():
+                last_beat = max(worker.heartbeat.value, worker.started_at)
+                if now - last_beat <= self.health_timeout:
+                    continue
+                logger.error(f"Рабочий процесс {worker.index} не отвечает {now - last_beat:.0f} с, перезапуск")
+                worker.process.kill()
+                worker.process.join()
+            elif worker.next_start_at == 0.0:
+                logger.error(f"Рабочий процесс {worker.index} завершился с кодом {worker.process.exitcode}")
+                # Процесс, падающий сразу после запуска, перезапускаем с нарастающей паузой
+                uptime = now - worker.started_at
+                delay = 0.0 if uptime > MAX_RESTART_DELAY else min(2.0 ** worker.restarts, MAX_RESTART_DELAY)
+                worker.next_start_at = now + delay
+            if worker.next_start_at and worker.next_start_at > now:
+                continue
+            worker.restarts += 1
+            self._start(worker)
+            restarted += 1
+        return restarted
+
+    def shutdown_workers(self, timeout: float = SHUTDOWN_TIMEOUT):
+        """Остановка процессов после обработки уже полученных обновлений"""
+        deadline = time.monotonic() + timeout
+        for worker in self._workers:
+            if worker.process and worker.process.is_alive():
+                try:
+                    worker.updates.put(STOP, timeout=timeout)
+                except queue.Full:
+                    pass
+        for worker in self._workers:
+            if worker.process:
+                while worker.process.is_alive() and time.monotonic() < deadline:
+                    worker.process.join(min(HEARTBEAT_INTERVAL, max(0.0, deadline - time.monotonic())))
+                    if worker.process.is_alive():
+                        # STOP мог забрать незавершенный запрос убитого ранее процесса
+                        try:
+                            worker.updates.put_nowait(STOP)
+                        except queue.Full:
+                            pass
+                if worker.process.is_alive():
+                    logger.warning(f"Рабочий процесс {worker.index} не завершился вовремя, принудительная остановка")
+                    worker.process.terminate()
+                    worker.process.join()
+        self._manager.shutdown()
+
+    def stats(self) -> List[dict]:
+        """Состояние рабочих процессов"""
+        now = time.time()
+        return [{
+            'index': worker.index,
+            'pid': worker.process.pid if worker.process else None,
+            'alive': bool(worker.process and worker.process.is_alive()),
+            'restarts': worker.restarts,
+            'heartbeat_age': now - worker.heartbeat.value if worker.heartbeat else None,
+        } for worker in self._workers]
+
+    def _start(self, worker: _Worker):
+        worker.heartbeat = self._context.Value('d', 0.0)
+        worker.started_at = time.time()
+        worker.next_start_at = 0.0
+        worker.process = self._context.Process(
+            target=self.worker_target,
+            args=(worker.index, len(self._workers), worker.updates, worker.heartbeat),
+            name=f"bot-worker-{worker.index}",
+            daemon=True,
+        )
+        worker.process.start()
+        logger.info(f"Запущен рабочий процесс {worker.index} (pid {worker.process.pid})")
+
+    async def _main(self):
+        self._stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self._stop_event.set)
+            except NotImplementedError:
+                pass
+
+        self.bot = self.bot or Bot(TELEGRAM_BOT_TOKEN)
+        self.start_workers()
+        monitor = asyncio.create_task(self._monitor())
+        try:
+            async with self.bot:
+                if BOT_MODE == "webhook":
+                    await self._serve_webhook()
+                else:
+                    await self._poll()
+        finally:
+            monitor.cancel()
+            await loop.run_in_executor(None, self.shutdown_workers)
+
+    async def _monitor(self):
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            self.check_workers()
+
+    async def _poll(self):
+        """Получение обновлений long polling до сигнала остановки"""
+        await self.bot.delete_webhook()
+        offset = None
+
+        async def fetch():
+            nonlocal offset
+            while True:
+                try:
+                    updates = await self.bot.get_updates(offset=offset, timeout=POLL_TIMEOUT,
+                                                         allowed_updates=Update.ALL_TYPES)
+                except TelegramError as exc:
+                    logger.warning(f"Ошибка получения обновлений: {exc}")
+                    await asyncio.sleep(1)
+                    continue
+                for update in updates:
+                    await self.update_queue.put(update)
+                    offset = update.update_id + 1
+
+        fetcher = asyncio.create_task(fetch())
+        await self._stop_event.wait()
+        fetcher.cancel()
+        try:
+            await fetcher
+        except asyncio.CancelledError:
+            pass
+        # Подтверждаем Telegram уже разосланные обновления
+        if offset is not None:
+            try:
+                await self.bot.get_updates(offset=offset, timeout=0)
+            except TelegramError:
+                pass
+
+    async def _serve_webhook(self):
+        """Прием обновлений через webhook до сигнала остановки"""
+        if not WEBHOOK_URL:
+            raise ValueError("Для режима webhook нужно задать WEBHOOK_URL")
+        if not WEBHOOK_SECRET_TOKEN:
+            raise ValueError("Для режима webhook нужно задать WEBHOOK_SECRET_TOKEN")
+        server = WebhookServer(self, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH,
+                               WEBHOOK_SECRET_TOKEN, WEBHOOK_MAX_BACKLOG * len(self._workers))
+        await server.start()
+        await self.bot.set_webhook(url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+                                   secret_token=WEBHOOK_SECRET_TOKEN,
+                                   allowed_updates=Update.ALL_TYPES)
+        try:
+            await self._stop_event.wait()
+        finally:
+            await server.stop()
+
+
+def worker_main(index: int, workers: int, updates, heartbeat):
+    """Точка входа рабочего процесса"""
+    # Остановкой управляет супервизор (через STOP в очереди)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_run_worker(index, workers, updates, heartbeat))
+
+
+async def _run_worker(index: int, workers: int, updates, heartbeat):
+    # Импорт здесь: bot.py сам импортирует этот модуль
+    from bot import build_application, create_database, start_metrics
+    from config import METRICS_PORT
+
+    db = create_database()
+    # Незавершенные рассылки продолжает только первый процесс, иначе сообщения
+    # ушли бы несколько раз. Лист ожидания обрабатывается в каждом процессе:
+    # предложения забираются атомарно (claim_waitlist_offers), а wake() после
+    # отмены записи в любом процессе сразу отправляет предложение
+    application = build_application(db, worker_count=workers, resume_broadcasts=index == 0)
+    start_metrics(db, METRICS_PORT + index if METRICS_PORT else 0)
+
+    async def beat():
+        while True:
+            heartbeat.value = time.time()
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+    loop = asyncio.get_running_loop()
+    try:
+        async with application:
+            if application.post_init:
+                await application.post_init(application)
+            await application.start()
+            beater = asyncio.create_task(beat())
+            logger.info(f"Рабочий процесс {index} готов к обработке обновлений")
+
+            while True:
+                try:
+                    data = await loop.run_in_executor(None, updates.get, True, HEARTBEAT_INTERVAL)
+                except queue.Empty:
+                    continue
+                if data is STOP:
+                    break
+                await application.update_queue.put(Update.de_json(data, application.bot))
+
+            beater.cancel()
+            await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+    finally:
+        db.close()
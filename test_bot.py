@@ -87,6 +87,7 @@ def test_database():
           f"регистраций - {stats['total_registrations']}")
     
     # Удаляем тестовую базу данных
+    test_db.close()
     os.remove("test_registrations.db")
     print("\nТестирование базы данных завершено успешно!")
 
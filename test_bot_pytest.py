@@ -17,6 +17,11 @@ from telegram.ext import ContextTypes
 from config import DATABASE_PATH
 from database import Database
 from registration import RegistrationHandler
+from database import EVENTS_PAGE_SIZE
+from tracing import PROFILER
+from validators import (validate_name, validate_email, validate_phone, validate_birth_date,
+                        validate_column, validate_users, parse_registration,
+                        ERROR_EMPTY, ERROR_FORMAT, ERROR_DATE, ERROR_FUTURE)
 from constants import *
 
 @pytest.fixture
@@ -49,6 +54,7 @@ def db():
     test_db_path = "test_registrations.db"
     database = Database(test_db_path)
     yield database
+    database.close()
     # Удаляем тестовую базу данных после тестов
     if os.path.exists(test_db_path):
         os.remove(test_db_path)
@@ -372,6 +378,263 @@ def test_get_registration_stats(db):
     assert stats['total_events'] == 0
     assert stats['total_registrations'] == 0
 
+@pytest.mark.asyncio
+async def test_export_command(mock_update, mock_context, reg_handler, db):
+    """Тест выгрузки участников мероприятия администратором"""
+    user_id = db.add_user(
+        telegram_id=11111,
+        full_name="User One",
+        email="one@example.com",
+        phone="+79991111111",
+        birth_date="01.01.1990"
+    )
+    event_id = db.add_event("Встреча", "Описание", "2024-12-31 18:00:00", "Онлайн")
+    db.register_user_for_event(user_id, event_id)
+    mock_context.args = [str(event_id), 'ndjson']
+    
+    with patch('registration.ADMIN_IDS', [mock_update.effective_user.id]):
+        await reg_handler.export_command(mock_update, mock_context)
+    
+    mock_update.message.reply_document.assert_called_once()
+    kwargs = mock_update.message.reply_document.call_args.kwargs
+    assert kwargs['filename'] == f"event_{event_id}_attendees.ndjson.gz"
+    assert ': 1' in kwargs['caption']
+
+@pytest.mark.asyncio
+async def test_export_command_requires_admin(mock_update, mock_context, reg_handler):
+    """Тест запрета выгрузки для обычного пользователя"""
+    mock_context.args = ['1']
+    
+    with patch('registration.ADMIN_IDS', []):
+        await reg_handler.export_command(mock_update, mock_context)
+    
+    args, kwargs = mock_update.message.reply_text.call_args
+    assert 'нет прав администратора' in args[0]
+    mock_update.message.reply_document.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_broadcast_command(mock_update, mock_context, reg_handler, db):
+    """Тест запуска рассылки участникам мероприятия"""
+    user_id = db.add_user(
+        telegram_id=11111,
+        full_name="User One",
+        email="one@example.com",
+        phone="+79991111111",
+        birth_date="01.01.1990"
+    )
+    event_id = db.add_event("Встреча", "Описание", "2024-12-31 18:00:00", "Онлайн")
+    db.register_user_for_event(user_id, event_id)
+    mock_update.message.text = f"/broadcast {event_id} Встреча переносится\nна час позже"
+    mock_context.bot = MagicMock(rate_limiter=None)
+    mock_context.bot.send_message = AsyncMock()
+    
+    with patch('registration.ADMIN_IDS', [mock_update.effective_user.id]):
+        await reg_handler.broadcast_command(mock_update, mock_context)
+    await asyncio.gather(*reg_handler.broadcaster._tasks.values())
+    
+    args, kwargs = mock_update.message.reply_text.call_args
+    assert 'запущена' in args[0]
+    first_call = mock_context.bot.send_message.call_args_list[0].kwargs
+    assert first_call == {'chat_id': 11111, 'text': "Встреча переносится\nна час позже"}
+    broadcast = db.get_broadcast(1)
+    assert (broadcast.status, broadcast.delivered) == ('completed', 1)
+
+@pytest.mark.asyncio
+async def test_profile_command(mock_update, mock_context, reg_handler):
+    """Тест профилирования по команде администратора"""
+    tasks = []
+    mock_context.args = ['5']
+    mock_context.application.create_task = MagicMock(
+        side_effect=lambda coroutine: tasks.append(asyncio.ensure_future(coroutine))
+    )
+    
+    with patch('registration.ADMIN_IDS', [mock_update.effective_user.id]), \
+            patch.object(PROFILER, 'capture', AsyncMock(return_value="ncalls  tottime")) as capture:
+        await reg_handler.profile_command(mock_update, mock_context)
+        await asyncio.gather(*tasks)
+    
+    capture.assert_awaited_once_with(5)
+    assert 'Профилирование 5 с' in mock_update.message.reply_text.call_args.args[0]
+    kwargs = mock_update.message.reply_document.call_args.kwargs
+    assert kwargs['document'] == "ncalls  tottime".encode('utf-8')
+    assert kwargs['filename'] == "profile_5s.txt"
+    
+    # Неверная длительность
+    mock_context.args = ['1000']
+    with patch('registration.ADMIN_IDS', [mock_update.effective_user.id]):
+        await reg_handler.profile_command(mock_update, mock_context)
+    assert 'Использование' in mock_update.message.reply_text.call_args.args[0]
+
+@pytest.mark.asyncio
+async def test_events_one_tap_registration(mock_update, mock_context, reg_handler, db):
+    """Список /events листается и записывает на мероприятие в том же сообщении"""
+    user_id = db.add_user(mock_update.effective_user.id, "Test User", "test@example.com",
+                          "+79991234567", "01.01.1990")
+    event_ids = [db.add_event(f"Событие {i}", "", f"2999-01-{i + 1:02d} 10:00:00", "Москва")
+                 for i in range(EVENTS_PAGE_SIZE + 1)]
+    
+    await reg_handler.events_command(mock_update, mock_context)
+    keyboard = mock_update.message.reply_text.call_args.kwargs['reply_markup'].inline_keyboard
+    assert len(keyboard) == EVENTS_PAGE_SIZE + 1
+    next_page = keyboard[-1][0].callback_data
+    assert next_page.startswith('ev:p:') and len(next_page.encode()) <= 64
+    
+    # Вторая страница: редактирование того же сообщения
+    query = AsyncMock()
+    query.data = next_page
+    mock_update.callback_query = query
+    await reg_handler.events_callback(mock_update, mock_context)
+    text = query.edit_message_text.call_args.args[0]
+    keyboard = query.edit_message_text.call_args.kwargs['reply_markup'].inline_keyboard
+    assert f"Событие {EVENTS_PAGE_SIZE}" in text
+    
+    # Запись одним нажатием; на странице появляется отметка
+    query.data = keyboard[0][0].callback_data
+    await reg_handler.events_callback(mock_update, mock_context)
+    assert query.answer.call_args.args[0] == EVENT_REGISTERED.format(title=f"Событие {EVENTS_PAGE_SIZE}")
+    assert [registration.event_id for registration in db.get_user_registrations(user_id)] == [event_ids[-1]]
+    assert query.edit_message_text.call_args.kwargs['reply_markup'].inline_keyboard[0][0].text.startswith('✅')
+    
+    # Повторное нажатие
+    await reg_handler.events_callback(mock_update, mock_context)
+    assert query.answer.call_args.args[0] == EVENT_ALREADY_REGISTERED
+    mock_update.message.reply_text.assert_called_once()
+
+@pytest.mark.asyncio
+async def test_events_full_joins_waitlist(mock_update, mock_context, reg_handler, db):
+    """Мест нет: пользователь попадает в лист ожидания и получает место после отмены"""
+    other_id = db.add_user(1, "Other User", "other@example.com", "+79990000001", "01.01.1990")
+    user_id = db.add_user(mock_update.effective_user.id, "Test User", "test@example.com",
+                          "+79991234567", "01.01.1990")
+    event_id = db.add_event("Событие", "", "2999-01-01 10:00:00", "Москва", capacity=1)
+    db.reserve_seat(other_id, event_id)
+    query = AsyncMock()
+    query.data = f"ev:r:{event_id}:"
+    mock_update.callback_query = query
+    
+    await reg_handler.events_callback(mock_update, mock_context)
+    
+    query.answer.assert_called_once_with(WAITLIST_JOINED.format(position=1), show_alert=True)
+    assert 'мест нет' in query.edit_message_text.call_args.args[0]
+    assert len(db.get_event_registrations(event_id)) == 1
+    
+    # Место освободилось: предложение приходит с кнопками, подтверждение регистрирует
+    assert db.cancel_registration(other_id, event_id)
+    bot = MagicMock(rate_limiter=None)
+    bot.send_message = AsyncMock()
+    assert await reg_handler.waitlist.sweep(bot) == 1
+    offer = bot.send_message.call_args.kwargs
+    assert offer['chat_id'] == mock_update.effective_user.id
+    query.data = offer['reply_markup'].inline_keyboard[0][0].callback_data
+    
+    await reg_handler.waitlist_callback(mock_update, mock_context)
+    
+    assert query.edit_message_text.call_args.args[0] == EVENT_REGISTERED.format(title="Событие")
+    assert [attendee.user_id for attendee in db.get_event_registrations(event_id)] == [user_id]
+
+@pytest.mark.asyncio
+async def test_events_requires_profile(mock_update, mock_context, reg_handler, db):
+    """Без регистрации в боте запись не выполняется"""
+    event_id = db.add_event("Событие", "", "2999-01-01 10:00:00", "Москва")
+    query = AsyncMock()
+    query.data = f"ev:r:{event_id}:"
+    mock_update.callback_query = query
+    
+    await reg_handler.events_callback(mock_update, mock_context)
+    
+    query.answer.assert_called_once_with(EVENTS_NEED_PROFILE, show_alert=True)
+    assert db.get_event_registrations(event_id) == []
+
+@pytest.mark.parametrize("rule, raw, expected", [
+    (validate_name, "  Иван   Петров ", ("Иван Петров", None)),
+    (validate_name, "   ", (None, ERROR_EMPTY)),
+    (validate_email, " test@example.com ", ("test@example.com", None)),
+    (validate_email, "test@@example.com", (None, ERROR_FORMAT)),
+    (validate_phone, "+7 (999) 123-45-67", ("+79991234567", None)),
+    (validate_phone, "8 (999) 123-45-67", ("89991234567", None)),
+    (validate_phone, "invalid-phone", (None, ERROR_FORMAT)),
+    (validate_birth_date, "01.01.1990", ("01.01.1990", None)),
+    (validate_birth_date, "1990-01-01", (None, ERROR_FORMAT)),
+    (validate_birth_date, "31.02.1990", (None, ERROR_DATE)),
+    (validate_birth_date, "01.01.2999", (None, ERROR_FUTURE)),
+])
+def test_validators(rule, raw, expected):
+    """Тест правил проверки: нормализованное значение или код ошибки"""
+    assert tuple(rule(raw)) == expected
+
+def test_validators_batch_matches_single():
+    """Пакетная проверка дает те же результаты, что и поштучная"""
+    dates = ["01.01.1990", "31.02.1990", "01.01.1990", "bad", "01.01.2999"]
+    assert validate_column('birth_date', dates) == [validate_birth_date(value) for value in dates]
+    
+    users = [
+        {'telegram_id': 1, 'full_name': "Иван", 'email': "a@example.com", 'phone': "8 999 123-45-67", 'birth_date': "01.01.1990"},
+        {'telegram_id': 2, 'full_name': "Петр", 'email': "broken", 'phone': "+79991234567", 'birth_date': "31.02.1990"},
+    ]
+    valid, errors = validate_users(users)
+    assert valid == [{**users[0], 'phone': "89991234567"}]
+    assert errors == [(1, 'email', ERROR_FORMAT), (1, 'birth_date', ERROR_DATE)]
+
+@pytest.mark.parametrize("text, values, errors", [
+    ("Иван Петров\nivan@example.com\n+7 999 123-45-67\n01.01.1990",
+     {'full_name': "Иван Петров", 'email': "ivan@example.com", 'phone': "+79991234567", 'birth_date': "01.01.1990"}, {}),
+    ("Иван Петров, ivan@example.com, 89991234567, 1.1.1990",
+     {'full_name': "Иван Петров", 'email': "ivan@example.com", 'phone': "89991234567", 'birth_date': "01.01.1990"}, {}),
+    ("Имя: Иван Петров\nТелефон: +7 (999) 123-45-67\nEmail: broken",
+     {'full_name': "Иван Петров", 'phone': "+79991234567"}, {'email': ERROR_FORMAT}),
+    ("Иван Петров 31.02.1990", {'full_name': "Иван Петров"}, {'birth_date': ERROR_DATE}),
+])
+def test_parse_registration(text, values, errors):
+    """Разбор всех полей регистрации из одного сообщения"""
+    assert parse_registration(text) == (values, errors)
+
+@pytest.mark.asyncio
+async def test_register_single_message(mock_update, mock_context, reg_handler):
+    """Все поля одним сообщением: сразу подтверждение, без вопросов по шагам"""
+    mock_update.message.text = "/register Иван Петров\nivan@example.com\n+7 999 123-45-67\n01.01.1990"
+    
+    result = await reg_handler.register_command(mock_update, mock_context)
+    
+    assert result == CONFIRM
+    assert mock_context.user_data['phone'] == "+79991234567"
+    mock_update.message.reply_text.assert_called_once()
+    assert 'подтвердите' in mock_update.message.reply_text.call_args.args[0]
+
+@pytest.mark.asyncio
+async def test_register_partial_message(mock_update, mock_context, reg_handler):
+    """Некорректные и отсутствующие поля запрашиваются отдельно, принятые - нет"""
+    mock_context.user_data['email'] = "old@example.com"  # черновик прошлой попытки
+    mock_update.message.text = "/register Иван Петров, ivan@mail, 01.01.1990"
+    
+    result = await reg_handler.register_command(mock_update, mock_context)
+    
+    assert result == EMAIL
+    text = mock_update.message.reply_text.call_args.args[0]
+    assert INVALID_FIELDS.format(fields="email") in text
+    assert EMAIL_REQUEST in text
+    
+    mock_update.message.text = "ivan@example.com"
+    result = await reg_handler.get_email(mock_update, mock_context)
+    
+    # Следующий вопрос - телефон, с кнопкой отправки контакта
+    assert result == PHONE
+    keyboard = mock_update.message.reply_text.call_args.kwargs['reply_markup'].keyboard
+    assert keyboard[0][0].request_contact
+
+@pytest.mark.asyncio
+async def test_get_contact(mock_update, mock_context, reg_handler):
+    """Телефон из отправленного контакта; чужой контакт не принимается"""
+    mock_context.user_data.update(full_name="Иван Петров", email="ivan@example.com", birth_date="01.01.1990")
+    mock_update.message.contact = MagicMock(user_id=42, phone_number="79991234567")
+    
+    assert await reg_handler.get_contact(mock_update, mock_context) == PHONE
+    assert mock_update.message.reply_text.call_args.args[0] == INVALID_CONTACT
+    
+    mock_update.message.contact.user_id = mock_update.effective_user.id
+    
+    assert await reg_handler.get_contact(mock_update, mock_context) == CONFIRM
+    assert mock_context.user_data['phone'] == "+79991234567"
+
 def test_constants_defined():
     """Тест наличия всех необходимых констант"""
     # Проверяем, что все необходимые константы определены
@@ -0,0 +1,808 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Тесты слоя работы с базой данных (pytest)
+"""
+
+import asyncio
+import csv
+import gzip
+import json
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from database import (Database, ConnectionPool, PoolTimeoutError, encode_cursor, decode_cursor, EXPORT_COLUMNS,
+                      RESERVATION_REGISTERED, RESERVATION_DUPLICATE, RESERVATION_FULL, RESERVATION_NOT_FOUND,
+                      RESERVATION_EXPIRED)
+from async_database import AsyncDatabase
+from cache import TTLCache, MISSING
+from records import UserRecord, EventRecord, RegistrationRecord
+from migrations import MIGRATIONS, SCHEMA_VERSION, apply_migrations, get_schema_version
+
+
+@pytest.fixture
+def db(tmp_path):
+    """Фикстура для создания тестовой базы данных во временном каталоге"""
+    database = Database(str(tmp_path / "registrations.db"))
+    yield database
+    database.close()
+
+
+def add_test_user(db, telegram_id, full_name="Test User"):
+    """Добавление тестового пользователя"""
+    return db.add_user(
+        telegram_id=telegram_id,
+        full_name=full_name,
+        email=f"user{telegram_id}@example.com",
+        phone="+79991234567",
+        birth_date="01.01.1990"
+    )
+
+
+def test_pool_reuses_connections(db):
+    """Соединения переиспользуются, а не открываются на каждый вызов"""
+    for i in range(20):
+        add_test_user(db, 1000 + i)
+        db.get_user_by_telegram_id(1000 + i)
+
+    stats = db.get_pool_stats()
+    assert stats['created'] == 1
+    assert stats['in_use'] == 0
+    assert stats['checkouts'] > 20
+
+
+def test_pool_is_bounded_and_counts_waits(tmp_path):
+    """Пул не создает больше size соединений и учитывает ожидание"""
+    pool = ConnectionPool(str(tmp_path / "pool.db"), size=2, timeout=5)
+    first = pool.acquire()
+    second = pool.acquire()
+
+    released = threading.Timer(0.05, pool.release, args=(first,))
+    released.start()
+    third = pool.acquire()
+    released.join()
+
+    assert third is first
+    stats = pool.stats()
+    assert stats['created'] == 2
+    assert stats['waits'] == 1
+    assert stats['wait_time_max'] > 0
+
+    pool.release(second)
+    pool.release(third)
+    pool.close()
+    assert pool.stats()['created'] == 0
+
+
+def test_pool_timeout(tmp_path):
+    """Если все соединения заняты дольше timeout, выбрасывается ошибка"""
+    pool = ConnectionPool(str(tmp_path / "pool.db"), size=1, timeout=0.01)
+    conn = pool.acquire()
+    with pytest.raises(PoolTimeoutError):
+        pool.acquire()
+    assert pool.stats()['timeouts'] == 1
+    pool.release(conn)
+    pool.close()
+
+
+def test_pool_rolls_back_unfinished_transaction(db):
+    """Незавершенная транзакция откатывается при возврате соединения"""
+    with db.pool.connection() as conn:
+        conn.execute("INSERT INTO events (title) VALUES ('Черновик')")
+        assert conn.in_transaction
+
+    assert db.get_all_events() == []
+
+
+def test_pool_concurrent_threads(db):
+    """Методы Database безопасно вызываются из нескольких потоков"""
+    errors = []
+
+    def worker(offset):
+        try:
+            for i in range(25):
+                add_test_user(db, offset + i)
+        except Exception as exc:  # pragma: no cover - диагностика
+            errors.append(exc)
+
+    threads = [threading.Thread(target=worker, args=(n * 100,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert db.get_registration_stats()['total_users'] == 200
+    assert db.get_pool_stats()['created'] <= db.pool.size
+
+
+@pytest.fixture
+def adb(db):
+    """Фикстура асинхронного фасада поверх тестовой базы"""
+    async_db = AsyncDatabase(db, workers=2)
+    yield async_db
+    async_db._executor.shutdown(wait=True)
+
+
+@pytest.mark.asyncio
+async def test_async_database_mirrors_api(adb):
+    """AsyncDatabase возвращает те же результаты, что и Database"""
+    user_id = await adb.add_user(
+        telegram_id=42,
+        full_name="Async User",
+        email="async@example.com",
+        phone="+79991234567",
+        birth_date="01.01.1990"
+    )
+    event_id = await adb.add_event("Встреча", "Описание", "2024-12-31 18:00:00", "Онлайн")
+    await adb.register_user_for_event(user_id, event_id)
+
+    user = await adb.get_user_by_telegram_id(42)
+    assert user == adb.sync.get_user_by_telegram_id(42)
+    assert await adb.get_event_registrations(event_id) == adb.sync.get_event_registrations(event_id)
+    assert (await adb.get_registration_stats())['total_registrations'] == 1
+
+
+@pytest.mark.asyncio
+async def test_async_database_does_not_block_loop(adb):
+    """Пока запрос выполняется в рабочем потоке, цикл событий продолжает работу"""
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            ticks += 1
+            await asyncio.sleep(0.005)
+
+    task = asyncio.create_task(ticker())
+    await adb.run(time.sleep, 0.1)
+    task.cancel()
+    assert ticks > 5
+
+
+@pytest.mark.asyncio
+async def test_async_database_cancel_interrupts_query(adb):
+    """Отмена корутины прерывает выполняющийся SQL-запрос"""
+    def endless_query():
+        with adb.sync.pool.connection() as conn:
+            conn.execute(
+                "WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c) "
+                "SELECT count(*) FROM c"
+            ).fetchone()
+
+    task = asyncio.create_task(adb.run(endless_query))
+    await asyncio.sleep(0.1)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    # Соединение возвращается в пул и пригодно для дальнейшей работы
+    for _ in range(100):
+        if adb.get_pool_stats()['in_use'] == 0:
+            break
+        await asyncio.sleep(0.01)
+    assert adb.get_pool_stats()['in_use'] == 0
+    assert await adb.get_all_events() == []
+
+
+def test_migrations_set_schema_version(db):
+    """После инициализации схема имеет последнюю версию, а WAL включен"""
+    with db.pool.connection() as conn:
+        assert get_schema_version(conn) == SCHEMA_VERSION
+        assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        # Повторный запуск ничего не применяет
+        assert apply_migrations(conn) == 0
+
+
+def test_current_schema_skips_ddl(tmp_path):
+    """При повторном запуске с актуальной схемой выполняется только проверка версии"""
+    path = str(tmp_path / "current.db")
+    Database(path).close()
+
+    statements = []
+    conn = sqlite3.connect(path)
+    conn.set_trace_callback(statements.append)
+    assert apply_migrations(conn) == 0
+    conn.close()
+    assert statements == ['PRAGMA user_version']
+
+
+def test_migrations_upgrade_legacy_database(tmp_path):
+    """База, созданная до появления миграций, обновляется без потери данных"""
+    path = str(tmp_path / "legacy.db")
+    conn = sqlite3.connect(path)
+    for statement in MIGRATIONS[0][2]:
+        conn.execute(statement)
+    conn.execute("INSERT INTO events (title, date) VALUES ('Старое', '2024-01-01')")
+    conn.commit()
+    conn.close()
+
+    database = Database(path)
+    assert [event['title'] for event in database.get_all_events()] == ['Старое']
+    with database.pool.connection() as conn:
+        assert get_schema_version(conn) == SCHEMA_VERSION
+    database.close()
+
+
+def test_failed_migration_is_rolled_back(tmp_path, monkeypatch):
+    """Ошибочная миграция откатывается целиком и не меняет версию"""
+    broken = MIGRATIONS + [(SCHEMA_VERSION + 1, "Сломанная", [
+        'CREATE TABLE partial (id INTEGER)',
+        'CREATE TABLE partial (id INTEGER)',
+    ])]
+    monkeypatch.setattr('migrations.MIGRATIONS', broken)
+
+    conn = sqlite3.connect(str(tmp_path / "broken.db"))
+    with pytest.raises(sqlite3.OperationalError):
+        apply_migrations(conn)
+    assert get_schema_version(conn) == SCHEMA_VERSION
+    tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+    assert 'partial' not in tables
+    conn.close()
+
+
+@pytest.mark.parametrize("query, params", [
+    ("SELECT * FROM events ORDER BY date", ()),
+    ("""
+        SELECT e.id, e.title, e.description, e.date, e.location, er.registration_date
+        FROM events e
+        JOIN event_registrations er ON e.id = er.event_id
+        WHERE er.user_id = ?
+        ORDER BY e.date
+    """, (1,)),
+    ("""
+        SELECT u.full_name, u.email, u.phone, u.birth_date, er.registration_date
+        FROM users u
+        JOIN event_registrations er ON u.id = er.user_id
+        WHERE er.event_id = ?
+        ORDER BY er.registration_date
+    """, (1,)),
+])
+def test_queries_use_indexes(db, query, params):
+    """Запросы не сканируют таблицу регистраций и не сортируют мероприятия"""
+    with db.pool.connection() as conn:
+        plan = ' | '.join(row[-1] for row in conn.execute('EXPLAIN QUERY PLAN ' + query, params))
+    assert 'SCAN er' not in plan and 'SCAN event_registrations' not in plan
+    if 'WHERE er.user_id' not in query:
+        assert 'TEMP B-TREE' not in plan
+
+
+def generate_users(count, start=0):
+    """Генератор тестовых пользователей для массовой загрузки"""
+    for i in range(start, start + count):
+        yield {
+            'telegram_id': 500000 + i,
+            'full_name': f"User {i}",
+            'email': f"user{i}@example.com",
+            'phone': "+79991234567",
+            'birth_date': "01.01.1990",
+        }
+
+
+def test_add_users_bulk_counts_duplicates(db):
+    """Массовая загрузка принимает генератор и считает дубликаты"""
+    add_test_user(db, 500000, full_name="Existing")
+
+    result = db.add_users_bulk(generate_users(2500), chunk_size=1000)
+
+    assert result == {'inserted': 2499, 'duplicates': 1, 'invalid': 0}
+    assert db.get_registration_stats()['total_users'] == 2500
+    # Существующая запись не перезаписывается
+    assert db.get_user_by_telegram_id(500000)['full_name'] == "Existing"
+
+
+def test_add_users_bulk_upsert(db):
+    """В режиме update_existing дубликаты обновляют существующие записи"""
+    add_test_user(db, 500000, full_name="Existing")
+
+    result = db.add_users_bulk(generate_users(3), update_existing=True)
+
+    assert result == {'inserted': 2, 'duplicates': 1, 'invalid': 0}
+    assert db.get_user_by_telegram_id(500000)['full_name'] == "User 0"
+
+
+def test_add_users_bulk_accepts_tuples(db):
+    """Пользователи могут передаваться кортежами в порядке USER_FIELDS"""
+    result = db.add_users_bulk([(1, "A", "a@example.com", "+79990000001", "01.01.1990")])
+    assert result == {'inserted': 1, 'duplicates': 0, 'invalid': 0}
+    assert db.get_user_by_telegram_id(1)['email'] == "a@example.com"
+
+
+def test_add_users_bulk_validates(db):
+    """validate=True нормализует записи и пропускает некорректные"""
+    users = [
+        {'telegram_id': 1, 'full_name': "  Иван   Петров ", 'email': "ivan@example.com",
+         'phone': "+7 (999) 123-45-67", 'birth_date': "01.01.1990"},
+        (2, "Петр", "not-an-email", "+79990000002", "02.02.1990"),
+        (3, "Анна", "anna@example.com", "123", "31.02.1990"),
+        (4, "Олег", "oleg@example.com", "+79990000004", "04.04.1990"),
+    ]
+
+    result = db.add_users_bulk(users, chunk_size=2, validate=True)
+
+    assert result == {'inserted': 2, 'duplicates': 0, 'invalid': 2}
+    user = db.get_user_by_telegram_id(1)
+    assert user['full_name'] == "Иван Петров"
+    assert user['phone'] == "+79991234567"
+    assert db.get_user_by_telegram_id(2) is None
+    assert db.get_user_by_telegram_id(3) is None
+    assert db.get_user_by_telegram_id(4)['email'] == "oleg@example.com"
+
+
+def test_register_users_for_event_bulk(db):
+    """Массовая регистрация пропускает уже зарегистрированных"""
+    db.add_users_bulk(generate_users(10))
+    event_id = db.add_event("Встреча", "Описание", "2024-12-31 18:00:00", "Онлайн")
+    user_ids = [db.get_user_by_telegram_id(500000 + i)['id'] for i in range(10)]
+    db.register_user_for_event(user_ids[0], event_id)
+
+    result = db.register_users_for_event_bulk(event_id, iter(user_ids + user_ids[:2]), chunk_size=4)
+
+    assert result == {'inserted': 9, 'duplicates': 3, 'full': 0, 'not_found': 0}
+    assert len(db.get_event_registrations(event_id)) == 10
+
+
+def hammer_event(database, event_id, user_ids, threads=16):
+    """Одновременная запись пользователей на мероприятие из нескольких потоков"""
+    results = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(threads)
+    
+    def worker(index):
+        barrier.wait()
+        for user_id in user_ids[index::threads]:
+            reservation = database.reserve_seat(user_id, event_id)
+            with lock:
+                results.append(reservation.status)
+    
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return results
+
+
+@pytest.mark.parametrize("write_behind", [False, True])
+def test_reserve_seat_never_oversells(tmp_path, write_behind):
+    """Много потоков записываются на одно мероприятие: мест занято ровно capacity"""
+    database = Database(str(tmp_path / "capacity.db"), pool_size=8, write_behind=write_behind)
+    try:
+        database.add_users_bulk(generate_users(200))
+        user_ids = [database.get_user_by_telegram_id(500000 + i)['id'] for i in range(200)]
+        event_id = database.add_event("Мастер-класс", "", "2999-01-01 10:00:00", "Москва", capacity=25)
+        
+        # Каждый пользователь пытается записаться дважды
+        results = hammer_event(database, event_id, user_ids * 2)
+        
+        assert results.count(RESERVATION_REGISTERED) == 25
+        assert results.count(RESERVATION_FULL) + results.count(RESERVATION_DUPLICATE) == 375
+        assert len(database.get_event_registrations(event_id)) == 25
+        assert database.get_event(event_id)['remaining'] == 0
+        assert database.get_event_registration_count(event_id) == 25
+    finally:
+        database.close()
+
+
+def test_reserve_seat_statuses_and_release(db):
+    """Статусы записи; удаление регистрации освобождает место"""
+    user_ids = [add_test_user(db, 600000 + i) for i in range(3)]
+    event_id = db.add_event("Встреча", "", "2999-01-01 10:00:00", "Онлайн", capacity=1)
+    
+    assert db.reserve_seat(user_ids[0], event_id).status == RESERVATION_REGISTERED
+    assert db.reserve_seat(user_ids[0], event_id) == (RESERVATION_DUPLICATE, None)
+    assert db.reserve_seat(user_ids[1], event_id) == (RESERVATION_FULL, None)
+    assert db.reserve_seat(user_ids[1], 999) == (RESERVATION_NOT_FOUND, None)
+    assert db.register_user_for_event(user_ids[1], event_id) is None
+    
+    with db.pool.connection() as conn:
+        conn.execute('DELETE FROM event_registrations WHERE user_id = ?', (user_ids[0],))
+        conn.commit()
+    assert db.get_remaining_seats([event_id]) == {event_id: 1}
+    assert db.reserve_seat(user_ids[1], event_id).status == RESERVATION_REGISTERED
+    
+    # Лимит меньше числа участников: записанные остаются, новых мест нет
+    assert db.set_event_capacity(event_id, 0)
+    assert db.get_event(event_id)['remaining'] == 0
+    assert db.set_event_capacity(event_id, None)
+    assert db.reserve_seat(user_ids[2], event_id).status == RESERVATION_REGISTERED
+    assert db.get_event(event_id)['remaining'] is None
+
+
+def test_register_users_for_event_bulk_respects_capacity(db):
+    """Массовая регистрация останавливается на лимите мест"""
+    db.add_users_bulk(generate_users(10))
+    user_ids = [db.get_user_by_telegram_id(500000 + i)['id'] for i in range(10)]
+    event_id = db.add_event("Встреча", "", "2999-01-01 10:00:00", "Онлайн", capacity=6)
+    db.register_user_for_event(user_ids[0], event_id)
+    
+    result = db.register_users_for_event_bulk(event_id, user_ids, chunk_size=4)
+    
+    assert result == {'inserted': 5, 'duplicates': 1, 'full': 4, 'not_found': 0}
+    assert db.get_event(event_id)['remaining'] == 0
+
+
+def test_register_users_for_event_bulk_missing_event(db):
+    """Регистрация на несуществующее мероприятие не выдается за дубликаты"""
+    db.add_users_bulk(generate_users(3))
+    user_ids = [db.get_user_by_telegram_id(500000 + i)['id'] for i in range(3)]
+
+    result = db.register_users_for_event_bulk(999, iter(user_ids))
+
+    assert result == {'inserted': 0, 'duplicates': 0, 'full': 0, 'not_found': 3}
+    assert db.get_registration_stats()['total_registrations'] == 0
+
+
+def test_waitlist_promotion_and_expiry(db):
+    """Освободившееся место удерживается за первым в очереди до подтверждения или истечения срока"""
+    user_ids = [add_test_user(db, 700000 + i) for i in range(4)]
+    event_id = db.add_event("Встреча", "", "2999-01-01 10:00:00", "Онлайн", capacity=1)
+    assert db.reserve_seat(user_ids[0], event_id).status == RESERVATION_REGISTERED
+    assert db.join_waitlist(user_ids[0], event_id) is None
+    assert [db.join_waitlist(user_id, event_id) for user_id in user_ids[1:3]] == [1, 2]
+    assert db.join_waitlist(user_ids[2], event_id) == 2
+
+    # Отмена: место сразу удерживается за первым ожидающим, остальным оно недоступно
+    assert db.cancel_registration(user_ids[0], event_id)
+    assert db.get_event(event_id)['remaining'] == 0
+    assert db.reserve_seat(user_ids[3], event_id).status == RESERVATION_FULL
+    offers = db.claim_waitlist_offers(10)
+    assert [offer.telegram_id for offer in offers] == [700001]
+    assert db.claim_waitlist_offers(10) == []
+    assert db.confirm_waitlist_offer(user_ids[2], event_id).status == RESERVATION_EXPIRED
+
+    # Срок истек: предложение переходит следующему
+    assert db.expire_waitlist_offers(now=offers[0].offered_until) == 1
+    assert db.confirm_waitlist_offer(user_ids[1], event_id).status == RESERVATION_EXPIRED
+    assert db.join_waitlist(user_ids[2], event_id) == 0
+    assert db.confirm_waitlist_offer(user_ids[2], event_id).status == RESERVATION_REGISTERED
+    assert db.get_event(event_id)['remaining'] == 0
+    assert [attendee.user_id for attendee in db.get_event_registrations(event_id)] == [user_ids[2]]
+
+    # Отказ от места и новые места от администратора тоже уходят очереди
+    assert db.join_waitlist(user_ids[3], event_id) == 1
+    assert db.set_event_capacity(event_id, 2)
+    assert [offer.telegram_id for offer in db.claim_waitlist_offers(10)] == [700003]
+    assert db.leave_waitlist(user_ids[3], event_id)
+    assert db.get_event(event_id)['remaining'] == 1
+
+
+def test_waitlist_next_user_uses_index(db):
+    """Следующие в очереди находятся по индексу, без просмотра и сортировки очереди"""
+    query = "SELECT id FROM waitlist WHERE event_id = ? AND status = 'waiting' ORDER BY id LIMIT ?"
+    with db.pool.connection() as conn:
+        plan = ' | '.join(row[-1] for row in conn.execute('EXPLAIN QUERY PLAN ' + query, (1, 5)))
+    assert 'idx_waitlist_queue' in plan
+    assert 'TEMP B-TREE' not in plan
+
+
+def test_stats_counters_follow_changes(db):
+    """Счетчики статистики обновляются триггерами при вставке и удалении"""
+    db.add_users_bulk(generate_users(5))
+    event_id = db.add_event("Встреча", "Описание", "2024-12-31 18:00:00", "Онлайн")
+    other_event_id = db.add_event("Другая", "Описание", "2025-01-31 18:00:00", "Онлайн")
+    user_ids = [db.get_user_by_telegram_id(500000 + i)['id'] for i in range(5)]
+    db.register_users_for_event_bulk(event_id, user_ids)
+    db.register_user_for_event(user_ids[0], other_event_id)
+
+    assert db.get_registration_stats() == {
+        'total_users': 5, 'total_events': 2, 'total_registrations': 6
+    }
+    assert db.get_event_registration_count(event_id) == 5
+    assert db.get_event_registration_count(other_event_id) == 1
+
+    with db.pool.connection() as conn:
+        conn.execute('DELETE FROM event_registrations WHERE user_id = ?', (user_ids[0],))
+        conn.commit()
+
+    assert db.get_registration_stats()['total_registrations'] == 4
+    assert db.get_event_registration_count(event_id) == 4
+    assert db.get_event_registration_count(other_event_id) == 0
+
+
+def test_stats_read_is_single_index_lookup(db):
+    """Статистика читается по первичному ключу, без сканирования таблиц"""
+    with db.pool.connection() as conn:
+        plan = [row[-1] for row in conn.execute(
+            "EXPLAIN QUERY PLAN SELECT name, value FROM stats_counters "
+            "WHERE name IN ('users', 'events', 'registrations')"
+        )]
+    assert len(plan) == 1 and plan[0].startswith('SEARCH stats_counters')
+
+
+def test_rebuild_stats_counters(db):
+    """Пересчет восстанавливает рассогласованные счетчики"""
+    db.add_users_bulk(generate_users(3))
+    with db.pool.connection() as conn:
+        conn.execute("UPDATE stats_counters SET value = 100")
+        conn.commit()
+
+    stats = db.rebuild_stats_counters()
+
+    assert stats == {'total_users': 3, 'total_events': 0, 'total_registrations': 0}
+
+
+def test_iter_events_keyset_pagination(db):
+    """Постраничное чтение мероприятий выдает все строки в порядке (date, id)"""
+    dates = [None, "2024-12-01", "2024-12-01", "2024-11-01", None, "2025-01-01"]
+    for i, date in enumerate(dates):
+        db.add_event(f"Мероприятие {i}", "", date, "Онлайн")
+
+    expected = [(event['date'], event['id']) for event in db.get_all_events()]
+    expected.sort(key=lambda item: (item[0] is not None, item[0] or '', item[1]))
+
+    streamed = [(event['date'], event['id']) for event in db.iter_events(page_size=2)]
+    assert streamed == expected
+
+
+def test_events_page_cursor_resumes(db):
+    """Курсор позволяет продолжить чтение с места остановки"""
+    for i in range(5):
+        db.add_event(f"Мероприятие {i}", "", f"2024-12-0{i + 1}", "Онлайн")
+
+    first, cursor = db.get_events_page(page_size=2)
+    second, cursor = db.get_events_page(page_size=2, cursor=cursor)
+    third, cursor = db.get_events_page(page_size=2, cursor=cursor)
+
+    assert [event['title'] for event in first + second + third] == [f"Мероприятие {i}" for i in range(5)]
+    assert cursor is None
+    assert len(encode_cursor("2024-12-01 10:00:00", 123456)) < 64
+
+
+def test_decode_cursor_rejects_garbage():
+    """Испорченный курсор вызывает ValueError"""
+    with pytest.raises(ValueError):
+        decode_cursor("not-a-cursor")
+
+
+def test_iter_event_registrations(db):
+    """Участники мероприятия читаются постранично без сортировки во временном B-дереве"""
+    db.add_users_bulk(generate_users(7))
+    event_id = db.add_event("Встреча", "Описание", "2024-12-31 18:00:00", "Онлайн")
+    user_ids = [db.get_user_by_telegram_id(500000 + i)['id'] for i in range(7)]
+    db.register_users_for_event_bulk(event_id, user_ids)
+
+    attendees = list(db.iter_event_registrations(event_id, page_size=3))
+
+    assert sorted(attendee['user_id'] for attendee in attendees) == sorted(user_ids)
+    assert attendees[0]['telegram_id'] == 500000 + user_ids.index(attendees[0]['user_id'])
+    with db.pool.connection() as conn:
+        plan = ' | '.join(row[-1] for row in conn.execute(
+            "EXPLAIN QUERY PLAN SELECT er.id FROM event_registrations er JOIN users u ON u.id = er.user_id "
+            "WHERE er.event_id = ? AND (er.registration_date, er.user_id) > (?, ?) "
+            "ORDER BY er.registration_date, er.user_id LIMIT 10", (event_id, '2024', 0)
+        ))
+    assert 'TEMP B-TREE' not in plan
+
+
+@pytest.mark.parametrize("fmt", ["csv", "ndjson"])
+def test_export_event_registrations(db, tmp_path, fmt):
+    """Выгрузка участников пишет сжатый файл порциями и сообщает о ходе работы"""
+    db.add_users_bulk(generate_users(25))
+    event_id = db.add_event("Встреча", "Описание", "2024-12-31 18:00:00", "Онлайн")
+    with db.pool.connection() as conn:
+        user_ids = [row[0] for row in conn.execute('SELECT id FROM users')]
+    db.register_users_for_event_bulk(event_id, user_ids)
+
+    progress = []
+    path = tmp_path / f"export.{fmt}.gz"
+    rows = db.export_event_registrations(event_id, str(path), fmt, chunk_size=10, progress=progress.append)
+
+    assert rows == 25
+    assert progress == [10, 20, 25]
+    with gzip.open(path, 'rt', encoding='utf-8', newline='') as exported:
+        if fmt == 'csv':
+            records = list(csv.DictReader(exported))
+        else:
+            records = [json.loads(line) for line in exported]
+    assert len(records) == 25
+    assert {record['email'] for record in records} == {f"user{i}@example.com" for i in range(25)}
+    assert list(records[0].keys()) == list(EXPORT_COLUMNS)
+
+
+def test_export_rejects_unknown_format(db, tmp_path):
+    """Неизвестный формат выгрузки отклоняется"""
+    with pytest.raises(ValueError):
+        db.export_event_registrations(1, str(tmp_path / "export.gz"), 'xml')
+
+
+def test_ttl_cache_lru_and_ttl():
+    """Кэш вытесняет давно неиспользованные записи и забывает устаревшие"""
+    now = [0.0]
+    cache = TTLCache(maxsize=2, ttl=10, clock=lambda: now[0])
+    cache.set('a', 1)
+    cache.set('b', None)
+    assert cache.get('a') == 1
+    cache.set('c', 3)  # вытесняет 'b'
+
+    assert cache.get('b') is MISSING
+    now[0] = 11
+    assert cache.get('a') is MISSING
+    assert cache.stats() == {
+        'size': 1, 'maxsize': 2, 'hits': 1, 'misses': 2, 'evictions': 1, 'expirations': 1
+    }
+
+
+def test_ttl_cache_skips_stale_write():
+    """Значение, прочитанное до инвалидации, не попадает в кэш"""
+    cache = TTLCache()
+    snapshot = cache.snapshot()
+    cache.invalidate('a')
+    cache.set('a', 'stale', snapshot)
+    assert cache.get('a') is MISSING
+
+
+def test_user_cache_hits_and_invalidation(db):
+    """Повторные запросы обслуживаются кэшем, изменения его сбрасывают"""
+    assert db.get_user_by_telegram_id(777) is None
+    assert db.get_user_by_telegram_id(777) is None
+    assert db.get_cache_stats()['hits'] == 1
+
+    # Отрицательный результат сбрасывается при добавлении
+    add_test_user(db, 777, full_name="Cached")
+    assert db.get_user_by_telegram_id(777)['full_name'] == "Cached"
+
+    db.update_user(777, "Renamed", "new@example.com", "+79990000000", "02.02.1992")
+    assert db.get_user_by_telegram_id(777)['full_name'] == "Renamed"
+
+    db.add_users_bulk([(777, "Bulk", "b@example.com", "+79990000000", "03.03.1993")], update_existing=True)
+    assert db.get_user_by_telegram_id(777)['full_name'] == "Bulk"
+
+
+def test_user_cache_returns_immutable_records(db):
+    """Закэшированная запись неизменяема, поэтому вызывающий код не может ее испортить"""
+    add_test_user(db, 778)
+    user = db.get_user_by_telegram_id(778)
+    with pytest.raises(TypeError):
+        user['full_name'] = "Changed"
+    assert db.get_user_by_telegram_id(778) is user
+
+
+def test_upcoming_events_pages_are_cached(db):
+    """Страницы /events отдаются из кэша; прошедшие мероприятия не показываются"""
+    db.add_event("Прошедшее", "", "2000-01-01 10:00:00", "Москва")
+    ids = [db.add_event(f"Событие {i}", "", f"2999-01-{i + 1:02d} 10:00:00", "Москва") for i in range(3)]
+    
+    events, cursor = db.get_upcoming_events_page(page_size=2)
+    assert [event.id for event in events] == ids[:2]
+    events, next_cursor = db.get_upcoming_events_page(page_size=2, cursor=cursor)
+    assert [event.id for event in events] == ids[2:] and next_cursor is None
+    
+    # Повторное чтение из кэша; изменение списка копии не портит кэш
+    events, _ = db.get_upcoming_events_page(page_size=2)
+    events.clear()
+    assert len(db.get_upcoming_events_page(page_size=2)[0]) == 2
+    assert db.get_event_cache_stats()['hits'] == 2
+    
+    # Новое мероприятие сбрасывает кэш
+    new_id = db.add_event("Раньше всех", "", "2998-12-31 10:00:00", "Москва")
+    assert db.get_upcoming_events_page(page_size=2)[0][0].id == new_id
+
+
+def test_user_cache_can_be_disabled(tmp_path):
+    """При user_cache_size=0 кэш не используется"""
+    database = Database(str(tmp_path / "nocache.db"), user_cache_size=0)
+    assert database.get_cache_stats() is None
+    assert database.get_user_by_telegram_id(1) is None
+    database.close()
+
+
+@pytest.fixture
+def wb_db(tmp_path):
+    """База данных в режиме отложенной записи"""
+    database = Database(str(tmp_path / "write_behind.db"), pool_size=8,
+                        write_behind=True, write_max_delay=0.02)
+    yield database
+    database.close()
+
+
+def test_write_behind_group_commits(wb_db):
+    """Параллельные записи объединяются в групповые коммиты с точными результатами"""
+    results = {}
+
+    def worker(telegram_id):
+        results[telegram_id] = add_test_user(wb_db, telegram_id)
+
+    threads = [threading.Thread(target=worker, args=(1000 + i,)) for i in range(40)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for telegram_id, user_id in results.items():
+        assert wb_db.get_user_by_telegram_id(telegram_id)['id'] == user_id
+    stats = wb_db.get_writer_stats()
+    assert stats['operations'] == 40
+    assert stats['batches'] < 40
+    assert stats['max_batch'] > 1
+
+
+def test_write_behind_futures_report_duplicates(wb_db):
+    """Future возвращает ID записи или None для дубликата, не ломая остальную пачку"""
+    first = wb_db.submit_add_user(1, "First", "a@example.com", "+79990000001", "01.01.1990")
+    duplicate = wb_db.submit_add_user(1, "Again", "b@example.com", "+79990000002", "01.01.1990")
+    second = wb_db.submit_add_user(2, "Second", "c@example.com", "+79990000003", "01.01.1990")
+
+    assert first.result() is not None
+    assert duplicate.result() is None
+    assert second.result() == first.result() + 1
+
+    event_id = wb_db.add_event("Встреча", "Описание", "2024-12-31 18:00:00", "Онлайн")
+    registration = wb_db.submit_register_user_for_event(first.result(), event_id)
+    again = wb_db.submit_register_user_for_event(first.result(), event_id)
+    assert registration.result() is not None
+    assert again.result() is None
+    assert wb_db.get_registration_stats()['total_registrations'] == 1
+
+
+def test_write_behind_invalidates_cache(wb_db):
+    """После группового коммита кэш пользователя сброшен"""
+    assert wb_db.get_user_by_telegram_id(5) is None
+    add_test_user(wb_db, 5)
+    assert wb_db.get_user_by_telegram_id(5) is not None
+
+
+def test_write_behind_close_flushes_queue(tmp_path):
+    """При закрытии все операции из очереди записываются"""
+    path = str(tmp_path / "flush.db")
+    database = Database(path, write_behind=True, write_max_delay=1.0)
+    futures = [database.submit_add_user(i, "U", "u@example.com", "+79990000001", "01.01.1990")
+               for i in range(10)]
+    database.close()
+
+    assert all(future.result() for future in futures)
+    reopened = Database(path)
+    assert reopened.get_registration_stats()['total_users'] == 10
+    reopened.close()
+
+
+@pytest.mark.asyncio
+async def test_async_database_write_behind(wb_db):
+    """AsyncDatabase ждет результат группового коммита"""
+    adb = AsyncDatabase(wb_db)
+    user_id = await adb.add_user(9, "Async", "a@example.com", "+79990000001", "01.01.1990")
+    assert user_id is not None
+    assert await adb.add_user(9, "Async", "a@example.com", "+79990000001", "01.01.1990") is None
+    adb._executor.shutdown(wait=True)
+
+
+def test_records_are_dict_compatible(db):
+    """Записи поддерживают доступ по ключу, индексу и атрибуту"""
+    add_test_user(db, 779)
+    user = db.get_user_by_telegram_id(779)
+
+    assert isinstance(user, UserRecord)
+    assert user['full_name'] == user.full_name == user[2] == "Test User"
+    assert user.get('missing', 'default') == 'default'
+    assert list(user.keys()) == list(UserRecord._fields)
+    assert dict(user)['email'] == "user779@example.com"
+    assert user._asdict() == dict(user.items())
+    with pytest.raises(KeyError):
+        user['missing']
+    assert not hasattr(user, '__dict__')
+
+    # in, итерация, len и JSON - как у кортежа; словарь дает _asdict()
+    assert 'full_name' not in user and "Test User" in user
+    assert list(user) == list(user.values())
+    assert len(user) == len(UserRecord._fields)
+    assert json.loads(json.dumps(user)) == list(user.values())
+    assert 'full_name' in user._asdict()
+    assert json.loads(json.dumps(user._asdict()))['telegram_id'] == 779
+
+
+def test_event_listings_return_records(db):
+    """Все выборки возвращают компактные записи"""
+    user_id = add_test_user(db, 780)
+    event_id = db.add_event("Встреча", "Описание", "2024-12-31 18:00:00", "Онлайн")
+    db.register_user_for_event(user_id, event_id)
+
+    assert isinstance(db.get_all_events()[0], EventRecord)
+    assert isinstance(db.get_event(event_id), EventRecord)
+    registration = db.get_event_registrations(event_id)[0]
+    assert isinstance(registration, RegistrationRecord)
+    assert registration['email'] == "user780@example.com"
+    assert db.get_user_registrations(user_id)[0]['event_id'] == event_id
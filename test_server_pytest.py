@@ -0,0 +1,973 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Тесты приема и обработки обновлений (pytest)
+"""
+
+import asyncio
+import io
+import json
+import os
+import queue
+import signal
+import socket
+import subprocess
+import sys
+import time
+from collections import Counter
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import httpx
+import pytest
+import pytest_asyncio
+from telegram import Bot, Update, User
+from telegram.error import BadRequest, Forbidden, RetryAfter
+from telegram.ext import Application, CommandHandler, ConversationHandler, MessageHandler, filters
+
+from webhook import WebhookServer, SECRET_TOKEN_HEADER
+from dispatcher import PerUserUpdateProcessor
+from database import Database
+from async_database import AsyncDatabase
+from persistence import SQLitePersistence
+from scheduler import SendScheduler, TokenBucket, BULK
+from broadcast import Broadcaster
+from waitlist import WaitlistPromoter
+from supervisor import Supervisor, shard_for
+from handover import InstanceLock, read_pid, serve_polling
+import metrics
+from metrics import CALLS, ERRORS, LATENCY
+from bot import build_application, start_metrics
+from startup import StartupReport, IMPORT_BUDGET, LAZY_MODULES
+from tracing import TRACER, PROFILER, RingBufferExporter, TracedRequest, JSONFileExporter
+from telegram.request import HTTPXRequest
+from registration import RegistrationHandler
+
+SECRET = "test-secret"
+
+
+def make_update(update_id, user_id=100, text="/start"):
+    """JSON обновления Telegram с текстовым сообщением"""
+    message = {
+        'message_id': update_id,
+        'date': 1700000000,
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': {'id': user_id, 'is_bot': False, 'first_name': 'Test'},
+        'text': text,
+    }
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    return {'update_id': update_id, 'message': message}
+
+
+@pytest_asyncio.fixture
+async def application():
+    """Приложение без обращений к API Telegram (ответ на getMe подменен)"""
+    bot_user = User(id=1, is_bot=True, first_name='Bot', username='test_bot')
+    with patch.object(Bot, '_post', AsyncMock(return_value=bot_user.to_dict())):
+        app = Application.builder().token('123:TEST').updater(None).build()
+        await app.initialize()
+    yield app
+    if app.running:
+        await app.stop()
+    await app.shutdown()
+
+
+@pytest_asyncio.fixture
+async def adb_persistence(tmp_path):
+    """Хранилище состояния поверх временной базы"""
+    adb = AsyncDatabase(Database(str(tmp_path / "persist.db"), pool_size=2), workers=2)
+    yield adb, SQLitePersistence(adb, max_age=7 * 24 * 3600)
+    adb.close()
+
+
+async def start_server(app, **kwargs):
+    server = WebhookServer(app, listen='127.0.0.1', port=0, url_path='/hook',
+                           secret_token=SECRET, **kwargs)
+    await server.start()
+    return server
+
+
+@pytest.mark.asyncio
+async def test_webhook_delivers_updates_to_handlers(application):
+    """Обновление, отправленное по HTTP, доходит до обработчика команды"""
+    received = []
+
+    async def start(update, context):
+        received.append(update.effective_user.id)
+
+    application.add_handler(CommandHandler('start', start))
+    await application.start()
+    server = await start_server(application)
+    try:
+        async with httpx.AsyncClient(base_url=f'http://127.0.0.1:{server.port}') as client:
+            for update_id in range(1, 4):
+                response = await client.post('/hook', json=make_update(update_id, user_id=update_id),
+                                             headers={SECRET_TOKEN_HEADER: SECRET})
+                assert response.status_code == 200
+        for _ in range(100):
+            if len(received) == 3:
+                break
+            await asyncio.sleep(0.01)
+    finally:
+        await server.stop()
+
+    assert sorted(received) == [1, 2, 3]
+    assert server.accepted == 3
+
+
+@pytest.mark.asyncio
+async def test_webhook_rejects_invalid_requests(application):
+    """Неверный токен, путь, метод и тело запроса отклоняются, в очередь ничего не попадает"""
+    server = await start_server(application)
+    try:
+        async with httpx.AsyncClient(base_url=f'http://127.0.0.1:{server.port}') as client:
+            headers = {SECRET_TOKEN_HEADER: SECRET}
+            assert (await client.post('/hook', json=make_update(1))).status_code == 403
+            assert (await client.post('/hook', json=make_update(1),
+                                      headers={SECRET_TOKEN_HEADER: 'wrong'})).status_code == 403
+            assert (await client.post('/other', json=make_update(1), headers=headers)).status_code == 404
+            assert (await client.get('/hook', headers=headers)).status_code == 405
+            assert (await client.post('/hook', content=b'not json', headers=headers)).status_code == 400
+            # Корректный JSON, но не объект
+            for body in (b'[1]', b'"x"', b'null'):
+                assert (await client.post('/hook', content=body, headers=headers)).status_code == 400
+    finally:
+        await server.stop()
+
+    assert application.update_queue.qsize() == 0
+    assert server.rejected == 8
+
+
+@pytest.mark.parametrize("secret_token", ['', 'с пробелом и кириллицей', 'x' * 257])
+def test_webhook_requires_secret_token(application, secret_token):
+    """Без корректного секретного токена webhook-сервер не создается"""
+    with pytest.raises(ValueError):
+        WebhookServer(application, secret_token=secret_token)
+
+
+@pytest.mark.asyncio
+async def test_webhook_backlog_is_bounded(application):
+    """При заполненной очереди сервер отвечает 503, пока обработка не догонит"""
+    # Приложение не запущено, поэтому обновления остаются в очереди (см. также
+    # test_webhook_backlog_counts_processor для запущенного приложения)
+    server = await start_server(application, max_backlog=2)
+    try:
+        async with httpx.AsyncClient(base_url=f'http://127.0.0.1:{server.port}') as client:
+            headers = {SECRET_TOKEN_HEADER: SECRET}
+            statuses = [
+                (await client.post('/hook', json=make_update(i), headers=headers)).status_code
+                for i in range(1, 5)
+            ]
+            assert statuses == [200, 200, 503, 503]
+
+            await application.update_queue.get()
+            response = await client.post('/hook', json=make_update(5), headers=headers)
+            assert response.status_code == 200
+    finally:
+        await server.stop()
+
+    assert application.update_queue.qsize() == 2
+
+
+@pytest_asyncio.fixture
+async def concurrent_application():
+    """Приложение с параллельной обработкой обновлений"""
+    bot_user = User(id=1, is_bot=True, first_name='Bot', username='test_bot')
+    processor = PerUserUpdateProcessor(max_concurrent=4)
+    with patch.object(Bot, '_post', AsyncMock(return_value=bot_user.to_dict())):
+        app = Application.builder().token('123:TEST').updater(None).concurrent_updates(processor).build()
+        await app.initialize()
+    yield app
+    if app.running:
+        await app.stop()
+    await app.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_processor_serializes_same_user_and_parallelizes_others(concurrent_application):
+    """Обновления одного пользователя идут по порядку, разных - параллельно"""
+    app = concurrent_application
+    log = []
+    running = {'now': 0, 'max': 0}
+
+    async def handler(update, context):
+        user_id = update.effective_user.id
+        running['now'] += 1
+        running['max'] = max(running['max'], running['now'])
+        log.append(('start', user_id, update.update_id))
+        await asyncio.sleep(0.02)
+        log.append(('end', user_id, update.update_id))
+        running['now'] -= 1
+
+    app.add_handler(CommandHandler('start', handler))
+    await app.start()
+
+    update_id = 0
+    for _ in range(3):
+        for user_id in (1, 2, 3):
+            update_id += 1
+            await app.update_queue.put(Update.de_json(make_update(update_id, user_id=user_id), app.bot))
+    for _ in range(200):
+        if len(log) == 18:
+            break
+        await asyncio.sleep(0.01)
+
+    assert len(log) == 18
+    # Разные пользователи обрабатывались одновременно
+    assert running['max'] == 3
+    # У каждого пользователя обработчики не пересекались и шли в порядке поступления
+    for user_id in (1, 2, 3):
+        events = [(kind, uid) for kind, u, uid in log if u == user_id]
+        assert [kind for kind, _ in events] == ['start', 'end'] * 3
+        ids = [uid for kind, uid in events if kind == 'start']
+        assert ids == sorted(ids)
+
+    stats = app.update_processor.stats()
+    assert stats['processed'] == 9
+    assert stats['pending'] == 0 and stats['active_users'] == 0
+    assert stats['serialized'] == 6
+    assert stats['user_wait_max'] > 0
+
+
+@pytest.mark.asyncio
+async def test_processor_slow_user_does_not_hold_slots():
+    """Ожидающие своей очереди обновления медленного пользователя не занимают слоты"""
+    processor = PerUserUpdateProcessor(max_concurrent=2)
+    release = asyncio.Event()
+    done = []
+
+    async def slow():
+        await release.wait()
+        done.append('slow')
+
+    async def fast(name):
+        done.append(name)
+
+    slow_user = [Update.de_json(make_update(i, user_id=1), None) for i in range(1, 4)]
+    tasks = [asyncio.create_task(processor.process_update(u, slow())) for u in slow_user]
+    await asyncio.sleep(0.01)
+    other = Update.de_json(make_update(10, user_id=2), None)
+    await asyncio.wait_for(processor.process_update(other, fast('fast')), timeout=1)
+    assert done == ['fast']
+    assert processor.stats()['waiting'] == 2
+
+    release.set()
+    await asyncio.gather(*tasks)
+    assert done == ['fast', 'slow', 'slow', 'slow']
+
+
+@pytest.mark.asyncio
+async def test_processor_counts_updates_taken_from_queue(concurrent_application):
+    """Запущенное приложение сразу забирает обновления из очереди - их учитывает pending"""
+    app = concurrent_application
+    release = asyncio.Event()
+    handled = []
+
+    async def handler(update, context):
+        await release.wait()
+        handled.append(update.update_id)
+
+    app.add_handler(CommandHandler('start', handler))
+    await app.start()
+
+    for update_id in range(1, 21):
+        await app.update_queue.put(
+            Update.de_json(make_update(update_id, user_id=update_id % 5), app.bot)
+        )
+    for _ in range(100):
+        if app.update_processor.pending == 20:
+            break
+        await asyncio.sleep(0.01)
+
+    processor = app.update_processor
+    assert app.update_queue.qsize() == 0
+    assert processor.pending == 20
+    assert processor.stats()['in_flight'] == 4
+
+    release.set()
+    for _ in range(100):
+        if len(handled) == 20:
+            break
+        await asyncio.sleep(0.01)
+    assert len(handled) == 20
+    assert processor.pending == 0
+
+
+@pytest.mark.asyncio
+async def test_webhook_backlog_counts_processor(concurrent_application):
+    """У запущенного приложения с параллельной обработкой лимит учитывает обновления у обработчика"""
+    app = concurrent_application
+    release = asyncio.Event()
+
+    async def handler(update, context):
+        await release.wait()
+
+    app.add_handler(CommandHandler('start', handler))
+    await app.start()
+    server = await start_server(app, max_backlog=5)
+    try:
+        async with httpx.AsyncClient(base_url=f'http://127.0.0.1:{server.port}') as client:
+            headers = {SECRET_TOKEN_HEADER: SECRET}
+            statuses = [
+                (await client.post('/hook', json=make_update(i, user_id=i), headers=headers)).status_code
+                for i in range(1, 9)
+            ]
+            assert statuses == [200] * 5 + [503] * 3
+            assert app.update_queue.qsize() == 0
+            assert app.update_processor.pending == 5
+
+            release.set()
+            for _ in range(100):
+                if not server.backlog():
+                    break
+                await asyncio.sleep(0.01)
+            response = await client.post('/hook', json=make_update(9, user_id=9), headers=headers)
+            assert response.status_code == 200
+    finally:
+        await server.stop()
+
+
+def build_persistent_app(adb, interval=60):
+    """Приложение с сохранением состояния и простым диалогом из двух шагов"""
+    persistence = SQLitePersistence(adb, update_interval=interval)
+    app = Application.builder().token('123:TEST').updater(None).persistence(persistence).build()
+    finished = []
+
+    async def begin(update, context):
+        context.user_data['draft'] = 'черновик'
+        return 1
+
+    async def finish(update, context):
+        finished.append((update.effective_user.id, context.user_data.get('draft'), update.message.text))
+        context.user_data.clear()
+        return ConversationHandler.END
+
+    app.add_handler(ConversationHandler(
+        entry_points=[CommandHandler('go', begin)],
+        states={1: [MessageHandler(filters.TEXT & ~filters.COMMAND, finish)]},
+        fallbacks=[],
+        name='test_conversation',
+        persistent=True,
+    ))
+    return app, persistence, finished
+
+
+@pytest.mark.asyncio
+async def test_persistence_resumes_conversation_after_restart(tmp_path):
+    """Незавершенный диалог и черновик переживают перезапуск и загружаются лениво"""
+    adb = AsyncDatabase(Database(str(tmp_path / "persist.db"), pool_size=2), workers=2)
+    bot_user = User(id=1, is_bot=True, first_name='Bot', username='test_bot')
+    try:
+        with patch.object(Bot, '_post', AsyncMock(return_value=bot_user.to_dict())):
+            app, persistence, _ = build_persistent_app(adb)
+            async with app:
+                await app.process_update(Update.de_json(make_update(1, user_id=7, text='/go'), app.bot))
+                await app.process_update(Update.de_json(make_update(2, user_id=8, text='/go'), app.bot))
+            assert adb.sync.get_user_data(7) == {'draft': 'черновик'}
+
+            # "Перезапуск": новое приложение поверх той же базы
+            app, persistence, finished = build_persistent_app(adb)
+            async with app:
+                assert persistence.stats()['loaded_users'] == 0
+                await app.process_update(Update.de_json(make_update(3, user_id=7, text='готово'), app.bot))
+                assert finished == [(7, 'черновик', 'готово')]
+                assert persistence.stats()['loaded_users'] == 1
+                await app.update_persistence()
+                await persistence.flush()
+
+        # Завершенный диалог и пустой черновик удалены, второй пользователь не тронут
+        assert adb.sync.get_user_data(7) is None
+        assert adb.sync.get_conversation_states('test_conversation') == {(8, 8): 1}
+    finally:
+        adb.close()
+
+
+@pytest.mark.asyncio
+async def test_persistence_coalesces_writes(adb_persistence):
+    """Изменения одного прохода записываются одной транзакцией, повторы пропускаются"""
+    adb, persistence = adb_persistence
+    await asyncio.gather(
+        persistence.update_user_data(1, {'full_name': 'A'}),
+        persistence.update_user_data(2, {'full_name': 'B'}),
+        persistence.update_conversation('registration', (1, 1), 1),
+        persistence.update_conversation('registration', (2, 2), 2),
+    )
+    await persistence.flush()
+    assert persistence.stats()['flushes'] == 1
+    assert persistence.stats()['rows_written'] == 4
+
+    # Те же данные повторно не пишутся
+    await persistence.update_user_data(1, {'full_name': 'A'})
+    await persistence.flush()
+    assert persistence.stats()['flushes'] == 1
+    assert persistence.stats()['unchanged'] == 1
+    assert await adb.get_conversation_states('registration') == {(1, 1): 1, (2, 2): 2}
+
+
+@pytest.mark.asyncio
+async def test_persistence_purges_stale_conversations(adb_persistence):
+    """Устаревшие диалоги удаляются при загрузке"""
+    adb, persistence = adb_persistence
+    await adb.save_conversation_state({1: {'email': 'a@b.c'}, 2: {'email': 'c@d.e'}},
+                                      {('registration', (1, 1)): 2, ('registration', (2, 2)): 3})
+    with adb.sync.pool.connection() as conn:
+        conn.execute("UPDATE conversation_states SET updated_at = datetime('now', '-30 days') "
+                     "WHERE conversation_key = '[1, 1]'")
+        conn.execute("UPDATE user_data SET updated_at = datetime('now', '-30 days') WHERE user_id = 1")
+        conn.commit()
+
+    assert await persistence.get_conversations('registration') == {(2, 2): 3}
+    assert await adb.get_user_data(1) is None
+    assert await adb.get_user_data(2) == {'email': 'c@d.e'}
+
+
+def test_token_bucket_refills_at_rate():
+    """Корзина выдает не больше capacity токенов сразу и пополняется со скоростью rate"""
+    now = [0.0]
+    bucket = TokenBucket(rate=2.0, capacity=2, clock=lambda: now[0])
+    assert bucket.delay() == 0
+    bucket.take()
+    bucket.take()
+    assert bucket.delay() == pytest.approx(0.5)
+    now[0] = 0.5
+    assert bucket.delay() == 0
+
+
+@pytest_asyncio.fixture
+async def scheduler():
+    """Планировщик с небольшими лимитами для тестов"""
+    send_scheduler = SendScheduler(global_rate=20, chat_rate=100, chat_burst=100, max_retries=2)
+    await send_scheduler.initialize()
+    yield send_scheduler
+    await send_scheduler.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_scheduler_interactive_goes_before_bulk(scheduler):
+    """Когда общая корзина пуста, ответы пользователям обгоняют рассылку"""
+    order = []
+
+    async def send(name):
+        order.append(name)
+        return True
+
+    # Израсходуем токены общей корзины
+    scheduler._global.tokens = 0
+    bulk = [asyncio.create_task(scheduler.process_request(
+        send, (f'bulk{i}',), {}, 'sendMessage', {'chat_id': 100 + i}, {'priority': BULK}
+    )) for i in range(5)]
+    await asyncio.sleep(0)
+    interactive = asyncio.create_task(scheduler.process_request(
+        send, ('reply',), {}, 'sendMessage', {'chat_id': 1}, None
+    ))
+    await asyncio.gather(interactive, *bulk)
+
+    assert order[0] == 'reply'
+    assert order[1:] == [f'bulk{i}' for i in range(5)]
+    stats = scheduler.stats()
+    assert stats['lanes']['interactive']['sent'] == 1
+    assert stats['lanes']['bulk']['sent'] == 5
+    assert stats['lanes']['bulk']['latency_max'] > stats['lanes']['interactive']['latency_max']
+
+
+@pytest.mark.asyncio
+async def test_scheduler_limits_per_chat_rate():
+    """Сообщения в один чат идут не чаще chat_rate, по порядку"""
+    send_scheduler = SendScheduler(global_rate=1000, chat_rate=20, chat_burst=1)
+    await send_scheduler.initialize()
+    sent = []
+
+    async def send(i):
+        sent.append((i, time.monotonic()))
+
+    try:
+        await asyncio.gather(*(send_scheduler.process_request(
+            send, (i,), {}, 'sendMessage', {'chat_id': 5}, None) for i in range(4)))
+    finally:
+        await send_scheduler.shutdown()
+
+    assert [i for i, _ in sent] == [0, 1, 2, 3]
+    # 3 интервала по 50 мс (с небольшим допуском на таймер)
+    assert sent[-1][1] - sent[0][1] >= 0.14
+
+
+@pytest.mark.asyncio
+async def test_scheduler_retries_after_flood_control(scheduler):
+    """При RetryAfter отправка приостанавливается и повторяется"""
+    calls = []
+
+    async def send():
+        calls.append(time.monotonic())
+        if len(calls) == 1:
+            raise RetryAfter(0.1)
+        return True
+
+    assert await scheduler.process_request(send, (), {}, 'sendMessage', {'chat_id': 1}, None)
+    assert len(calls) == 2
+    assert calls[1] - calls[0] >= 0.09
+    stats = scheduler.stats()
+    assert stats['retries'] == 1
+    # Повтор считается только в retries, отправлено одно сообщение
+    assert stats['lanes']['interactive']['sent'] == 1
+
+
+@pytest.mark.asyncio
+async def test_scheduler_gives_up_after_max_retries(scheduler):
+    """После max_retries повторов ошибка передается вызывающему"""
+    async def send():
+        raise RetryAfter(0)
+
+    with pytest.raises(RetryAfter):
+        await scheduler.process_request(send, (), {}, 'sendMessage', {'chat_id': 1}, None)
+    stats = scheduler.stats()
+    assert stats['retries'] == 2
+    assert stats['lanes']['interactive']['sent'] == 0
+
+
+@pytest.mark.asyncio
+async def test_scheduler_skips_non_message_methods(scheduler):
+    """Служебные методы (getUpdates, getMe) не ждут токенов"""
+    scheduler._global.tokens = 0
+    scheduler._pause(10)
+
+    async def call():
+        return 'ok'
+
+    result = await asyncio.wait_for(
+        scheduler.process_request(call, (), {}, 'getUpdates', {}, None), timeout=1
+    )
+    assert result == 'ok'
+
+
+def seed_attendees(db, count):
+    """Мероприятие с count участниками; возвращает ID мероприятия"""
+    db.add_users_bulk({
+        'telegram_id': 1000 + i,
+        'full_name': f"User {i}",
+        'email': f"user{i}@example.com",
+        'phone': "+79991234567",
+        'birth_date': "01.01.1990",
+    } for i in range(count))
+    event_id = db.add_event("Встреча", "Описание", "2024-12-31 18:00:00", "Онлайн")
+    with db.pool.connection() as conn:
+        user_ids = [row[0] for row in conn.execute('SELECT id FROM users')]
+    db.register_users_for_event_bulk(event_id, user_ids)
+    return event_id
+
+
+@pytest.mark.asyncio
+async def test_broadcast_counts_and_resumes_after_crash(adb_persistence):
+    """Рассылка считает доставленные, заблокированные и ошибки и продолжается после сбоя"""
+    adb, _ = adb_persistence
+    event_id = seed_attendees(adb.sync, 10)
+    broadcast_id = await adb.create_broadcast(event_id, "Напоминание", created_by=1)
+    delivered = []
+    crash = {'chat_id': 1006}
+
+    async def send_message(chat_id, text, **kwargs):
+        if chat_id == crash['chat_id']:
+            raise RuntimeError("сбой процесса")
+        if chat_id == 1002:
+            raise Forbidden("bot was blocked by the user")
+        if chat_id == 1003:
+            raise BadRequest("chat not found")
+        delivered.append(chat_id)
+
+    bot = MagicMock(rate_limiter=None)
+    bot.send_message = AsyncMock(side_effect=send_message)
+    broadcaster = Broadcaster(adb, page_size=3)
+
+    with pytest.raises(RuntimeError):
+        await broadcaster.run(bot, broadcast_id)
+    # Сохранены две полные страницы (1000-1005)
+    progress = await adb.get_broadcast(broadcast_id)
+    assert (progress.status, progress.delivered, progress.blocked, progress.failed) == ('running', 4, 1, 1)
+
+    # "Перезапуск": продолжение незавершенных рассылок
+    crash['chat_id'] = None
+    assert await Broadcaster(adb, page_size=3).resume(bot) == 1
+    for _ in range(100):
+        if (await adb.get_broadcast(broadcast_id)).status == 'completed':
+            break
+        await asyncio.sleep(0.01)
+
+    result = await adb.get_broadcast(broadcast_id)
+    assert (result.status, result.delivered, result.blocked, result.failed) == ('completed', 8, 1, 1)
+    assert result.cursor is None
+    # Страницы до сбоя не отправлялись повторно, страница со сбоем отправлена заново
+    sent = Counter(chat_id for chat_id in delivered if chat_id != 1)
+    assert {chat_id for chat_id, times in sent.items() if times == 1} >= {1000, 1001, 1004, 1005, 1009}
+    assert set(sent) == {1000, 1001, 1004, 1005, 1006, 1007, 1008, 1009}
+    # Итоги отправлены администратору
+    assert bot.send_message.call_args.kwargs['chat_id'] == 1
+    assert 'Доставлено: 8' in bot.send_message.call_args.kwargs['text']
+    assert await adb.get_active_broadcasts() == []
+
+
+@pytest.mark.asyncio
+async def test_waitlist_promoter_notifies_in_batches(adb_persistence):
+    """Освободившиеся места предлагаются очереди пачками, фоновая задача просыпается по wake()"""
+    adb, _ = adb_persistence
+    event_id = seed_attendees(adb.sync, 3)
+    await adb.set_event_capacity(event_id, 3)
+    user_ids = [await adb.add_user(2000 + i, f"Waiting {i}", f"w{i}@example.com", "+79991234567", "01.01.1990")
+                for i in range(5)]
+    for user_id in user_ids:
+        assert await adb.join_waitlist(user_id, event_id) >= 1
+
+    batches = []
+
+    async def send_message(chat_id, text, **kwargs):
+        batches[-1].append(chat_id)
+        if chat_id == 2001:
+            raise Forbidden("bot was blocked by the user")
+
+    bot = MagicMock(rate_limiter=None)
+    bot.send_message = AsyncMock(side_effect=send_message)
+    promoter = WaitlistPromoter(adb, sweep_interval=60, batch_size=2)
+    original_claim = adb.claim_waitlist_offers
+
+    async def claim(limit):
+        batches.append([])
+        return await original_claim(limit)
+
+    with patch.object(adb, 'claim_waitlist_offers', claim):
+        # Три места освобождаются сразу (лимит увеличен), предложения уходят пачками по 2
+        await adb.set_event_capacity(event_id, 6)
+        assert await promoter.sweep(bot) == 2
+        assert [sorted(batch) for batch in batches] == [[2000, 2001], [2002], []]
+
+        # Отказ передает место следующему; фоновая задача отправляет предложение без ожидания интервала
+        batches.clear()
+        promoter.start(bot)
+        await asyncio.sleep(0.05)
+        await adb.leave_waitlist(user_ids[0], event_id)
+        promoter.wake()
+        for _ in range(100):
+            if 2003 in sum(batches, []):
+                break
+            await asyncio.sleep(0.01)
+        await promoter.stop()
+    assert 2003 in sum(batches, [])
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("resume_broadcasts", [True, False])
+async def test_every_worker_starts_waitlist(adb_persistence, resume_broadcasts):
+    """Лист ожидания запускается в каждом процессе, рассылки продолжает только первый"""
+    adb, _ = adb_persistence
+    application = build_application(adb, worker_count=2, resume_broadcasts=resume_broadcasts)
+    with patch.object(Broadcaster, 'resume', AsyncMock(return_value=0)) as resume, \
+            patch.object(WaitlistPromoter, 'start') as start:
+        await application.post_init(application)
+    start.assert_called_once()
+    assert resume.called == resume_broadcasts
+
+
+def echo_worker(index, workers, updates, heartbeat):
+    """Тестовый рабочий процесс: записывает, какие пользователи к нему попали"""
+    heartbeat.value = time.time()
+    while True:
+        try:
+            data = updates.get(timeout=0.2)
+        except queue.Empty:
+            continue
+        if data is None:
+            return
+        text = data['message']['text']
+        if text == 'crash':
+            os._exit(1)
+        with open(text, 'a') as log:
+            log.write(f"{index} {data['message']['from']['id']}\n")
+
+
+def wait_for(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "условие не выполнилось вовремя"
+        time.sleep(0.05)
+
+
+def test_shard_for_keeps_user_on_one_worker():
+    """Обновления одного пользователя всегда попадают в один процесс"""
+    updates = [Update.de_json(make_update(i, user_id=user_id), None)
+               for i, user_id in enumerate([5, 6, 5, 7, 6, 5])]
+    shards = [shard_for(update, 3) for update in updates]
+    assert shards == [5 % 3, 6 % 3, 5 % 3, 7 % 3, 6 % 3, 5 % 3]
+
+
+def test_supervisor_routes_and_restarts_workers(tmp_path):
+    """Супервизор раздает обновления по пользователям и перезапускает упавший процесс"""
+    log_path = str(tmp_path / "shards.log")
+    supervisor = Supervisor(2, worker_target=echo_worker, queue_size=100)
+    supervisor.start_workers()
+    try:
+        for i, user_id in enumerate([10, 11, 12, 13, 10, 11]):
+            supervisor.update_queue.put_nowait(
+                Update.de_json(make_update(i, user_id=user_id, text=log_path), None)
+            )
+        wait_for(lambda: os.path.exists(log_path) and len(open(log_path).readlines()) == 6)
+
+        # Падение процесса, обслуживающего четных пользователей
+        supervisor.update_queue.put_nowait(Update.de_json(make_update(7, user_id=10, text='crash'), None))
+        wait_for(lambda: not supervisor.stats()[0]['alive'])
+        # Процесс упал вскоре после запуска, поэтому перезапуск - после паузы
+        assert supervisor.check_workers() == 0
+        wait_for(lambda: supervisor.check_workers() == 1)
+        assert supervisor.stats()[0]['restarts'] == 1
+
+        # Перезапущенный процесс продолжает получать свои обновления
+        supervisor.update_queue.put_nowait(Update.de_json(make_update(8, user_id=12, text=log_path), None))
+        wait_for(lambda: len(open(log_path).readlines()) == 7)
+    finally:
+        supervisor.shutdown_workers(timeout=10)
+
+    lines = [line.split() for line in open(log_path)]
+    assert all(int(index) == int(user_id) % 2 for index, user_id in lines)
+    assert not any(worker['alive'] for worker in supervisor.stats())
+
+
+def test_supervisor_restarts_hung_worker():
+    """Процесс без сигнала о работе дольше health_timeout перезапускается"""
+    supervisor = Supervisor(1, worker_target=echo_worker, health_timeout=0.5)
+    supervisor.start_workers()
+    try:
+        wait_for(lambda: supervisor._workers[0].heartbeat.value > 0)
+        first_pid = supervisor.stats()[0]['pid']
+        assert supervisor.check_workers() == 0
+        time.sleep(0.6)
+        assert supervisor.check_workers() == 1
+        assert supervisor.stats()[0]['pid'] != first_pid
+    finally:
+        supervisor.shutdown_workers(timeout=10)
+
+
+def test_instance_lock_allows_one_active_instance(tmp_path):
+    """Блокировку держит один экземпляр, после освобождения ее получает следующий"""
+    pid_path = str(tmp_path / "bot.pid")
+    active, waiting = InstanceLock(pid_path), InstanceLock(pid_path)
+    assert active.acquire()
+    try:
+        assert not waiting.acquire(blocking=False)
+        assert read_pid(pid_path) == os.getpid()
+    finally:
+        active.release()
+    assert waiting.acquire(blocking=False)
+    waiting.release()
+
+
+async def run_handover(tmp_path, handler_delay, drain_timeout):
+    """
+    Передача работы: новый экземпляр прогревается и ждет блокировку старого,
+    затем по SIGTERM дожидается обработчика не дольше drain_timeout
+    """
+    pid_path, ready_path = str(tmp_path / "bot.pid"), str(tmp_path / "bot.ready")
+    finished = []
+    post_stop = AsyncMock()
+
+    async def slow(update, context):
+        await asyncio.sleep(handler_delay)
+        finished.append(update.update_id)
+
+    bot_user = User(id=1, is_bot=True, first_name='Bot', username='test_bot')
+    with patch.object(Bot, '_post', AsyncMock(return_value=bot_user.to_dict())):
+        app = Application.builder().token('123:TEST').post_stop(post_stop).build()
+        app.add_handler(CommandHandler('start', slow))
+        old_instance = InstanceLock(pid_path)
+        old_instance.acquire()
+        with patch.object(app.updater, 'start_polling', AsyncMock()), \
+                patch.object(app.updater, 'stop', AsyncMock()), \
+                patch.object(Application, 'shutdown', autospec=True, side_effect=Application.shutdown) as shutdown:
+            task = asyncio.create_task(serve_polling(app, InstanceLock(pid_path), ready_path, drain_timeout))
+            while read_pid(ready_path) != os.getpid():
+                await asyncio.sleep(0.05)
+            # Готов, но пока старый экземпляр работает, обновления не получает
+            await asyncio.sleep(0.3)
+            assert not app.running
+            app.updater.start_polling.assert_not_called()
+
+            old_instance.release()
+            while not app.running:
+                await asyncio.sleep(0.05)
+            assert not os.path.exists(ready_path)
+            await app.update_queue.put(Update.de_json(make_update(1), app.bot))
+            await asyncio.sleep(0.1)
+
+            os.kill(os.getpid(), signal.SIGTERM)
+            drained = await asyncio.wait_for(task, timeout=10)
+            app.updater.stop.assert_called_once()
+            # Фоновые задачи и бот останавливаются и при истечении срока ожидания
+            post_stop.assert_awaited_once_with(app)
+            shutdown.assert_called_once_with(app)
+    return drained, finished
+
+
+@pytest.mark.asyncio
+async def test_handover_drains_handlers_before_exit(tmp_path):
+    drained, finished = await run_handover(tmp_path, handler_delay=0.5, drain_timeout=5)
+    assert drained
+    assert finished == [1]
+
+
+@pytest.mark.asyncio
+async def test_handover_stops_waiting_after_deadline(tmp_path):
+    drained, finished = await run_handover(tmp_path, handler_delay=30, drain_timeout=0.3)
+    assert not drained
+    assert finished == []
+
+
+def test_metrics_render_prometheus_text():
+    """Счетчики и гистограммы выводятся в текстовом формате Prometheus"""
+    registry = metrics.Registry()
+    requests = metrics.Counter('test_requests_total', 'Запросы', ('method',), registry=registry)
+    latency = metrics.Histogram('test_latency_seconds', 'Задержка', registry=registry, buckets=(0.1, 1.0))
+    requests.inc(method='get')
+    requests.inc(2, method='get')
+    for value in (0.05, 0.5, 3.0):
+        latency.observe(value)
+
+    text = registry.render()
+    assert '# TYPE test_requests_total counter' in text
+    assert 'test_requests_total{method="get"} 3' in text
+    assert 'test_latency_seconds_bucket{le="0.1"} 1' in text
+    assert 'test_latency_seconds_bucket{le="1"} 2' in text
+    assert 'test_latency_seconds_bucket{le="+Inf"} 3' in text
+    assert 'test_latency_seconds_count 3' in text
+    with pytest.raises(ValueError):
+        requests.inc(path='/')
+
+
+def test_database_methods_are_instrumented():
+    """Каждый метод Database учитывается в счетчиках, ошибках и гистограмме"""
+    db = Database(':memory:', pool_size=1)
+    try:
+        labels = {'component': 'database', 'method': 'export_event_registrations'}
+        calls, errors, observed = CALLS.value(**labels), ERRORS.value(**labels), LATENCY.count(**labels)
+        db.export_event_registrations(1, io.BytesIO(), fmt='csv')
+        with pytest.raises(ValueError):
+            db.export_event_registrations(1, io.BytesIO(), fmt='xml')
+        assert CALLS.value(**labels) == calls + 2
+        assert ERRORS.value(**labels) == errors + 1
+        assert LATENCY.count(**labels) == observed + 2
+    finally:
+        db.close()
+
+
+def test_metrics_endpoint_serves_conversation_gauge(tmp_path):
+    """Сервер метрик отдает число диалогов по шагам из сохраненных состояний"""
+    adb = AsyncDatabase(Database(str(tmp_path / "metrics.db"), pool_size=1), workers=1)
+    adb.sync.save_conversation_state({}, {
+        ('registration', (1, 1)): 0, ('registration', (2, 2)): 0, ('registration', (3, 3)): 4,
+    })
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    server = start_metrics(adb, port=port)
+    try:
+        response = httpx.get(f"http://127.0.0.1:{port}/metrics")
+        assert response.status_code == 200
+        assert response.headers['content-type'].startswith('text/plain')
+        assert 'bot_conversations_active{state="NAME"} 2' in response.text
+        assert 'bot_conversations_active{state="CONFIRM"} 1' in response.text
+        assert '# TYPE bot_call_duration_seconds histogram' in response.text
+        assert httpx.get(f"http://127.0.0.1:{port}/other").status_code == 404
+    finally:
+        server.shutdown()
+        server.server_close()
+        adb.close()
+
+
+@pytest.mark.asyncio
+async def test_tracing_records_handler_database_and_api_spans(tmp_path):
+    """Трасса обновления: обработчик, запрос к базе в рабочем потоке и вызов API"""
+    adb = AsyncDatabase(Database(str(tmp_path / "trace.db"), pool_size=1), workers=1)
+    ring, trace_path = RingBufferExporter(10), str(tmp_path / "traces.jsonl")
+    request = TracedRequest()
+    update = MagicMock(spec=Update)
+    update.update_id, update.effective_user.id = 42, 100
+
+    async def reply_text(*args, **kwargs):
+        return await request.do_request('https://api.telegram.org/bot1:T/sendMessage', 'POST')
+
+    update.message.reply_text = AsyncMock(side_effect=reply_text)
+    handler = RegistrationHandler(adb)
+    try:
+        with patch.object(HTTPXRequest, 'do_request', AsyncMock(return_value=(200, b'{}'))):
+            TRACER.configure(0.0, [ring])
+            await handler.my_info_command(update, MagicMock())
+            assert ring.traces() == []
+
+            TRACER.configure(1.0, [ring, JSONFileExporter(trace_path)])
+            await handler.my_info_command(update, MagicMock())
+    finally:
+        TRACER.configure(0.0, [])
+        await request.shutdown()
+        adb.close()
+
+    [trace] = ring.traces()
+    spans = {span['name']: span for span in trace['spans']}
+    root = spans['handler.my_info_command']
+    assert root['parent_id'] is None
+    assert root['attributes'] == {'update_id': 42, 'user_id': 100}
+    assert spans['db.get_user_by_telegram_id']['parent_id'] == root['span_id']
+    assert spans['api.sendMessage']['parent_id'] == root['span_id']
+    assert all(span['duration'] <= root['duration'] for span in trace['spans'])
+    with open(trace_path) as trace_file:
+        assert json.loads(trace_file.readline())['trace_id'] == trace['trace_id']
+
+
+@pytest.mark.asyncio
+async def test_profiler_captures_event_loop_work():
+    """Профиль снимается с цикла событий; второй замер одновременно не запускается"""
+    def busy_function():
+        return sum(range(10000))
+
+    async def busy():
+        while True:
+            busy_function()
+            await asyncio.sleep(0.001)
+
+    worker = asyncio.create_task(busy())
+    capture = asyncio.create_task(PROFILER.capture(0.2))
+    await asyncio.sleep(0)
+    with pytest.raises(RuntimeError):
+        await PROFILER.capture(0.1)
+    report = await capture
+    worker.cancel()
+    assert 'busy_function' in report
+    assert not PROFILER.running
+
+
+COLD_START_SCRIPT = """
+import json, sys, time
+import telegram.ext
+started = time.perf_counter()
+import bot
+print(json.dumps({'own': time.perf_counter() - started,
+                  'lazy': [name for name in %r if name in sys.modules]}))
+"""
+
+
+def test_cold_start_within_budget():
+    """Импорт bot.py сверх telegram.ext укладывается в бюджет, редкие подсистемы не загружаются"""
+    runs = []
+    for _ in range(3):
+        output = subprocess.run(
+            [sys.executable, '-c', COLD_START_SCRIPT % (LAZY_MODULES,)],
+            capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    assert runs[0]['lazy'] == []
+    # Лучший из трех запусков: не зависит от случайной нагрузки на машину
+    assert min(run['own'] for run in runs) < IMPORT_BUDGET
+
+
+def test_startup_report_phases():
+    clock = iter([10.0, 10.5, 10.75])
+    with patch('startup.time.perf_counter', lambda: next(clock)):
+        report = StartupReport()
+        report.mark("импорт модулей")
+        report.mark("база данных")
+    assert report.phases == [("импорт модулей", 0.5), ("база данных", 0.25)]
+    assert report.summary() == "импорт модулей 0.50 с, база данных 0.25 с; всего 0.75 с"
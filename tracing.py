@@ -0,0 +1,275 @@
+"""
+Трассировка обработки обновлений (обработчик, запросы к базе, вызовы API Telegram)
+и профилирование цикла событий по запросу администратора
+"""
+
+import asyncio
+import collections
+import contextvars
+import functools
+import inspect
+import io
+import json
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Deque, Dict, Iterator, List, Optional, Sequence
+
+from telegram import Update
+from telegram.request import HTTPXRequest
+
+logger = logging.getLogger(__name__)
+
+# Текущий span задачи; в рабочие потоки базы данных передается через copy_context()
+_current_span: contextvars.ContextVar[Optional['Span']] = contextvars.ContextVar('current_span', default=None)
+
+
+class Span:
+    """Интервал работы внутри трассы: имя, начало, длительность, атрибуты, ошибка"""
+
+    __slots__ = ('trace', 'span_id', 'parent_id', 'name', 'started', 'duration', 'attributes', 'error', '_start')
+
+    def __init__(self, trace: 'Trace', name: str, parent_id: Optional[int], attributes: Dict):
+        self.trace = trace
+        self.span_id = trace.next_id()
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes
+        self.started = time.time()
+        self.duration = 0.0
+        self.error: Optional[str] = None
+        self._start = time.perf_counter()
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def to_dict(self) -> Dict:
+        return {
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'started': self.started,
+            'duration': self.duration,
+            'attributes': self.attributes,
+            'error': self.error,
+        }
+
+
+class Trace:
+    """Все span одного обновления; дочерние span могут завершаться в других потоках"""
+
+    __slots__ = ('trace_id', 'spans', '_lock', '_ids')
+
+    def __init__(self):
+        self.trace_id = os.urandom(8).hex()
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+        self._ids = 0
+
+    def next_id(self) -> int:
+        with self._lock:
+            self._ids += 1
+            return self._ids
+
+    def add(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span.span_id)
+        return {'trace_id': self.trace_id, 'spans': [span.to_dict() for span in spans]}
+
+
+class RingBufferExporter:
+    """Последние size трасс в памяти"""
+
+    def __init__(self, size: int = 100):
+        self._traces: Deque[Dict] = collections.deque(maxlen=size)
+
+    def export(self, trace: Dict):
+        self._traces.append(trace)
+
+    def traces(self) -> List[Dict]:
+        return list(self._traces)
+
+
+class JSONFileExporter:
+    """Трассы в файл, по одному JSON-объекту в строке"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, trace: Dict):
+        line = json.dumps(trace, ensure_ascii=False, default=str) + '\n'
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as trace_file:
+                trace_file.write(line)
+
+
+class Tracer:
+    """
+    Трассировщик: корневой span открывает обработчик обновления с вероятностью
+    sample_rate, вложенные span (запросы к базе, вызовы API) записываются только
+    внутри выбранной трассы. Без активной трассы обертки сразу вызывают функцию.
+    Завершенная трасса передается всем экспортерам (объектам с методом export(dict)).
+    """
+
+    def __init__(self, sample_rate: float = 0.0, exporters: Sequence = (),
+                 rng: Callable[[], float] = random.random):
+        self.sample_rate = sample_rate
+        self.exporters = list(exporters)
+        self._rng = rng
+
+    def configure(self, sample_rate: float, exporters: Sequence):
+        self.sample_rate = sample_rate
+        self.exporters = list(exporters)
+
+    @staticmethod
+    def active() -> bool:
+        return _current_span.get() is not None
+
+    @contextmanager
+    def span(self, name: str, root: bool = False, **attributes) -> Iterator[Optional[Span]]:
+        """
+        Span внутри текущей трассы. root=True начинает новую трассу, если
+        активной нет и обновление попало в выборку; иначе span не записывается.
+        """
+        parent = _current_span.get()
+        if parent is None:
+            if not root or not self.sample_rate or self._rng() >= self.sample_rate:
+                yield None
+                return
+            trace = Trace()
+            span = Span(trace, name, None, attributes)
+        else:
+            trace = parent.trace
+            span = Span(trace, name, parent.span_id, attributes)
+
+        token = _current_span.set(span)
+        try:
+            yield span
+        except Exception as exc:
+            span.error = f"{type(exc).__name__}: {exc}"
+            raise
+        finally:
+            span.duration = time.perf_counter() - span._start
+            _current_span.reset(token)
+            trace.add(span)
+            if parent is None:
+                self._export(trace)
+
+    def _export(self, trace: Trace):
+        data = trace.to_dict()
+        for exporter in self.exporters:
+            try:
+                exporter.export(data)
+            except Exception:
+                logger.exception(f"Ошибка экспорта трассы {trace.trace_id}")
+
+
+TRACER = Tracer()
+
+
+def _update_attributes(args) -> Dict:
+    """Номер обновления и пользователь - атрибуты корневого span обработчика"""
+    for arg in args:
+        if isinstance(arg, Update):
+            user = arg.effective_user
+            return {'update_id': arg.update_id, 'user_id': user.id if user else None}
+    return {}
+
+
+def traced(name: str, root: bool = False, tracer: Tracer = TRACER) -> Callable:
+    """Декоратор функции или корутины: вызов записывается как span с именем name"""
+    def decorator(func: Callable) -> Callable:
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if not root and _current_span.get() is None:
+                    return await func(*args, **kwargs)
+                with tracer.span(name, root=root, **(_update_attributes(args) if root else {})):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not root and _current_span.get() is None:
+                return func(*args, **kwargs)
+            with tracer.span(name, root=root):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def trace_class(component: str, root: bool = False) -> Callable[[type], type]:
+    """
+    Декоратор класса: публичные методы и корутины записываются как span
+    <component>.<метод>. root=True - методы класса открывают трассу обновления
+    (обработчики); иначе они записываются только внутри уже открытой трассы.
+    """
+    def decorator(cls: type) -> type:
+        for name, attribute in list(vars(cls).items()):
+            if (name.startswith('_') or not inspect.isfunction(attribute)
+                    or inspect.isgeneratorfunction(attribute)):
+                continue
+            is_root = root and inspect.iscoroutinefunction(attribute)
+            setattr(cls, name, traced(f"{component}.{name}", root=is_root)(attribute))
+        return cls
+    return decorator
+
+
+class TracedRequest(HTTPXRequest):
+    """HTTPXRequest, записывающий каждый вызов API Telegram как span api.<метод>"""
+
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        if _current_span.get() is None:
+            return await super().do_request(url, method, *args, **kwargs)
+        with TRACER.span(f"api.{url.rsplit('/', 1)[-1]}"):
+            return await super().do_request(url, method, *args, **kwargs)
+
+
+class Profiler:
+    """Снятие профиля cProfile с цикла событий бота на заданное время"""
+
+    def __init__(self):
+        self._running = False
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    async def capture(self, seconds: float, limit: int = 40) -> str:
+        """
+        Профиль всего, что выполнялось в потоке цикла событий за seconds секунд
+        (обработчики, планировщик, PTB); запросы к базе идут в своих потоках и
+        видны как ожидание. Возвращает отчет pstats по суммарному времени.
+        """
+        if self._running:
+            raise RuntimeError("Профилирование уже выполняется")
+        # Профилировщик нужен только по команде администратора
+        import cProfile
+        import pstats
+        
+        self._running = True
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                profile.disable()
+        finally:
+            self._running = False
+
+        output = io.StringIO()
+        stats = pstats.Stats(profile, stream=output)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(limit)
+        return output.getvalue()
+
+
+PROFILER = Profiler()
@@ -0,0 +1,221 @@
+"""
+Проверка и нормализация данных регистрации: имя, email, телефон, дата рождения.
+Одни и те же правила используются в диалоге регистрации и при массовой загрузке.
+"""
+
+import re
+from itertools import islice
+from datetime import date, datetime
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+# Коды ошибок проверки
+ERROR_EMPTY = 'empty'
+ERROR_TOO_LONG = 'too_long'
+ERROR_FORMAT = 'format'
+ERROR_DATE = 'date'
+ERROR_FUTURE = 'future'
+
+MAX_NAME_LENGTH = 200
+# Сколько первых значений столбца validate_column проверяет на повторы
+MEMO_PROBE = 1000
+
+_SPACES = re.compile(r'\s+')
+_EMAIL = re.compile(r'[^@\s]+@[^@\s]+\.[^@\s]+')
+_PHONE = re.compile(r'\+?[1-9]\d{3,14}')
+_BIRTH_DATE = re.compile(r'(\d{2})\.(\d{2})\.(\d{4})')
+# Разделители, которые пользователи вводят в номерах телефонов: удаляются одним проходом
+_PHONE_SEPARATORS = str.maketrans('', '', ' -()')
+
+
+class ValidationResult(NamedTuple):
+    """Нормализованное значение или код ошибки"""
+    value: Optional[str]
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def _failed(error: str) -> ValidationResult:
+    return ValidationResult(None, error)
+
+
+def validate_name(raw: str) -> ValidationResult:
+    """Полное имя: лишние пробелы убираются"""
+    name = _SPACES.sub(' ', raw).strip()
+    if not name:
+        return _failed(ERROR_EMPTY)
+    if len(name) > MAX_NAME_LENGTH:
+        return _failed(ERROR_TOO_LONG)
+    return ValidationResult(name)
+
+
+def validate_email(raw: str) -> ValidationResult:
+    email = raw.strip()
+    if not email:
+        return _failed(ERROR_EMPTY)
+    if not _EMAIL.fullmatch(email):
+        return _failed(ERROR_FORMAT)
+    return ValidationResult(email)
+
+
+def validate_phone(raw: str) -> ValidationResult:
+    """
+    Телефон: пробелы, дефисы и скобки удаляются, остальное не меняется
+    ("8 (999) 123-45-67" -> "89991234567", код страны не подставляется)
+    """
+    phone = raw.strip().translate(_PHONE_SEPARATORS)
+    if not phone:
+        return _failed(ERROR_EMPTY)
+    if not _PHONE.fullmatch(phone):
+        return _failed(ERROR_FORMAT)
+    return ValidationResult(phone)
+
+
+def validate_birth_date(raw: str, today: Optional[date] = None) -> ValidationResult:
+    """Дата рождения в формате ДД.ММ.ГГГГ, существующая и не в будущем"""
+    birth_date = raw.strip()
+    if not birth_date:
+        return _failed(ERROR_EMPTY)
+    match = _BIRTH_DATE.fullmatch(birth_date)
+    if not match:
+        return _failed(ERROR_FORMAT)
+    day, month, year = map(int, match.groups())
+    try:
+        parsed = date(year, month, day)
+    except ValueError:
+        return _failed(ERROR_DATE)
+    if parsed > (today or datetime.now().date()):
+        return _failed(ERROR_FUTURE)
+    return ValidationResult(birth_date)
+
+
+# Правила по полям пользователя (порядок - как в Database.add_users_bulk)
+RULES: Dict[str, Callable[[str], ValidationResult]] = {
+    'full_name': validate_name,
+    'email': validate_email,
+    'phone': validate_phone,
+    'birth_date': validate_birth_date,
+}
+
+
+def validate_column(field: str, values: Iterable[str]) -> List[ValidationResult]:
+    """
+    Проверка всего столбца одним проходом. Результаты те же, что у поштучной
+    проверки; текущая дата берется один раз. Повторяющиеся значения (даты
+    рождения, одинаковые номера из выгрузок) проверяются один раз. Если среди
+    первых MEMO_PROBE значений повторов почти нет (email, имена), запоминание
+    отключается: на уникальных данных оно только замедляет проверку.
+    """
+    rule = RULES[field]
+    if field == 'birth_date':
+        today = datetime.now().date()
+        rule = lambda raw: validate_birth_date(raw, today)  # noqa: E731
+    memo: Dict[str, ValidationResult] = {}
+    results: List[ValidationResult] = []
+    append = results.append
+    values = iter(values)
+    for raw in islice(values, MEMO_PROBE):
+        result = memo.get(raw)
+        if result is None:
+            result = memo[raw] = rule(raw)
+        append(result)
+    if len(memo) * 4 > len(results) * 3:
+        results.extend(map(rule, values))
+        return results
+    for raw in values:
+        result = memo.get(raw)
+        if result is None:
+            result = memo[raw] = rule(raw)
+        append(result)
+    return results
+
+
+# Разбор регистрации одним сообщением: подписи полей ("Email: ...") и поиск
+# значений в свободном тексте
+FIELD_LABELS = {
+    'имя': 'full_name', 'фио': 'full_name', 'полное имя': 'full_name', 'name': 'full_name',
+    'email': 'email', 'e-mail': 'email', 'почта': 'email', 'эл. почта': 'email',
+    'телефон': 'phone', 'тел': 'phone', 'тел.': 'phone', 'номер': 'phone', 'phone': 'phone',
+    'дата рождения': 'birth_date', 'др': 'birth_date', 'дата': 'birth_date', 'birth date': 'birth_date',
+}
+_LABELED = re.compile(r'\s*([^:\n]{1,20}?)\s*:\s*(.*)')
+_FIND_EMAIL = re.compile(r'[^@\s,;]+@[^@\s,;]+')
+_FIND_DATE = re.compile(r'(?<![\d.])(\d{1,2})[./-](\d{1,2})[./-](\d{4})(?![\d.])')
+_FIND_PHONE = re.compile(r'\+?\d[\d ()\-]{5,}\d')
+_LEFTOVER_SEPARATORS = re.compile(r'[,;\n]+')
+
+
+def _normalize_date(raw: str) -> str:
+    """1.2.1990, 01/02/1990, 01-02-1990 -> 01.02.1990"""
+    match = _FIND_DATE.fullmatch(raw.strip())
+    if not match:
+        return raw
+    day, month, year = match.groups()
+    return f"{day:0>2}.{month:0>2}.{year}"
+
+
+def parse_registration(text: str) -> Tuple[Dict[str, str], Dict[str, str]]:
+    """
+    Разбор всех полей регистрации из одного сообщения. Понимает строки с
+    подписями ("Телефон: +7 999 123-45-67") и свободный текст, в котором email,
+    дата рождения и телефон находятся по виду, а остаток считается именем.
+    Возвращает нормализованные корректные значения и ошибки найденных, но
+    некорректных полей ({поле: код ошибки}); отсутствующих полей нет ни там, ни там.
+    """
+    raw: Dict[str, str] = {}
+    free_lines = []
+    for line in text.splitlines():
+        labeled = _LABELED.fullmatch(line)
+        field = FIELD_LABELS.get(labeled.group(1).lower()) if labeled else None
+        if field:
+            raw[field] = labeled.group(2)
+        else:
+            free_lines.append(line)
+
+    free = '\n'.join(free_lines)
+    # Порядок важен: цифры даты не должны приниматься за телефон
+    for field, pattern in (('email', _FIND_EMAIL), ('birth_date', _FIND_DATE), ('phone', _FIND_PHONE)):
+        match = pattern.search(free)
+        if match is None:
+            continue
+        if field not in raw:
+            raw[field] = match.group(0)
+        free = free[:match.start()] + '\n' + free[match.end():]
+    if 'full_name' not in raw:
+        name = _LEFTOVER_SEPARATORS.sub(' ', free).strip()
+        if name:
+            raw['full_name'] = name
+
+    if 'birth_date' in raw:
+        raw['birth_date'] = _normalize_date(raw['birth_date'])
+    values, errors = {}, {}
+    for field, value in raw.items():
+        result = RULES[field](value)
+        if result.ok:
+            values[field] = result.value
+        else:
+            errors[field] = result.error
+    return values, errors
+
+
+def validate_users(users: Sequence, fields: Sequence[str] = ('full_name', 'email', 'phone', 'birth_date'),
+                   ) -> Tuple[List[Dict], List[Tuple[int, str, str]]]:
+    """
+    Проверка записей для массовой загрузки (словари с полями пользователя).
+    Каждый столбец проверяется validate_column. Возвращает нормализованные
+    корректные записи и ошибки (номер записи, поле, код ошибки).
+    """
+    columns = {field: validate_column(field, [user[field] for user in users]) for field in fields}
+    valid, errors = [], []
+    for index, user in enumerate(users):
+        failed = False
+        for field in fields:
+            result = columns[field][index]
+            if result.error:
+                errors.append((index, field, result.error))
+                failed = True
+        if not failed:
+            valid.append({**user, **{field: columns[field][index].value for field in fields}})
+    return valid, errors
@@ -0,0 +1,105 @@
+"""
+Лист ожидания: снятие истекших предложений мест и отправка новых предложений
+"""
+
+import asyncio
+import logging
+from datetime import datetime
+from typing import Optional
+
+from telegram import Bot, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import TelegramError
+
+from async_database import AsyncDatabase
+from constants import WAITLIST_OFFER, WAITLIST_CONFIRM_BUTTON, WAITLIST_DECLINE_BUTTON
+from records import WaitlistOfferRecord
+
+logger = logging.getLogger(__name__)
+
+# Как часто проверять истекшие предложения (секунды) и сколько предложений
+# отправлять за один раз
+WAITLIST_SWEEP_INTERVAL = 30.0
+WAITLIST_NOTIFY_BATCH = 50
+
+# Кнопки предложения: wl:y:<ID мероприятия> - подтвердить, wl:n:<ID> - отказаться
+WAITLIST_CALLBACK_PATTERN = r'^wl:'
+
+
+class WaitlistPromoter:
+    """
+    Фоновая задача листа ожидания. Места предлагаются следующим в очереди
+    в той же транзакции, что их освобождает (Database.cancel_registration,
+    expire_waitlist_offers и т.д.); здесь периодически снимаются истекшие
+    предложения и рассылаются новые - пачками по batch_size сообщений,
+    отправляемых параллельно (темп задает планировщик отправки).
+    wake() запускает проверку сразу, не дожидаясь интервала.
+    """
+
+    def __init__(self, db: AsyncDatabase, sweep_interval: float = WAITLIST_SWEEP_INTERVAL,
+                 batch_size: int = WAITLIST_NOTIFY_BATCH):
+        self.db = db
+        self.sweep_interval = sweep_interval
+        self.batch_size = batch_size
+        self._task: Optional[asyncio.Task] = None
+        self._wake = asyncio.Event()
+
+    def start(self, bot: Bot) -> asyncio.Task:
+        """Запуск фоновой задачи"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run(bot), name='waitlist')
+        return self._task
+
+    def wake(self):
+        """Немедленная проверка: место освободилось или пользователь отказался"""
+        self._wake.set()
+
+    async def stop(self):
+        """Остановка; неотправленные предложения будут отправлены после запуска"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def run(self, bot: Bot):
+        """Цикл проверок до остановки"""
+        while True:
+            try:
+                await self.sweep(bot)
+            except Exception:
+                logger.exception("Ошибка обработки листа ожидания")
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.sweep_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    async def sweep(self, bot: Bot) -> int:
+        """Снятие истекших предложений и отправка новых; возвращает число отправленных"""
+        await self.db.expire_waitlist_offers()
+        sent = 0
+        while True:
+            offers = await self.db.claim_waitlist_offers(self.batch_size)
+            if not offers:
+                return sent
+            results = await asyncio.gather(*(self._send(bot, offer) for offer in offers))
+            sent += sum(results)
+
+    @staticmethod
+    async def _send(bot: Bot, offer: WaitlistOfferRecord) -> bool:
+        """Предложение места с кнопками подтверждения и отказа"""
+        deadline = datetime.fromtimestamp(offer.offered_until).strftime('%H:%M %d.%m.%Y')
+        keyboard = InlineKeyboardMarkup([[
+            InlineKeyboardButton(WAITLIST_CONFIRM_BUTTON, callback_data=f"wl:y:{offer.event_id}"),
+            InlineKeyboardButton(WAITLIST_DECLINE_BUTTON, callback_data=f"wl:n:{offer.event_id}"),
+        ]])
+        try:
+            await bot.send_message(
+                chat_id=offer.telegram_id,
+                text=WAITLIST_OFFER.format(title=offer.title, deadline=deadline),
+                reply_markup=keyboard
+            )
+            return True
+        except TelegramError as exc:
+            # Место останется за пользователем до конца срока, затем перейдет следующему
+            logger.warning(f"Не удалось отправить предложение места пользователю {offer.telegram_id}: {exc}")
+            return False
@@ -0,0 +1,233 @@
+"""
+Прием обновлений Telegram через webhook вместо long polling
+"""
+
+import asyncio
+import hmac
+import json
+import logging
+import queue
+import re
+import signal
+import ssl
+from typing import Optional, Tuple
+
+from telegram import Update
+from telegram.ext import Application
+
+logger = logging.getLogger(__name__)
+
+SECRET_TOKEN_HEADER = 'x-telegram-bot-api-secret-token'
+# Допустимый секретный токен по правилам Bot API (setWebhook)
+SECRET_TOKEN_PATTERN = re.compile(r'[A-Za-z0-9_-]{1,256}')
+
+HTTP_STATUSES = {
+    200: 'OK',
+    400: 'Bad Request',
+    403: 'Forbidden',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    413: 'Payload Too Large',
+    503: 'Service Unavailable',
+}
+
+
+class WebhookServer:
+    """
+    Встроенный HTTP-сервер для webhook Telegram на asyncio.
+    Проверяет секретный токен из заголовка X-Telegram-Bot-Api-Secret-Token
+    (без токена сервер не запускается: иначе любой, кто видит порт, может
+    прислать обновление от имени администратора) и кладет обновления в application.update_queue. Если необработанных
+    обновлений уже max_backlog (в очереди и у обработчика обновлений),
+    отвечает 503 - Telegram повторит доставку позже, а память бота не растет
+    без ограничений.
+    """
+
+    def __init__(self, application: Application, listen: str = '0.0.0.0', port: int = 8443,
+                 url_path: str = '/telegram', secret_token: str = '',
+                 max_backlog: int = 1000, max_body_size: int = 1024 * 1024,
+                 ssl_context: Optional[ssl.SSLContext] = None):
+        if not secret_token or not SECRET_TOKEN_PATTERN.fullmatch(secret_token):
+            raise ValueError("Для режима webhook нужен секретный токен WEBHOOK_SECRET_TOKEN "
+                             "(1-256 символов: A-Z, a-z, 0-9, _ и -)")
+        self.application = application
+        self.listen = listen
+        self.port = port
+        self.url_path = url_path
+        self.secret_token = secret_token
+        self.max_backlog = max_backlog
+        self.max_body_size = max_body_size
+        self.ssl_context = ssl_context
+        self._server: Optional[asyncio.AbstractServer] = None
+        # Счетчики для мониторинга
+        self.accepted = 0
+        self.rejected = 0
+
+    async def start(self):
+        """Запуск сервера; при port=0 реальный порт доступен в self.port"""
+        self._server = await asyncio.start_server(
+            self._handle_connection, self.listen, self.port, ssl=self.ssl_context
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info(f"Webhook-сервер слушает {self.listen}:{self.port}{self.url_path}")
+
+    async def stop(self):
+        """Остановка приема новых соединений"""
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+            logger.info("Webhook-сервер остановлен")
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Обработка соединения (с поддержкой keep-alive)"""
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                status = self._process(method, path, headers, body)
+                keep_alive = headers.get('connection', '').lower() != 'close' and status != 413
+                self._write_response(writer, status, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> Optional[Tuple[str, str, dict, bytes]]:
+        """Чтение одного HTTP-запроса; None, если клиент закрыл соединение"""
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        method, path, _ = request_line.decode('latin-1').split(' ', 2)
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        length = int(headers.get('content-length', 0))
+        if length > self.max_body_size:
+            return method, path, {'connection': 'close', 'content-length': str(length)}, b''
+        body = await reader.readexactly(length) if length else b''
+        return method, path.split('?', 1)[0], headers, body
+
+    def _process(self, method: str, path: str, headers: dict, body: bytes) -> int:
+        """Проверка запроса и постановка обновления в очередь; возвращает HTTP-статус"""
+        if path != self.url_path:
+            return self._reject(404)
+        if method != 'POST':
+            return self._reject(405)
+        if int(headers.get('content-length', 0)) > self.max_body_size:
+            return self._reject(413)
+        if not hmac.compare_digest(
+            headers.get(SECRET_TOKEN_HEADER, '').encode(), self.secret_token.encode()
+        ):
+            logger.warning("Webhook: запрос с неверным секретным токеном отклонен")
+            return self._reject(403)
+        if self.backlog() >= self.max_backlog:
+            logger.warning("Webhook: очередь обновлений переполнена, Telegram повторит доставку")
+            return self._reject(503)
+
+        try:
+            payload = json.loads(body)
+            # Обновление Telegram - JSON-объект; массив или строку de_json не разберет
+            if not isinstance(payload, dict):
+                raise ValueError(f"ожидался объект, получен {type(payload).__name__}")
+            update = Update.de_json(payload, self.application.bot)
+        except (ValueError, TypeError, KeyError) as exc:
+            logger.warning(f"Webhook: не удалось разобрать обновление: {exc}")
+            return self._reject(400)
+        if update is None:
+            return self._reject(400)
+
+        try:
+            self.application.update_queue.put_nowait(update)
+        except (asyncio.QueueFull, queue.Full):
+            return self._reject(503)
+        self.accepted += 1
+        return 200
+
+    def backlog(self) -> int:
+        """
+        Принятые, но еще не обработанные обновления. При параллельной обработке
+        Application сразу забирает их из update_queue, поэтому к длине очереди
+        добавляются обновления, которые держит обработчик (PerUserUpdateProcessor.pending)
+        """
+        processor = getattr(self.application, 'update_processor', None)
+        return self.application.update_queue.qsize() + getattr(processor, 'pending', 0)
+
+    def _reject(self, status: int) -> int:
+        self.rejected += 1
+        return status
+
+    @staticmethod
+    def _write_response(writer: asyncio.StreamWriter, status: int, keep_alive: bool):
+        """Отправка пустого ответа с указанным статусом"""
+        writer.write(
+            f"HTTP/1.1 {status} {HTTP_STATUSES[status]}\r\n"
+            f"Content-Length: 0\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+            f"\r\n".encode('latin-1')
+        )
+
+
+async def run_webhook(application: Application, webhook_url: str, listen: str = '0.0.0.0',
+                      port: int = 8443, url_path: str = '/telegram',
+                      secret_token: str = '', max_backlog: int = 1000,
+                      cert_file: Optional[str] = None, key_file: Optional[str] = None):
+    """
+    Запуск бота в режиме webhook до получения SIGINT/SIGTERM.
+    webhook_url - публичный HTTPS-адрес, по которому Telegram доступен этот сервер
+    (без url_path). Если TLS завершается на прокси, cert_file/key_file не нужны.
+    """
+    ssl_context = None
+    if cert_file:
+        ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        ssl_context.load_cert_chain(cert_file, key_file)
+
+    server = WebhookServer(application, listen, port, url_path, secret_token,
+                           max_backlog, ssl_context=ssl_context)
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            # Windows: остановка по Ctrl+C через KeyboardInterrupt
+            pass
+
+    async with application:
+        # run_polling вызывает эти обработчики сам, здесь - вручную
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        await server.start()
+        certificate = open(cert_file, 'rb') if cert_file else None
+        try:
+            await application.bot.set_webhook(
+                url=webhook_url.rstrip('/') + url_path,
+                certificate=certificate,
+                secret_token=secret_token,
+                allowed_updates=Update.ALL_TYPES,
+            )
+        finally:
+            if certificate:
+                certificate.close()
+        logger.info("Бот работает в режиме webhook")
+
+        try:
+            await stop_event.wait()
+        finally:
+            await server.stop()
+            await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)